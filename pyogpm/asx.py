@@ -11,6 +11,8 @@
 
 from collections import namedtuple
 
+from pattern import Extra
+
 PrintStmt = namedtuple('PrintStmt', ['args'])
 AssignStmt = namedtuple('AssignStmt', ['lexpr', 'expr'])
 IfStmt = namedtuple('IfStmt', ['expr', 'then_stmt', 'else_stmt'])
@@ -20,14 +22,20 @@ BlockStmt = namedtuple('BlockStmt', ['stmts'])
 VarDecl = namedtuple('VarDecl', ['label', 'cla'])
 VarEnd = namedtuple('VarEnd', ['label'])
 
-VarExpr = namedtuple('VarExpr', ['label'])
+class VarExpr(namedtuple('VarExpr', ['label'])):
+    'depth is set by tc_var to the scope depth of label, None if it differs between uses'
+    depth = None
+
 AttrExpr = namedtuple('AttrExpr', ['expr', 'label'])
 OpExpr = namedtuple('OpExpr', ['op', 'args'])
 NewExpr = namedtuple('NewExpr', ['cla'])
 AndExpr = namedtuple('AndExpr', ['left', 'right'])
 OrExpr = namedtuple('OrExpr', ['left', 'right'])
 
-Program = namedtuple('Program', ['block'])
+class Program(namedtuple('Program', ['block', 'extra'])):
+    'extra keeps what the back ends compile block to'
+    def __new__(cls, block, extra = None):
+        return super().__new__(cls, block, Extra() if extra is None else extra)
 
 
 ##
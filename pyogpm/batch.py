@@ -0,0 +1,259 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    batch execution of a program over many input records
+
+'''
+
+from subtype import Value
+
+from graph import (
+    init_state_graph,
+    swing_state,
+    box_value)
+
+from asx import (
+    AssignStmt,
+    IfStmt,
+    WhileStmt,
+    PrintStmt,
+    BlockStmt,
+    VarDecl,
+    VarEnd,
+    VarExpr,
+    OpExpr,
+    AndExpr,
+    OrExpr)
+
+from op import (
+    Unbatchable,
+    numpy,
+    pack_values,
+    invoke_batch_op)
+
+from st import st_program
+
+class Column:
+    '''
+        a variable across the lanes it is declared in. nothing is
+        stored until the first assignment, which fixes the dtype when
+        it covers every declared lane.
+    '''
+    def __init__(self, n, lanes):
+        self.n = n
+        self.lanes = lanes
+        self.xs = None
+
+    def read(self, idx):
+        if self.xs is None:
+            return numpy.full(len(idx), None, dtype = object)
+        return self.xs[idx]
+
+    def write(self, idx, ys):
+        if self.xs is None:
+            if len(idx) == self.lanes:
+                self.xs = numpy.empty(self.n, dtype = ys.dtype)
+            else:
+                self.xs = numpy.full(self.n, None, dtype = object)
+        elif self.xs.dtype != ys.dtype and self.xs.dtype != object:
+            self.xs = self.xs.astype(object)
+        self.xs[idx] = ys
+
+def values(xs):
+    'null lanes fail as value_of does in scalar mode'
+    if xs.dtype == object and (xs == None).any():
+        raise Unbatchable()
+    return xs
+
+def truth(xs):
+    return values(xs) == True
+
+def bt_value(x, env, idx):
+    return pack_values([x.value] * len(idx))
+
+def column(env, la):
+    'undeclared variables fail as find_var does in scalar mode'
+    cs = env.get(la)
+    if not cs:
+        raise Unbatchable()
+    return cs[-1]
+
+def bt_var(x, env, idx):
+    return column(env, x.label).read(idx)
+
+def bt_op(x, env, idx):
+    la, args = x
+    return invoke_batch_op(la, [values(bt_expr(arg, env, idx)) for arg in args])
+
+def bt_and_or(x, env, idx, carry):
+    left, right = x
+    xs = bt_expr(left, env, idx)
+    sel = truth(xs) == carry
+    if not sel.any():
+        return xs
+
+    ys = bt_expr(right, env, idx[sel])
+    if xs.dtype != ys.dtype:
+        xs = xs.astype(object)
+    xs[sel] = ys
+    return xs
+
+def bt_and(x, env, idx):
+    return bt_and_or(x, env, idx, True)
+
+def bt_or(x, env, idx):
+    return bt_and_or(x, env, idx, False)
+
+EXPR_TAB = {
+    Value: bt_value,
+    VarExpr: bt_var,
+    OpExpr: bt_op,
+    AndExpr: bt_and,
+    OrExpr: bt_or}
+
+def bt_expr(x, env, idx):
+    return EXPR_TAB[type(x)](x, env, idx)
+
+def lane_str(v):
+    if v is None:
+        return 'null'
+    return str(v)
+
+def bt_print(pr, env, idx, out):
+    cols = [bt_expr(x, env, idx).tolist() for x in pr.args]
+    for k, i in enumerate(idx.tolist()):
+        out[i].append(', '.join([lane_str(c[k]) for c in cols]))
+
+def bt_assign(s, env, idx, out):
+    lx, x = s
+    column(env, lx.label).write(idx, bt_expr(x, env, idx))
+
+def bt_if(s, env, idx, out):
+    x, thens, elses = s
+    c = truth(bt_expr(x, env, idx))
+    if c.any():
+        bt_stmt(thens, env, idx[c], out)
+    if not c.all():
+        bt_stmt(elses, env, idx[~c], out)
+
+def bt_while(s, env, idx, out):
+    x, ws = s
+    idx = idx[truth(bt_expr(x, env, idx))]
+    while len(idx):
+        bt_stmt(ws, env, idx, out)
+        idx = idx[truth(bt_expr(x, env, idx))]
+
+def bt_block(blk, env, idx, out):
+    for s in blk.stmts:
+        if type(s) is VarDecl:
+            env.setdefault(s.label, []).append(Column(len(out), len(idx)))
+        elif type(s) is VarEnd:
+            env[s.label].pop()
+        else:
+            bt_stmt(s, env, idx, out)
+
+STMT_TAB = {
+    AssignStmt: bt_assign,
+    IfStmt: bt_if,
+    WhileStmt: bt_while,
+    PrintStmt: bt_print,
+    BlockStmt: bt_block}
+
+def bt_stmt(s, env, idx, out):
+    STMT_TAB[type(s)](s, env, idx, out)
+
+def check_expr(x):
+    if type(x) not in EXPR_TAB:
+        raise Unbatchable()
+
+    if type(x) is OpExpr:
+        for arg in x.args:
+            check_expr(arg)
+    elif type(x) in {AndExpr, OrExpr}:
+        check_expr(x.left)
+        check_expr(x.right)
+
+def check_stmt(s):
+    'only variables and values, no objects and no matching'
+    if type(s) is BlockStmt:
+        for s1 in s.stmts:
+            if type(s1) not in {VarDecl, VarEnd}:
+                check_stmt(s1)
+    elif type(s) is AssignStmt:
+        if type(s.lexpr) is not VarExpr:
+            raise Unbatchable()
+        check_expr(s.expr)
+    elif type(s) is IfStmt:
+        check_expr(s.expr)
+        check_stmt(s.then_stmt)
+        check_stmt(s.else_stmt)
+    elif type(s) is WhileStmt:
+        check_expr(s.expr)
+        check_stmt(s.stmt)
+    elif type(s) is PrintStmt:
+        for x in s.args:
+            check_expr(x)
+    else:
+        raise Unbatchable()
+
+def batchable(prog, records):
+    if numpy is None:
+        return False
+
+    try:
+        check_stmt(prog.block)
+    except Unbatchable:
+        return False
+
+    return all(type(v) is Value for rec in records for v in rec.values())
+
+def bt_program(prog, records):
+    'output lines per record'
+    out = [[] for rec in records]
+    env = {}
+    for la in set(la for rec in records for la in rec):
+        if not all(la in rec for rec in records):
+            raise Unbatchable()
+        c = Column(len(records), len(records))
+        c.write(numpy.arange(len(records)), pack_values([rec[la].value for rec in records]))
+        env[la] = [c]
+
+    bt_block(prog.block, env, numpy.arange(len(records)), out)
+    return out
+
+def scalar_program(prog, records, policy = None):
+    'one fresh state graph per record, inputs bound in the root scope'
+    for rec in records:
+        sg = init_state_graph()
+        for la, v in rec.items():
+            swing_state(sg, sg.layout.root, la, box_value(sg, v))
+        st_program(prog, sg, policy)
+
+def batch_program(prog, records, policy = None):
+    '''
+        value-only programs run once with a lane per record, with
+        masks for branches and loops. anything else, and any lane
+        that would fail, runs record by record through st_program.
+    '''
+    if batchable(prog, records):
+        try:
+            out = bt_program(prog, records)
+        except Unbatchable:
+            out = None
+        if out is not None:
+            for lines in out:
+                for line in lines:
+                    print(line)
+            return True
+
+    scalar_program(prog, records, policy)
+    return False
+
+
+##
+## end of batch.py
+##$Id$
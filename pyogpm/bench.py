@@ -0,0 +1,578 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    benchmarks
+
+'''
+
+import io
+import os
+import time
+import tempfile
+import random
+import tracemalloc
+from contextlib import redirect_stdout
+
+from subtype import (
+    Tag,
+    Lazy,
+    Cla,
+    INT_TYPE,
+    BOOL_TYPE,
+    subtype,
+    subtype_uncached,
+    SUBTYPE_MEMO,
+    Value,
+    ValueSet,
+    IntRange)
+
+from graph import (
+    Label,
+    LayoutGraph,
+    PatternGraph,
+    Edges,
+    StateGraph,
+    NODE_FACTORY,
+    new_node,
+    cons_match,
+    init_state_graph,
+    add_object_to_state,
+    add_value_to_state,
+    swing_state,
+    find_attr,
+    gc_state,
+    extract_pattern,
+    view_pattern,
+    index_state,
+    cons_pattern_graph)
+
+from pattern import (
+    LabeledPattern,
+    PatternRef,
+    ClassPattern,
+    Case,
+    Extra,
+    MatchStmt)
+
+from mc import (
+    compile_pattern,
+    compile_match)
+
+from asx import (
+    VarDecl,
+    VarEnd,
+    VarExpr,
+    AssignStmt,
+    WhileStmt,
+    PrintStmt,
+    BlockStmt,
+    OpExpr,
+    Program)
+
+from tc import (
+    Env,
+    tc_program)
+
+from st import (
+    match_cases,
+    st_program)
+
+import cc
+import vm
+import batch
+import query
+import rete
+import checkpoint
+
+from gcpolicy import (
+    Never,
+    EveryAllocs)
+
+from mcache import MatchCache
+
+from compact import init_compact_state_graph
+
+from persistent import init_persistent_state_graph
+
+def timed(f, *args):
+    t = time.perf_counter()
+    r = f(*args)
+    return (r, time.perf_counter() - t)
+
+BENCH_NODE_LZ = Lazy(Tag('BenchNode'))
+BENCH_NODE = Cla(BENCH_NODE_LZ.tag,
+    [],
+    {
+        Label('e'): INT_TYPE,
+        Label('next'): BENCH_NODE_LZ
+    }).resolve_lazy()
+
+def build_list(sg, n):
+    e = Label('e')
+    nx = Label('next')
+    p = sg.layout.root
+    q = add_object_to_state(sg, BENCH_NODE)
+    swing_state(sg, p, nx, q)
+    for i in range(n):
+        swing_state(sg, q, e, add_value_to_state(sg, Value(INT_TYPE, i)))
+        q2 = add_object_to_state(sg, BENCH_NODE)
+        swing_state(sg, q, nx, q2)
+        q = q2
+    return gc_state(sg)
+
+def hierarchy(n, prefix = 'H'):
+    'class i inherits from classes i-1, i-2 and i/2'
+    clas = []
+    for i in range(n):
+        supers = {clas[j] for j in {i-1, i-2, i//2} if 0 <= j < i}
+        clas.append(Cla(Tag('{}{}'.format(prefix, i)), list(supers), {}))
+    return clas
+
+def bench_subtype(n = 500, k = 200000):
+    print('---- {} subtype checks in a hierarchy of {} classes ----'.format(k, n))
+    clas = hierarchy(n)
+    pairs = [(clas[(i*7919) % n], clas[(i*104729) % n]) for i in range(k)]
+    def sets():
+        return sum(x is y or x.tags >= y.tags for x, y in pairs)
+    def masks():
+        return sum(subtype(x, y) for x, y in pairs)
+    for name, f in [('tag sets', sets), ('bitmasks', masks)]:
+        r, t = timed(f)
+        print('{:10} {:8.3f}s {:8} hits'.format(name, t, r))
+
+def bench_subtype_memo(n = 1000, k = 200000):
+    print('---- {} value set checks over {} pairs ----'.format(k, n))
+    vss = [ValueSet({Value(INT_TYPE, j) for j in range(i % 50)}) for i in range(n)]
+    pairs = [(vss[(i*7919) % n], vss[(i*104729) % n]) for i in range(n)]
+    pairs += [(vs, INT_TYPE) for vs in vss]
+    pairs = [pairs[i % len(pairs)] for i in range(k)]
+    SUBTYPE_MEMO.clear()
+    for name, f in [('uncached', subtype_uncached), ('memo', subtype)]:
+        r, t = timed(lambda: sum(f(x, y) for x, y in pairs))
+        print('{:10} {:8.3f}s {:8} hits'.format(name, t, r))
+    print(SUBTYPE_MEMO.stats())
+
+def bench_value_range(n = 10**6, k = 100000):
+    print('---- INT between 0 and {}, {} checks ----'.format(n, k))
+    xs = [ValueSet({Value(INT_TYPE, (i*7919) % (2*n))}) for i in range(k)]
+    for name, make in [('value set', lambda: ValueSet(Value(INT_TYPE, i) for i in range(n))),
+            ('range', lambda: IntRange(0, n - 1))]:
+        tracemalloc.start()
+        y, t = timed(make)
+        cur, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        SUBTYPE_MEMO.clear()
+        r, t2 = timed(lambda: sum(subtype(x, y) for x in xs))
+        print('{:10} {:10} bytes build {:6.3f}s check {:6.3f}s {:6} hits'.format(name, cur, t, t2, r))
+
+def bench_hash_cons(n = 200, k = 20000):
+    print('---- {} intersections over a hierarchy of {} classes ----'.format(k, n))
+    clas = hierarchy(n, 'J')
+    pairs = [(clas[(i*7919) % n], clas[(i*104729) % n]) for i in range(k)]
+    def fresh():
+        return len({id(c) for c in [Cla(None, cs) for cs in pairs]})
+    def shared():
+        return len({id(c) for c in [Cla.inter(cs) for cs in pairs]})
+    for name, f in [('fresh', fresh), ('shared', shared)]:
+        r, t = timed(f)
+        print('{:10} {:8.3f}s {:8} objects'.format(name, t, r))
+
+def bench_compact(n = 100000):
+    print('---- compact state graph, {} list cells ----'.format(n))
+    for name, init in [('dict', init_state_graph), ('compact', init_compact_state_graph)]:
+        tracemalloc.start()
+        sg, t = timed(build_list, init(), n)
+        cur, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        nodes = len(sg.layout.nodes)
+        print('{:8} {:8} nodes {:8.1f} bytes/node {:6.2f}s'.format(name, nodes, cur/nodes, t))
+
+        p, t = timed(walk_list, sg)
+        print('{:8} walk {:6.3f}s'.format(name, t))
+        sg, t = timed(gc_state, sg)
+        print('{:8} gc   {:6.3f}s'.format(name, t))
+
+def walk_list(sg):
+    nx = Label('next')
+    p = find_attr(sg, sg.layout.root, nx)
+    while nx in sg.layout.edges.labels[p]:
+        p = find_attr(sg, p, nx)
+    return p
+
+def chain_graph(d):
+    nx = Label('next')
+    ps = [new_node() for i in range(d)]
+    las = {nx}
+    es = Edges({p: las for p in ps[:-1]}, {(p, nx): q for p, q in zip(ps, ps[1:])})
+    es.labels[ps[-1]] = set()
+    return (LayoutGraph(set(ps), es, ps[0]), dict.fromkeys(ps, BENCH_NODE))
+
+def bench_match_depth(depths = (10, 100, 1000, 10000, 100000, 1000000)):
+    print('---- cons_match on chains ----')
+    for d in depths:
+        g1, tm1 = chain_graph(d)
+        g2, tm2 = chain_graph(d)
+        f, t = timed(cons_match, g1, g2, subtype, tm1, tm2)
+        print('depth {:8} {:8.3f}s {:10.0f} nodes/s'.format(d, t, d/t))
+
+def bench_match_view(n = 100000):
+    print('---- small pattern against the head of {} list cells ----'.format(n))
+    sg = build_list(init_state_graph(), n)
+    p = find_attr(sg, sg.layout.root, Label('next'))
+    g, tm, rm = cons_pattern_graph(ClassPattern(BENCH_NODE, {Label('e'): ClassPattern(INT_TYPE, {})}))
+    for name, f in [('extract', extract_pattern), ('view', view_pattern)]:
+        def match():
+            g2, tm2 = f(sg, p)
+            return cons_match(g, g2, subtype, tm, tm2)
+        m, t = timed(match)
+        print('{:8} {:10.6f}s'.format(name, t))
+
+def bench_compiled_match(n = 100000):
+    print('---- {} matches, interpreted against compiled ----'.format(n))
+    e = Label('e')
+    nx = Label('next')
+    sg = build_list(init_state_graph(), 10)
+    pg2 = view_pattern(sg, find_attr(sg, sg.layout.root, nx))
+    pattern = ClassPattern(BENCH_NODE, {
+        e: ClassPattern(INT_TYPE, {}),
+        nx: ClassPattern(BENCH_NODE, {e: ClassPattern(INT_TYPE, {})})})
+    g, tm, rm = cons_pattern_graph(pattern)
+    m = compile_pattern((g, tm))
+    def interpreted():
+        for i in range(n):
+            cons_match(g, pg2.layout, subtype, tm, pg2.types)
+    def compiled():
+        for i in range(n):
+            m(pg2)
+    for name, f in [('cons_match', interpreted), ('compiled', compiled)]:
+        r, t = timed(f)
+        print('{:10} {:8.3f}s'.format(name, t))
+
+def prefix_cases(k):
+    e = Label('e')
+    nx = Label('next')
+    cas = []
+    for i in range(k):
+        pattern = ClassPattern(BENCH_NODE, {
+            nx: ClassPattern(BENCH_NODE, {}),
+            e: ValueSet({Value(INT_TYPE, i)})})
+        g, tm, rm = cons_pattern_graph(pattern)
+        cas.append(Case(pattern, None, Extra((PatternGraph(g, tm), rm, compile_pattern((g, tm))))))
+    return cas
+
+def bench_decision_tree(k = 30, n = 10000):
+    print('---- {} cases sharing a prefix, {} matches ----'.format(k, n))
+    e = Label('e')
+    nx = Label('next')
+    sg = build_list(init_state_graph(), k)
+    p = sg.layout.root
+    for i in range(k):
+        p = find_attr(sg, p, nx)
+    pg2 = view_pattern(sg, p)
+    cas = prefix_cases(k)
+    def run():
+        for i in range(n):
+            match_cases(pg2, cas)
+    r, t = timed(run)
+    print('{:10} {:8.3f}s'.format('in order', t))
+    compile_match(MatchStmt(None, cas))
+    r, t = timed(run)
+    print('{:10} {:8.3f}s'.format('tree', t))
+
+def bench_match_cache(k = 30, n = 10000):
+    print('---- {} cases, {} matches of an unchanged scrutinee ----'.format(k, n))
+    nx = Label('next')
+    sg = build_list(init_state_graph(), k)
+    p = sg.layout.root
+    for i in range(k):
+        p = find_attr(sg, p, nx)
+    cas = prefix_cases(k)
+    cache = MatchCache()
+    def uncached():
+        for i in range(n):
+            match_cases(view_pattern(sg, p), cas)
+    def cached():
+        for i in range(n):
+            cache.lookup(sg, p, cas, match_cases)
+    for name, f in [('uncached', uncached), ('cached', cached)]:
+        r, t = timed(f)
+        print('{:10} {:8.3f}s'.format(name, t))
+    print(cache.stats())
+
+def deep_scope_prog(d, n):
+    'a loop reading a variable declared d scopes out'
+    i = Label('i')
+    xs = [Label('x{}'.format(j)) for j in range(d)]
+    body = WhileStmt(OpExpr(Label('ilt'), [VarExpr(i), Value(INT_TYPE, n)]),
+        AssignStmt(VarExpr(i), OpExpr(Label('add'), [VarExpr(i), Value(INT_TYPE, 1)])))
+    return Program(BlockStmt([VarDecl(i, INT_TYPE), AssignStmt(VarExpr(i), Value(INT_TYPE, 0))] +
+        [VarDecl(x, INT_TYPE) for x in xs] + [body] +
+        [VarEnd(x) for x in reversed(xs)] + [VarEnd(i)]))
+
+def bench_scope_depth(depths = (1, 10, 100, 500), n = 2000):
+    print('---- {} loop iterations reading a variable d scopes out ----'.format(n))
+    for d in depths:
+        prog = deep_scope_prog(d, n)
+        tc_program(prog, Env())
+        r, t = timed(st_program, prog, init_state_graph(), Never())
+        r, t2 = timed(st_program, deep_scope_prog(d, n), init_state_graph(), Never())
+        print('depth {:6} indexed {:8.3f}s chain {:8.3f}s'.format(d, t, t2))
+
+def bench_tc_depth(depths = (100, 1000, 10000, 100000), n = 10):
+    print('---- type checking {} reads d scopes out ----'.format(n))
+    for d in depths:
+        prog = deep_scope_prog(d, n)
+        r, t = timed(tc_program, prog, Env())
+        print('depth {:6} {:8.3f}s'.format(d, t))
+
+def sum_prog(n):
+    i = Label('i')
+    s = Label('s')
+    return Program(BlockStmt([
+        VarDecl(i, INT_TYPE),
+        VarDecl(s, INT_TYPE),
+        AssignStmt(VarExpr(i), Value(INT_TYPE, 0)),
+        AssignStmt(VarExpr(s), Value(INT_TYPE, 0)),
+        WhileStmt(OpExpr(Label('ilt'), [VarExpr(i), Value(INT_TYPE, n)]), BlockStmt([
+            AssignStmt(VarExpr(s), OpExpr(Label('add'), [VarExpr(s), VarExpr(i)])),
+            AssignStmt(VarExpr(i), OpExpr(Label('add'), [VarExpr(i), Value(INT_TYPE, 1)]))])),
+        VarEnd(s),
+        VarEnd(i)]))
+
+def bench_closures(n = 50000):
+    print('---- {} loop iterations, interpreted, closures and bytecode ----'.format(n))
+    prog = sum_prog(n)
+    tc_program(prog, Env())
+    for name, f in [('st', st_program), ('cc', cc.run_program), ('vm', vm.run_program)]:
+        n0 = NODE_FACTORY._cur_id
+        r, t = timed(f, prog, init_state_graph(), EveryAllocs(2000))
+        print('{:10} {:8.3f}s {:8} nodes'.format(name, t, NODE_FACTORY._cur_id - n0))
+    print('{} instructions'.format(vm.vm_program(prog).executed))
+
+def flag_prog(n):
+    'a loop swinging the same few constants into variables'
+    i = Label('i')
+    k = Label('k')
+    f = Label('f')
+    return Program(BlockStmt([
+        VarDecl(i, INT_TYPE),
+        VarDecl(k, INT_TYPE),
+        VarDecl(f, BOOL_TYPE),
+        AssignStmt(VarExpr(i), Value(INT_TYPE, 0)),
+        WhileStmt(OpExpr(Label('ilt'), [VarExpr(i), Value(INT_TYPE, n)]), BlockStmt([
+            AssignStmt(VarExpr(f), Value(BOOL_TYPE, True)),
+            AssignStmt(VarExpr(k), OpExpr(Label('mod'), [VarExpr(i), Value(INT_TYPE, 7)])),
+            AssignStmt(VarExpr(i), OpExpr(Label('add'), [VarExpr(i), Value(INT_TYPE, 1)]))])),
+        VarEnd(f),
+        VarEnd(k),
+        VarEnd(i)]))
+
+def bench_intern(n = 50000):
+    print('---- {} loop iterations swinging constants ----'.format(n))
+    prog = flag_prog(n)
+    tc_program(prog, Env())
+    for name, intern in [('fresh', False), ('interned', True)]:
+        n0 = NODE_FACTORY._cur_id
+        tracemalloc.start()
+        r, t = timed(cc.run_program, prog, init_state_graph(False, intern), Never())
+        cur, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{:10} {:8.3f}s {:8} nodes {:10} bytes'.format(name, t, NODE_FACTORY._cur_id - n0, cur))
+
+
+def gcd_prog(a, b):
+    'gcd of the input variables a and b'
+    m = Label('m')
+    n = Label('n')
+    t = Label('t')
+    return Program(BlockStmt([
+        VarDecl(m, INT_TYPE),
+        VarDecl(n, INT_TYPE),
+        AssignStmt(VarExpr(m), VarExpr(a)),
+        AssignStmt(VarExpr(n), VarExpr(b)),
+        WhileStmt(OpExpr(Label('ine'), [VarExpr(n), Value(INT_TYPE, 0)]), BlockStmt([
+            VarDecl(t, INT_TYPE),
+            AssignStmt(VarExpr(t), VarExpr(m)),
+            AssignStmt(VarExpr(m), VarExpr(n)),
+            AssignStmt(VarExpr(n), OpExpr(Label('mod'), [VarExpr(t), VarExpr(n)])),
+            VarEnd(t)])),
+        PrintStmt([VarExpr(m)]),
+        VarEnd(n),
+        VarEnd(m)]))
+
+def bench_batch(n = 2000):
+    print('---- gcd over {} records, scalar and batch ----'.format(n))
+    a = Label('a')
+    b = Label('b')
+    prog = gcd_prog(a, b)
+    tc_program(prog, Env(None, {a: INT_TYPE, b: INT_TYPE}))
+    rnd = random.Random(0)
+    records = [{a: Value(INT_TYPE, rnd.randrange(1, 10**6)), b: Value(INT_TYPE, rnd.randrange(1, 10**6))} for k in range(n)]
+    outs = []
+    for name, f in [('scalar', batch.scalar_program), ('batch', batch.batch_program)]:
+        buf = io.StringIO()
+        with redirect_stdout(buf):
+            r, t = timed(f, prog, records, Never())
+        outs.append(buf.getvalue())
+        print('{:10} {:8.3f}s'.format(name, t))
+    print('same output', outs[0] == outs[1])
+
+
+def bench_query(n = 100000, k = 1000):
+    print('---- query over a {} node list and {} cursors ----'.format(n, k))
+    e = Label('e')
+    nx = Label('next')
+    cursor = Cla(Tag('BenchCursor'), [], {nx: BENCH_NODE})
+    sg = build_list(init_state_graph(), n)
+    (ns, es, r), tm, vm = sg
+    ps = [p for p in ns if tm.get(p) is BENCH_NODE]
+    for i in range(k):
+        swing_state(sg, add_object_to_state(sg, cursor), nx, ps[i * len(ps) // k])
+    q = query.compile_query(ClassPattern(cursor, {
+        nx: ClassPattern(BENCH_NODE, {e: IntRange(0, n // 2)})}))
+    def scan():
+        rs = []
+        for p in ns:
+            if p in tm:
+                f = q.match(view_pattern(sg, p))
+                if f is not None:
+                    rs.append(p)
+        return rs
+    rs, t = timed(scan)
+    print('{:10} {:8.3f}s {:8} matches'.format('scan', t, len(rs)))
+    index, t = timed(index_state, sg)
+    print('{:10} {:8.3f}s'.format('index', t))
+    rs, t = timed(query.query, sg, q, index)
+    print('{:10} {:8.3f}s {:8} matches'.format('query', t, len(rs)))
+
+def ref_chain(k):
+    'k nested labels, each referenced from every deeper level'
+    a = Label('a')
+    xs = [Label('x{}'.format(i)) for i in range(k)]
+    pattern = ClassPattern(BENCH_NODE, {})
+    for i in reversed(range(k)):
+        attrs = {a: pattern}
+        if i + 1 < k:
+            attrs[Label('next')] = PatternRef(xs[i])
+        pattern = LabeledPattern(xs[i], ClassPattern(BENCH_NODE, attrs))
+    return pattern
+
+def bench_pattern_refs(ks = (100, 200, 300)):
+    print('---- back references in pattern graphs ----')
+    for k in ks:
+        pattern = ref_chain(k)
+        r, t = timed(cons_pattern_graph, pattern)
+        print('{:10} {:8.3f}s'.format(k, t))
+
+
+def bench_rete(n = 20000, m = 1000):
+    print('---- {} swings on a {} node list, requery and incremental ----'.format(m, n))
+    e = Label('e')
+    nx = Label('next')
+    sg = build_list(init_state_graph(), n)
+    (ns, es, r), tm, vm = sg
+    ps = [p for p in ns if tm.get(p) is BENCH_NODE]
+    q = query.compile_query(ClassPattern(BENCH_NODE, {
+        e: IntRange(0, 9),
+        nx: ClassPattern(BENCH_NODE, {})}))
+    net, t = timed(rete.ReteNetwork, sg)
+    rs, t2 = timed(net.register, sg, q)
+    print('{:10} {:8.3f}s {:8} matches'.format('build', t + t2, len(net.productions[0].matches)))
+    rnd = random.Random(0)
+    t = 0
+    t2 = 0
+    for i in range(m):
+        swing_state(sg, rnd.choice(ps), e, add_value_to_state(sg, Value(INT_TYPE, rnd.randrange(n))))
+        if i % 100 == 99:
+            rs, dt = timed(net.flush, sg)
+            t += dt
+            rs, dt = timed(query.query, sg, q, net)
+            t2 += dt
+    print('{:10} {:8.3f}s {:8} matches'.format('requery', t2, len(rs)))
+    print('{:10} {:8.3f}s {:8} matches'.format('flush', t, len(net.productions[0].matches)))
+
+
+def copy_state(sg):
+    'what keeping an old dict state graph takes'
+    (ns, es, r), tm, vm = sg
+    labels = {p: set(las) for p, las in es.labels.items()}
+    es2 = Edges(labels, dict(es.targets), None, [], list(es.frames), None)
+    return StateGraph(LayoutGraph(set(ns), es2, r), dict(tm), dict(vm))
+
+def bench_persistent(n = 50000, k = 1000):
+    print('---- snapshots of a {} cell list, {} swings each ----'.format(n, k))
+    e = Label('e')
+    for name, init, snapshot in [('dict', init_state_graph, copy_state), ('hamt', init_persistent_state_graph, lambda sg: sg.fork())]:
+        sg, t = timed(build_list, init(), n)
+        print('{:8} build {:8.3f}s'.format(name, t))
+        ps = [p for p in sg.layout.nodes if sg.types.get(p) is BENCH_NODE]
+        q = find_attr(sg, ps[0], e)
+        sg2, t = timed(snapshot, sg)
+        print('{:8} snap  {:8.3f}s'.format(name, t))
+        def swings():
+            for i in range(k):
+                swing_state(sg2, ps[i], e, add_value_to_state(sg2, Value(INT_TYPE, -i)))
+        r, t = timed(swings)
+        kept = find_attr(sg, ps[0], e) == q and find_attr(sg2, ps[0], e) != q
+        print('{:8} swing {:8.3f}s, snapshot kept {}'.format(name, t, kept))
+
+
+def bench_checkpoint(n = 100000, k = 1000):
+    print('---- checkpoint of a {} cell list, {} matches ----'.format(n, k))
+    e = Label('e')
+    nx = Label('next')
+    sg = build_list(init_state_graph(), n)
+    q = query.compile_query(ClassPattern(BENCH_NODE, {
+        e: IntRange(0, n // 2),
+        nx: ClassPattern(BENCH_NODE, {})}))
+    fd, path = tempfile.mkstemp(suffix = '.ckpt')
+    os.close(fd)
+    try:
+        r, t = timed(checkpoint.save_state, path, sg)
+        print('{:10} {:8.3f}s {:8} bytes'.format('save', t, os.path.getsize(path)))
+        sg2, t = timed(checkpoint.load_state, path)
+        print('{:10} {:8.3f}s {:8} nodes'.format('load', t, len(sg2.layout.nodes)))
+        sg3, t = timed(checkpoint.open_state, path)
+        print('{:10} {:8.3f}s'.format('open', t))
+        'a few lookups are where a mapped graph pays off over loading'
+        ps = [p for p in sg.layout.nodes if sg.types.get(p) is BENCH_NODE][:k]
+        def matches(sg):
+            return [p for p in ps if q.match(view_pattern(sg, p)) is not None]
+        rs, t = timed(matches, sg3)
+        print('{:10} {:8.3f}s {:8} matches'.format('mapped', t, len(rs)))
+        print('same matches', rs == matches(sg2))
+        sg3.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    bench_subtype()
+    bench_subtype_memo()
+    bench_value_range()
+    bench_hash_cons()
+    bench_compact()
+    bench_match_depth()
+    bench_match_view()
+    bench_compiled_match()
+    bench_decision_tree()
+    bench_match_cache()
+    bench_scope_depth()
+    bench_tc_depth()
+    bench_closures()
+    bench_intern()
+    bench_batch()
+    bench_query()
+    bench_pattern_refs()
+    bench_rete()
+    bench_persistent()
+    bench_checkpoint()
+
+
+##
+## end of bench.py
+##$Id$
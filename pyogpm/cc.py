@@ -0,0 +1,364 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    compilation of type-checked programs to closures
+
+'''
+
+from subtype import Value
+
+from graph import (
+    add_object_to_state,
+    swing_state,
+    find_var_at,
+    find_lvar_at,
+    find_attr,
+    find_lattr,
+    value_of,
+    box_value,
+    reuse_value)
+
+from pattern import MatchStmt
+
+from asx import (
+    AssignStmt,
+    IfStmt,
+    WhileStmt,
+    PrintStmt,
+    BlockStmt,
+    VarDecl,
+    VarEnd,
+    VarExpr,
+    AttrExpr,
+    OpExpr,
+    NewExpr,
+    AndExpr,
+    OrExpr)
+
+from op import get_op
+
+from gcpolicy import (
+    STMT_EVENT,
+    BLOCK_EVENT)
+
+from st import (
+    SCOPE_LABEL,
+    collect,
+    node_str,
+    fork_match,
+    enter_case,
+    leave_case,
+    run_interp,
+    st_var_decl,
+    st_var_end)
+
+class Reg:
+    '''
+        a variable declared by the program. assignments leave the Value
+        they swing in value, so operands read it without walking the
+        frames, None when the node is all we have. node is the value
+        node the last assignment boxed, while the variable is its only
+        referrer, so the next assignment may write over it.
+    '''
+    def __init__(self, label):
+        self.label = label
+        self.value = None
+        self.node = None
+
+    def clear(self):
+        self.value = None
+        self.node = None
+
+def scope_reg(x, sc):
+    'the Reg of the variable x reads, None if x is not resolved to one'
+    d = x.depth
+    if d is not None and d < len(sc):
+        r = sc[-1-d]
+        if r is not None and r.label == x.label:
+            return r
+    return None
+
+def scope_regs(x, sc):
+    'the Regs x may name, every one with its label when not resolved'
+    r = scope_reg(x, sc)
+    if r is not None:
+        return [r]
+    return [r for r in sc if r is not None and r.label == x.label]
+
+def cc_value(x, sc):
+    def run(sg):
+        return x
+    return run
+
+def cc_var(x, sc):
+    'the node read may be shared from here on, so no Reg owns it'
+    la = x.label
+    d = x.depth
+    rs = scope_regs(x, sc)
+    def run(sg):
+        for r in rs:
+            r.node = None
+        return find_var_at(sg, SCOPE_LABEL, la, d)
+    return run
+
+def cc_lvar(x, sc):
+    la = x.label
+    d = x.depth
+    def run(sg):
+        return find_lvar_at(sg, SCOPE_LABEL, la, d)
+    return run
+
+def cc_attr(x, sc):
+    e = cc_expr(x.expr, sc)
+    la = x.label
+    def run(sg):
+        return find_attr(sg, e(sg), la)
+    return run
+
+def cc_lattr(x, sc):
+    e = cc_expr(x.expr, sc)
+    la = x.label
+    def run(sg):
+        return find_lattr(sg, e(sg), la)
+    return run
+
+def cc_operand(x, sc):
+    'x as a Value, a variable with a Reg is read from it'
+    if type(x) is Value:
+        return cc_value(x, sc)
+
+    r = scope_reg(x, sc) if type(x) is VarExpr else None
+    if r is not None:
+        la = x.label
+        d = x.depth
+        def run(sg):
+            v = r.value
+            if v is None:
+                v = value_of(sg, find_var_at(sg, SCOPE_LABEL, la, d))
+                r.value = v
+            return v
+        return run
+
+    e = cc_expr(x, sc)
+    def run(sg):
+        return value_of(sg, e(sg))
+    return run
+
+def cc_op(x, sc):
+    la, args = x
+    d = get_op(la)
+    f = d.f
+    es = [cc_operand(arg, sc) for arg in args]
+    if d.vf is not None and len(es) == 2:
+        e1, e2 = es
+        t = d.res_type
+        vf = d.vf
+        def run(sg):
+            return Value(t, vf(e1(sg).value, e2(sg).value))
+    elif len(es) == 1:
+        e1, = es
+        def run(sg):
+            return f(e1(sg))
+    else:
+        def run(sg):
+            return f(*[e(sg) for e in es])
+    return run
+
+def cc_test(x, sc):
+    'x as a python truth value, comparisons do not build the Value'
+    if type(x) is OpExpr and len(x.args) == 2 and get_op(x.op).vf is not None:
+        e1, e2 = [cc_operand(arg, sc) for arg in x.args]
+        vf = get_op(x.op).vf
+        def run(sg):
+            return vf(e1(sg).value, e2(sg).value) == True
+        return run
+
+    e = cc_operand(x, sc)
+    def run(sg):
+        return e(sg).value == True
+    return run
+
+def cc_new(x, sc):
+    cla = x.cla
+    def run(sg):
+        return add_object_to_state(sg, cla)
+    return run
+
+def cc_and(x, sc):
+    left = cc_expr(x.left, sc)
+    right = cc_expr(x.right, sc)
+    def run(sg):
+        p = left(sg)
+        if value_of(sg, p).value != True:
+            return p
+        return right(sg)
+    return run
+
+def cc_or(x, sc):
+    left = cc_expr(x.left, sc)
+    right = cc_expr(x.right, sc)
+    def run(sg):
+        p = left(sg)
+        if value_of(sg, p).value != False:
+            return p
+        return right(sg)
+    return run
+
+EXPR_TAB = {
+    Value: cc_value,
+    VarExpr: cc_var,
+    AttrExpr: cc_attr,
+    OpExpr: cc_op,
+    NewExpr: cc_new,
+    AndExpr: cc_and,
+    OrExpr: cc_or}
+
+def cc_expr(x, sc):
+    return EXPR_TAB[type(x)](x, sc)
+
+LEXPR_TAB = {
+    VarExpr: cc_lvar,
+    AttrExpr: cc_lattr}
+
+def cc_lexpr(lx, sc):
+    return LEXPR_TAB[type(lx)](lx, sc)
+
+def cc_var_decl(vd, sc):
+    r = Reg(vd.label)
+    sc.append(r)
+    def run(sg, ip):
+        r.clear()
+        return st_var_decl(vd, sg, ip)
+    return run
+
+def cc_var_end(ve, sc):
+    r = sc.pop()
+    def run(sg, ip):
+        r.clear()
+        return st_var_end(ve, sg, ip)
+    return run
+
+def cc_print(pr, sc):
+    es = [cc_expr(x, sc) for x in pr.args]
+    def run(sg, ip):
+        print(', '.join([node_str(sg, e(sg)) for e in es]))
+        return sg
+    return run
+
+def cc_assign(s, sc):
+    '''
+        a variable resolved to its Reg keeps the Value it is assigned,
+        and the node boxing it, which later Values are written over
+        while no read shares it and only the gc policy watches
+    '''
+    lx, x = s
+    le = cc_lexpr(lx, sc)
+    e = cc_expr(x, sc)
+    r = scope_reg(lx, sc) if type(lx) is VarExpr else None
+    rs = scope_regs(lx, sc) if type(lx) is VarExpr else []
+    if r is not None:
+        def run(sg, ip):
+            v = e(sg)
+            if type(v) is not Value:
+                p, la = le(sg)
+                swing_state(sg, p, la, v)
+                r.clear()
+            else:
+                if r.node is None or not reuse_value(sg, r.node, v, ip.policy):
+                    p, la = le(sg)
+                    r.node = box_value(sg, v)
+                    swing_state(sg, p, la, r.node)
+                r.value = v
+            return collect(sg, STMT_EVENT, ip)
+    else:
+        def run(sg, ip):
+            p, la = le(sg)
+            swing_state(sg, p, la, box_value(sg, e(sg)))
+            for r in rs:
+                r.clear()
+            return collect(sg, STMT_EVENT, ip)
+    return run
+
+def cc_if(s, sc):
+    x, thens, elses = s
+    t = cc_test(x, sc)
+    s1 = cc_stmt(thens, sc)
+    s2 = cc_stmt(elses, sc)
+    def run(sg, ip):
+        if t(sg):
+            return s1(sg, ip)
+        return s2(sg, ip)
+    return run
+
+def cc_while(s, sc):
+    x, ws = s
+    t = cc_test(x, sc)
+    s1 = cc_stmt(ws, sc)
+    def run(sg, ip):
+        while t(sg):
+            sg = s1(sg, ip)
+        return collect(sg, STMT_EVENT, ip)
+    return run
+
+def cc_block(blk, sc):
+    sc = list(sc)
+    ss = [cc_scope(s, sc) for s in blk.stmts]
+    def run(sg, ip):
+        for s in ss:
+            sg = s(sg, ip)
+        return collect(sg, BLOCK_EVENT, ip)
+    return run
+
+def cc_scope(s, sc):
+    'declarations push and pop the Regs of sc, as they do the frames'
+    if type(s) is VarDecl:
+        return cc_var_decl(s, sc)
+
+    if type(s) is VarEnd:
+        return cc_var_end(s, sc)
+
+    return cc_stmt(s, sc)
+
+def cc_match(s, sc):
+    x, cas = s
+    e = cc_expr(x, sc)
+    ss = [cc_stmt(ca.stmt, sc + [None]) for ca in cas]
+    def run(sg, ip):
+        sg, km = fork_match(sg, e, cas, ip)
+        if km is None:
+            return sg
+
+        k, m = km
+        return leave_case(ss[k](enter_case(sg, m), ip), ip)
+    return run
+
+STMT_TAB = {
+    MatchStmt: cc_match,
+    AssignStmt: cc_assign,
+    IfStmt: cc_if,
+    WhileStmt: cc_while,
+    PrintStmt: cc_print,
+    BlockStmt: cc_block}
+
+def cc_stmt(s, sc):
+    return STMT_TAB[type(s)](s, sc)
+
+def cc_program(prog):
+    'compiled once per program, after type checking'
+    extra = prog.extra
+    if extra.closure is None:
+        extra.closure = cc_block(prog.block, [])
+    return extra.closure
+
+def run_program(prog, sg, policy = None, cache = None):
+    'st_program through the compiled closures'
+    return run_interp(cc_program(prog), sg, policy, cache)
+
+
+##
+## end of cc.py
+##$Id$
@@ -0,0 +1,633 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    binary checkpoints of state and pattern graphs
+
+'''
+
+import os
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+
+from subtype import (
+    Tag,
+    Cla,
+    NO_TYPE,
+    NULL_TYPE,
+    INT_TYPE,
+    STR_TYPE,
+    BOOL_TYPE,
+    Value,
+    ValueSet,
+    IntRange,
+    StrPrefix,
+    BoolConst,
+    is_anon_tag)
+
+from graph import (
+    NODE_FACTORY,
+    Node,
+    Label,
+    Edges,
+    LayoutGraph,
+    PatternGraph,
+    StateGraph,
+    frame_nodes)
+
+from pattern import (
+    PatternConj,
+    PatternDisj,
+    Extra)
+
+from bidict import bidict
+
+from mc import compile_pattern
+
+from tc import (
+    conj_bindings,
+    disj_bindings)
+
+from query import Query
+
+class CheckpointError(Exception): pass
+class BadCheckpoint(CheckpointError): pass
+class Unserializable(CheckpointError): pass
+
+'''
+    a header, then a table of (offset, length) per section, then the
+    sections, 8-byte aligned. all but the string blob are int64 arrays.
+    strings are [n, offsets..] followed by the utf-8 blob. nodes are
+    sorted by id, and edges are referenced by node index, in the rows
+    edge_offsets[i] to edge_offsets[i+1] of the edge arrays. meta is
+    the root, the frames, then what the kind of checkpoint adds.
+'''
+
+MAGIC = b'OGPMCKPT'
+VERSION = 1
+HEADER = struct.Struct('<8sIII')
+ENTRY = struct.Struct('<QQ')
+
+STATE_KIND = 0
+PATTERN_KIND = 1
+EXTRA_KIND = 2
+
+'the case forms of an extra'
+ONE_FORM = 0
+CONJ_FORM = 1
+DISJ_FORM = 2
+
+(STRINGS, STRING_BLOB, TYPES, VALUES, MEMBERS, NODES, NODE_TYPES, NODE_VALUES,
+    EDGE_OFFSETS, EDGE_LABELS, EDGE_TARGETS, META) = range(12)
+
+'types are (kind, x, y, z) rows'
+TYPE_CLA = 0            # tag string
+TYPE_VALUE_SET = 1      # first member, member count
+TYPE_INT_RANGE = 2      # lo value or -1, hi value or -1
+TYPE_STR_PREFIX = 3     # prefix string
+TYPE_BOOL_CONST = 4     # 0 or 1
+
+'values are (type, kind, payload) rows'
+VALUE_INT = 0           # int64
+VALUE_BIG_INT = 1       # decimal string
+VALUE_STR = 2           # string
+VALUE_BOOL = 3          # 0 or 1
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+BUILTIN_TYPES = {t.tag: t for t in (NO_TYPE, NULL_TYPE, INT_TYPE, STR_TYPE, BOOL_TYPE)}
+
+class Tables:
+    'strings, types and values being written, each entry once'
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.types = array('q')
+        self.type_ids = {}
+        self.values = array('q')
+        self.value_ids = {}
+        self.members = array('q')
+
+    def string(self, s):
+        if type(s) is not str:
+            raise Unserializable()
+        k = self.string_ids.get(s)
+        if k is None:
+            k = len(self.strings)
+            self.string_ids[s] = k
+            self.strings.append(s)
+        return k
+
+    def type_ref(self, t):
+        key = (type(t), t)
+        k = self.type_ids.get(key)
+        if k is not None:
+            return k
+
+        if type(t) is Cla:
+            if is_anon_tag(t.tag) and t.tag not in BUILTIN_TYPES:
+                raise Unserializable()
+            row = (TYPE_CLA, self.string(t.tag.id), 0, 0)
+        elif type(t) is ValueSet:
+            ks = [self.value_ref(v) for v in t.vector]
+            row = (TYPE_VALUE_SET, len(self.members), len(ks), 0)
+            self.members.extend(ks)
+        elif type(t) is IntRange:
+            lo = -1 if t.lo is None else self.value_ref(Value(INT_TYPE, t.lo))
+            hi = -1 if t.hi is None else self.value_ref(Value(INT_TYPE, t.hi))
+            row = (TYPE_INT_RANGE, lo, hi, 0)
+        elif type(t) is StrPrefix:
+            row = (TYPE_STR_PREFIX, self.string(t.prefix), 0, 0)
+        elif type(t) is BoolConst:
+            row = (TYPE_BOOL_CONST, int(t.value), 0, 0)
+        else:
+            raise Unserializable()
+
+        k = len(self.types) // 4
+        self.types.extend(row)
+        self.type_ids[key] = k
+        return k
+
+    def value_ref(self, v):
+        k = self.value_ids.get(v)
+        if k is not None:
+            return k
+
+        x = v.value
+        if type(x) is bool:
+            row = (VALUE_BOOL, int(x))
+        elif type(x) is int:
+            row = (VALUE_INT, x) if INT64_MIN <= x <= INT64_MAX else (VALUE_BIG_INT, self.string(str(x)))
+        elif type(x) is str:
+            row = (VALUE_STR, self.string(x))
+        else:
+            raise Unserializable()
+
+        t = self.type_ref(v.cla)
+        k = len(self.values) // 3
+        self.values.extend((t,) + row)
+        self.value_ids[v] = k
+        return k
+
+def write_checkpoint(path, kind, g, tm, vm, frames = (), tail = None):
+    '''
+        g is any layout, tm and vm need only support in and [].
+        tail(tabs, ids) gives the rest of meta.
+    '''
+    ns, es, r = g
+    tabs = Tables()
+    nodes = array('q', sorted(p.id for p in ns))
+    ids = {i: k for k, i in enumerate(nodes)}
+    node_types = array('q')
+    node_values = array('q')
+    offsets = array('q', [0])
+    labels = array('q')
+    targets = array('q')
+    for i in nodes:
+        p = Node(i)
+        node_types.append(tabs.type_ref(tm[p]) if p in tm else -1)
+        node_values.append(tabs.value_ref(vm[p]) if p in vm else -1)
+        for la in sorted(es.labels[p], key = lambda la: la.id):
+            labels.append(tabs.string(la.id))
+            targets.append(ids[es.targets[(p, la)].id])
+        offsets.append(len(labels))
+
+    meta = array('q', [ids[r.id], len(frames)])
+    meta.extend(ids[p.id] for p in frames)
+    if tail is not None:
+        meta.extend(tail(tabs, ids))
+
+    blobs = [s.encode('utf-8') for s in tabs.strings]
+    string_offsets = array('q', [len(blobs), 0])
+    for b in blobs:
+        string_offsets.append(string_offsets[-1] + len(b))
+
+    sections = [string_offsets.tobytes(), b''.join(blobs), tabs.types.tobytes(),
+        tabs.values.tobytes(), tabs.members.tobytes(), nodes.tobytes(),
+        node_types.tobytes(), node_values.tobytes(), offsets.tobytes(),
+        labels.tobytes(), targets.tobytes(), meta.tobytes()]
+
+    with open(path, 'wb') as f:
+        pos = HEADER.size + ENTRY.size * len(sections)
+        table = []
+        for s in sections:
+            pos += -pos % 8
+            table.append((pos, len(s)))
+            pos += len(s)
+        f.write(HEADER.pack(MAGIC, VERSION, kind, len(sections)))
+        for off, n in table:
+            f.write(ENTRY.pack(off, n))
+        for (off, n), s in zip(table, sections):
+            f.write(b'\0' * (off - f.tell()))
+            f.write(s)
+
+def save_state(path, sg):
+    g, tm, vm = sg
+    write_checkpoint(path, STATE_KIND, g, tm, vm, frame_nodes(sg))
+
+def refs_row(tabs, ids, refs):
+    row = [len(refs)]
+    for la, p in refs.items():
+        row.extend((tabs.string(la.id), ids[p.id]))
+    return row
+
+def save_pattern(path, pg, refs = {}):
+    write_checkpoint(path, PATTERN_KIND, pg.layout, pg.types, {}, (),
+        lambda tabs, ids: refs_row(tabs, ids, refs))
+
+def save_query(path, q):
+    'the matcher itself is compiled again on load'
+    save_pattern(path, q.graph, q.refs)
+
+def save_extra(path, junc, extra):
+    '''
+        what tc_case put in the extra of a case with pattern junc. the
+        matchers and bindings are built again on load, and the decision
+        tree when the match is compiled again.
+    '''
+    x = extra.get()
+    if type(junc) is PatternConj or type(junc) is PatternDisj:
+        form = CONJ_FORM if type(junc) is PatternConj else DISJ_FORM
+        pgs, fs, rms = x[0], x[1], x[2]
+    else:
+        form = ONE_FORM
+        pgs, fs, rms = [x[0]], [{}], [x[1]]
+
+    'the pattern graphs share no nodes, so they are stored as one'
+    labels = {}
+    targets = {}
+    tm = {}
+    for (ns, es, r), tm2 in pgs:
+        labels.update((p, es.labels[p]) for p in ns)
+        targets.update(es.targets)
+        tm.update(tm2)
+    g = LayoutGraph(set(labels), Edges(labels, targets), pgs[0].layout.root)
+
+    def tail(tabs, ids):
+        row = [form, len(pgs)]
+        for pg, f, rm in zip(pgs, fs, rms):
+            (ns, es, r), tm2 = pg
+            row.append(ids[r.id])
+            row.append(len(ns))
+            row.extend(sorted(ids[p.id] for p in ns))
+            row.extend(refs_row(tabs, ids, rm))
+            row.append(len(f))
+            for p, q in sorted(f.items()):
+                row.extend((ids[p.id], q.id))
+        return row
+
+    write_checkpoint(path, EXTRA_KIND, g, tm, {}, (), tail)
+
+class Checkpoint:
+    '''
+        a checkpoint file mapped into memory. sections are viewed in
+        place, and strings, types and values are decoded on first use.
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise BadCheckpoint()
+            self.mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self.sections = []
+        self.string_cache = {}
+        self.type_cache = {}
+        self.value_cache = {}
+        self.label_cache = {}
+        try:
+            self.read_sections()
+            meta = self.sections[META]
+            self.root = meta[0]
+            nf = meta[1]
+            self.frames = list(meta[2:2+nf])
+            self.tail = iter(meta[2+nf:].tolist())
+        except IndexError:
+            self.close()
+            raise BadCheckpoint()
+        except Exception:
+            self.close()
+            raise
+
+    def read_sections(self):
+        'the table is checked before any section is viewed'
+        mm = self.mm
+        magic, version, self.kind, n = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION or n != META + 1:
+            raise BadCheckpoint()
+        if HEADER.size + ENTRY.size * n > len(mm):
+            raise BadCheckpoint()
+
+        table = [ENTRY.unpack_from(mm, HEADER.size + ENTRY.size * k) for k in range(n)]
+        for k, (off, size) in enumerate(table):
+            if off + size > len(mm) or (k != STRING_BLOB and (off | size) % 8):
+                raise BadCheckpoint()
+
+        buf = memoryview(mm)
+        for k, (off, size) in enumerate(table):
+            s = buf[off:off+size]
+            self.sections.append(s if k == STRING_BLOB else s.cast('q'))
+        buf.release()
+
+    def close(self):
+        self.sections = []
+        self.mm.close()
+
+    def take(self):
+        'the next int of the meta tail'
+        x = next(self.tail, None)
+        if x is None:
+            raise BadCheckpoint()
+        return x
+
+    def read_refs(self):
+        return bidict((self.label(self.take()), self.node(self.take())) for k in range(self.take()))
+
+    def string(self, k):
+        s = self.string_cache.get(k)
+        if s is None:
+            offs = self.sections[STRINGS]
+            s = str(self.sections[STRING_BLOB][offs[1+k]:offs[2+k]], 'utf-8')
+            self.string_cache[k] = s
+        return s
+
+    def label(self, k):
+        la = self.label_cache.get(k)
+        if la is None:
+            la = self.label_cache[k] = Label(self.string(k))
+        return la
+
+    def type_at(self, k):
+        t = self.type_cache.get(k)
+        if t is None:
+            ts = self.sections[TYPES]
+            kind, x, y = ts[4*k], ts[4*k+1], ts[4*k+2]
+            if kind == TYPE_CLA:
+                tag = Tag(self.string(x))
+                t = BUILTIN_TYPES[tag] if tag in BUILTIN_TYPES else Cla.get(tag)
+            elif kind == TYPE_VALUE_SET:
+                ms = self.sections[MEMBERS]
+                t = ValueSet(self.value_at(ms[i]) for i in range(x, x + y))
+            elif kind == TYPE_INT_RANGE:
+                t = IntRange(None if x < 0 else self.value_at(x).value, None if y < 0 else self.value_at(y).value)
+            elif kind == TYPE_STR_PREFIX:
+                t = StrPrefix(self.string(x))
+            elif kind == TYPE_BOOL_CONST:
+                t = BoolConst(bool(x))
+            else:
+                raise BadCheckpoint()
+            self.type_cache[k] = t
+        return t
+
+    def value_at(self, k):
+        v = self.value_cache.get(k)
+        if v is None:
+            vs = self.sections[VALUES]
+            t, kind, x = vs[3*k], vs[3*k+1], vs[3*k+2]
+            if kind == VALUE_INT:
+                x = x
+            elif kind == VALUE_BIG_INT:
+                x = int(self.string(x))
+            elif kind == VALUE_STR:
+                x = self.string(x)
+            elif kind == VALUE_BOOL:
+                x = bool(x)
+            else:
+                raise BadCheckpoint()
+            v = Value(self.type_at(t), x)
+            self.value_cache[k] = v
+        return v
+
+    def index(self, p):
+        'row of node p, None when absent'
+        nodes = self.sections[NODES]
+        i = bisect_left(nodes, p.id)
+        if i < len(nodes) and nodes[i] == p.id:
+            return i
+        return None
+
+    def node(self, i):
+        return Node(self.sections[NODES][i])
+
+    def row(self, i):
+        offs = self.sections[EDGE_OFFSETS]
+        return range(offs[i], offs[i+1])
+
+class MappedNodes:
+    def __init__(self, ck):
+        self.ck = ck
+
+    def __len__(self):
+        return len(self.ck.sections[NODES])
+
+    def __contains__(self, p):
+        return self.ck.index(p) is not None
+
+    def __iter__(self):
+        return (Node(i) for i in self.ck.sections[NODES])
+
+class MappedLabels:
+    def __init__(self, ck):
+        self.ck = ck
+
+    def __getitem__(self, p):
+        i = self.ck.index(p)
+        if i is None:
+            raise KeyError(p)
+        las = self.ck.sections[EDGE_LABELS]
+        return frozenset(self.ck.label(las[k]) for k in self.ck.row(i))
+
+    def __contains__(self, p):
+        return self.ck.index(p) is not None
+
+class MappedTargets:
+    def __init__(self, ck):
+        self.ck = ck
+
+    def get(self, k, default = None):
+        p, la = k
+        ck = self.ck
+        i = ck.index(p)
+        if i is not None:
+            las = ck.sections[EDGE_LABELS]
+            for j in ck.row(i):
+                if ck.label(las[j]) == la:
+                    return ck.node(ck.sections[EDGE_TARGETS][j])
+        return default
+
+    def __getitem__(self, k):
+        q = self.get(k)
+        if q is None:
+            raise KeyError(k)
+        return q
+
+    def __contains__(self, k):
+        return self.get(k) is not None
+
+    def items(self):
+        ck = self.ck
+        las = ck.sections[EDGE_LABELS]
+        tgts = ck.sections[EDGE_TARGETS]
+        for i in range(len(ck.sections[NODES])):
+            p = ck.node(i)
+            for j in ck.row(i):
+                yield ((p, ck.label(las[j])), ck.node(tgts[j]))
+
+class MappedColumn:
+    'node types or node values, -1 for none'
+    def __init__(self, ck, section, decode):
+        self.ck = ck
+        self.section = section
+        self.decode = decode
+
+    def get(self, p, default = None):
+        i = self.ck.index(p)
+        if i is None:
+            return default
+        k = self.ck.sections[self.section][i]
+        if k < 0:
+            return default
+        return self.decode(k)
+
+    def __getitem__(self, p):
+        x = self.get(p)
+        if x is None:
+            raise KeyError(p)
+        return x
+
+    def __contains__(self, p):
+        return self.get(p) is not None
+
+    def items(self):
+        col = self.ck.sections[self.section]
+        for i, k in enumerate(col):
+            if k >= 0:
+                yield (self.ck.node(i), self.decode(k))
+
+class MappedLayout:
+    def __init__(self, ck):
+        self.ck = ck
+        self.nodes = MappedNodes(ck)
+        self.edges = Edges(MappedLabels(ck), MappedTargets(ck))
+
+    @property
+    def root(self):
+        return self.ck.node(self.ck.root)
+
+    def __iter__(self):
+        return iter((self.nodes, self.edges, self.root))
+
+class MappedStateGraph:
+    '''
+        a read-only state graph over an open checkpoint, for analyses
+        that only match and query. load_state gives a mutable copy.
+    '''
+    def __init__(self, ck):
+        self.ck = ck
+        self.layout = MappedLayout(ck)
+        self.types = MappedColumn(ck, NODE_TYPES, ck.type_at)
+        self.values = MappedColumn(ck, NODE_VALUES, ck.value_at)
+
+    def __iter__(self):
+        return iter((self.layout, self.types, self.values))
+
+    def frame_nodes(self):
+        return [self.ck.node(i) for i in self.ck.frames]
+
+    def close(self):
+        self.ck.close()
+
+def open_state(path):
+    ck = Checkpoint(path)
+    if ck.kind != STATE_KIND:
+        raise BadCheckpoint()
+    return MappedStateGraph(ck)
+
+def read_graph(ck):
+    'dict layout, type and value maps, with the node factory moved past the ids'
+    ps = [Node(n) for n in ck.sections[NODES].tolist()]
+    offs = ck.sections[EDGE_OFFSETS].tolist()
+    las = [ck.label(k) for k in ck.sections[EDGE_LABELS].tolist()]
+    tgts = [ps[i] for i in ck.sections[EDGE_TARGETS].tolist()]
+    es = Edges({}, {}, None, [], [], None)
+    for i, p in enumerate(ps):
+        row = las[offs[i]:offs[i+1]]
+        es.labels[p] = set(row)
+        for la, q in zip(row, tgts[offs[i]:offs[i+1]]):
+            es.targets[(p, la)] = q
+    tm = {ps[i]: ck.type_at(k) for i, k in enumerate(ck.sections[NODE_TYPES].tolist()) if k >= 0}
+    vm = {ps[i]: ck.value_at(k) for i, k in enumerate(ck.sections[NODE_VALUES].tolist()) if k >= 0}
+
+    if ps:
+        NODE_FACTORY.reserve(ps[-1].id)
+    return (LayoutGraph(set(ps), es, ck.node(ck.root)), tm, vm)
+
+def load_state(path):
+    ck = Checkpoint(path)
+    try:
+        if ck.kind != STATE_KIND:
+            raise BadCheckpoint()
+        g, tm, vm = read_graph(ck)
+        g.edges.frames.extend(ck.node(i) for i in ck.frames)
+        return StateGraph(g, tm, vm)
+    finally:
+        ck.close()
+
+def load_pattern(path):
+    '(pattern graph, references)'
+    ck = Checkpoint(path)
+    try:
+        if ck.kind != PATTERN_KIND:
+            raise BadCheckpoint()
+        (ns, es, r), tm, vm = read_graph(ck)
+        es = Edges(es.labels, es.targets)
+        refs = ck.read_refs()
+        return (PatternGraph(LayoutGraph(ns, es, r), tm), refs)
+    finally:
+        ck.close()
+
+def load_query(path):
+    pg, refs = load_pattern(path)
+    return Query(pg, refs, compile_pattern(pg))
+
+def load_extra(path):
+    ck = Checkpoint(path)
+    try:
+        if ck.kind != EXTRA_KIND:
+            raise BadCheckpoint()
+        (ns, es, r), tm, vm = read_graph(ck)
+        form = ck.take()
+        pgs = []
+        fs = []
+        rms = []
+        for k in range(ck.take()):
+            r = ck.node(ck.take())
+            us = {ck.node(ck.take()) for j in range(ck.take())}
+            es2 = Edges({u: es.labels[u] for u in us},
+                {(u, la): es.targets[(u, la)] for u in us for la in es.labels[u]})
+            pgs.append(PatternGraph(LayoutGraph(us, es2, r), {u: tm[u] for u in us}))
+            rms.append(ck.read_refs())
+            f = bidict((ck.node(ck.take()), Node(ck.take())) for j in range(ck.take()))
+            if f:
+                NODE_FACTORY.reserve(max(q.id for q in f.values()))
+            fs.append(f)
+    finally:
+        ck.close()
+
+    ms = [compile_pattern(pg) for pg in pgs]
+    if form == ONE_FORM:
+        return Extra((pgs[0], rms[0], ms[0]))
+    if form == CONJ_FORM:
+        return Extra((pgs, fs, rms, ms, conj_bindings(pgs, rms)))
+    if form == DISJ_FORM:
+        return Extra((pgs, fs, rms, ms, disj_bindings(pgs, fs, rms)))
+    raise BadCheckpoint()
+
+
+##
+## end of checkpoint.py
+##$Id$
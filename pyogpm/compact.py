@@ -0,0 +1,379 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    compact state graphs, dense node ids and array adjacency
+
+'''
+
+from array import array
+from collections import deque
+
+from subtype import (
+    NULL_TYPE,
+    Value)
+
+from graph import (
+    Node,
+    NoScope,
+    UndefVar,
+    UndefAttr,
+    find_lvar)
+
+class CompactNodes:
+    def __init__(self, g):
+        self.g = g
+
+    def __len__(self):
+        return len(self.g.cla)
+
+    def __contains__(self, p):
+        return 0 <= p.id - self.g.base < len(self.g.cla)
+
+    def __iter__(self):
+        return (self.g.node(i) for i in range(len(self.g.cla)))
+
+class CompactRow:
+    def __init__(self, g, i):
+        self.g = g
+        self.i = i
+
+    def __contains__(self, la):
+        return self.g.target(self.i, la) is not None
+
+    def __iter__(self):
+        g = self.g
+        return (g.label_tab[lid] for lid in g.row_labels(self.i))
+
+    def __len__(self):
+        return len(self.g.row_labels(self.i))
+
+class CompactLabels:
+    def __init__(self, g):
+        self.g = g
+
+    def __getitem__(self, p):
+        g = self.g
+        i = p.id - g.base
+        if not 0 <= i < len(g.cla):
+            raise KeyError(p)
+        if i in g.extra:
+            return CompactRow(g, i)
+        return g.shape_las[g.shape[i]]
+
+    def __contains__(self, p):
+        return p in self.g.nodes
+
+class CompactTargets:
+    def __init__(self, g):
+        self.g = g
+
+    def __getitem__(self, k):
+        p, la = k
+        g = self.g
+        q = g.target(p.id - g.base, la)
+        if q is None:
+            raise KeyError(k)
+        return Node(g.base + q)
+
+    def __contains__(self, k):
+        p, la = k
+        g = self.g
+        return g.target(p.id - g.base, la) is not None
+
+class CompactEdges:
+    def __init__(self, g):
+        self.labels = CompactLabels(g)
+        self.targets = CompactTargets(g)
+        self.refs = None
+        self.watchers = []
+        self.consts = None
+
+class CompactLayout:
+    def __init__(self, g):
+        self.g = g
+        self.nodes = g.nodes
+        self.edges = CompactEdges(g)
+
+    @property
+    def root(self):
+        return self.g.node(self.g.root)
+
+    def __iter__(self):
+        return iter((self.nodes, self.edges, self.root))
+
+class CompactTypes:
+    def __init__(self, g):
+        self.g = g
+
+    def __getitem__(self, p):
+        g = self.g
+        i = p.id - g.base
+        c = g.cla[i] if 0 <= i < len(g.cla) else -1
+        if c < 0:
+            raise KeyError(p)
+        return g.cla_tab[c]
+
+    def __contains__(self, p):
+        return p in self.g.nodes and self.g.cla[self.g.row(p)] >= 0
+
+class CompactValues:
+    def __init__(self, g):
+        self.g = g
+
+    def __getitem__(self, p):
+        v = self.g.vals[self.g.row(p)] if p in self.g.nodes else None
+        if v is None:
+            raise KeyError(p)
+        return Value(self.g.cla_tab[self.g.cla[self.g.row(p)]], v)
+
+    def __contains__(self, p):
+        return p in self.g.nodes and self.g.vals[self.g.row(p)] is not None
+
+class CompactStateGraph:
+    '''
+        node i owns the edge slots off[i] to off[i+1] of etgt, in the
+        label order of its shape. shapes are interned, each with its
+        label set and a slot per label, so a lookup probes no edge.
+        labels swung onto a node after allocation go to extra.
+        row i is handed out as Node(base + i), and a collection moves
+        base past every handle issued so far, so stale handles miss.
+    '''
+    def __init__(self):
+        self.base = 0
+        self.label_ids = {}
+        self.label_tab = []
+        self.cla_ids = {}
+        self.cla_tab = []
+        self.cla = array('i')
+        self.off = array('i', [0])
+        self.shape = array('i')
+        self.shape_ids = {}
+        self.shape_lids = []
+        self.shape_las = []
+        self.shape_pos = []
+        self.etgt = array('i')
+        self.vals = []
+        self.extra = {}
+        self.nodes = CompactNodes(self)
+        self.layout = CompactLayout(self)
+        self.types = CompactTypes(self)
+        self.values = CompactValues(self)
+        self.root = self.new_row(-1, [], [])
+        self.frames = [self.root]
+
+    def __iter__(self):
+        return iter((self.layout, self.types, self.values))
+
+    def node(self, i):
+        return Node(self.base + i)
+
+    def frame_nodes(self):
+        return [self.node(i) for i in self.frames]
+
+    def row(self, p):
+        'the row of a live handle, -1 for a stale or foreign one'
+        i = p.id - self.base
+        return i if 0 <= i < len(self.cla) else -1
+
+    def live_row(self, p):
+        i = self.row(p)
+        if i < 0:
+            raise KeyError(p)
+        return i
+
+    def intern_label(self, la):
+        lid = self.label_ids.get(la)
+        if lid is None:
+            lid = len(self.label_tab)
+            self.label_ids[la] = lid
+            self.label_tab.append(la)
+        return lid
+
+    def intern_cla(self, cla):
+        c = self.cla_ids.get(id(cla))
+        if c is None:
+            c = len(self.cla_tab)
+            self.cla_ids[id(cla)] = c
+            self.cla_tab.append(cla)
+        return c
+
+    def intern_shape(self, lids):
+        lids = tuple(lids)
+        sid = self.shape_ids.get(lids)
+        if sid is None:
+            sid = len(self.shape_lids)
+            las = [self.label_tab[lid] for lid in lids]
+            self.shape_ids[lids] = sid
+            self.shape_lids.append(lids)
+            self.shape_las.append(frozenset(las))
+            self.shape_pos.append({la: k for k, la in enumerate(las)})
+        return sid
+
+    def new_row(self, c, lids, tids, v = None):
+        i = len(self.cla)
+        self.cla.append(c)
+        self.shape.append(self.intern_shape(lids))
+        self.etgt.extend(tids)
+        self.off.append(len(self.etgt))
+        self.vals.append(v)
+        return i
+
+    def row_labels(self, i):
+        lids = list(self.shape_lids[self.shape[i]])
+        if i in self.extra:
+            lids.extend(self.extra[i])
+        return lids
+
+    def target(self, i, la):
+        'row of the la successor of row i, None if there is none'
+        if not 0 <= i < len(self.cla):
+            return None
+        k = self.shape_pos[self.shape[i]].get(la)
+        if k is not None:
+            return self.etgt[self.off[i] + k]
+        x = self.extra.get(i)
+        if x is None:
+            return None
+        return x.get(self.label_ids.get(la))
+
+    def successors(self, i):
+        ts = list(self.etgt[self.off[i]:self.off[i+1]])
+        if i in self.extra:
+            ts.extend(self.extra[i].values())
+        return ts
+
+    def add_object_to_state(self, cla):
+        las = list(cla.attrs)
+        p = len(self.cla)
+        lids = [self.intern_label(la) for la in las]
+        self.new_row(self.intern_cla(cla), lids, range(p+1, p+1+len(las)))
+        c = self.intern_cla(NULL_TYPE)
+        for la in las:
+            self.new_row(c, [], [])
+        for w in self.layout.edges.watchers:
+            w.allocated(self.node(p), cla)
+            for i, la in enumerate(las):
+                w.allocated(self.node(p+1+i), NULL_TYPE)
+                w.swung(self.node(p), la, self.node(p+1+i))
+        return self.node(p)
+
+    def add_value_to_state(self, v):
+        p = self.new_row(self.intern_cla(v.cla), [], [], v.value)
+        for w in self.layout.edges.watchers:
+            w.allocated(self.node(p), v.cla)
+        return self.node(p)
+
+    def swing_state(self, p, la, q):
+        i = self.live_row(p)
+        j = self.live_row(q)
+        k = self.shape_pos[self.shape[i]].get(la)
+        if k is None:
+            self.extra.setdefault(i, {})[self.intern_label(la)] = j
+        else:
+            self.etgt[self.off[i] + k] = j
+        for w in self.layout.edges.watchers:
+            w.swung(p, la, q)
+
+    def find_var(self, sla, la):
+        r = self.root
+        q = self.target(r, la)
+        while q is None:
+            r = self.target(r, sla)
+            if r is None:
+                raise UndefVar()
+            q = self.target(r, la)
+        return self.node(q)
+
+    def find_lvar_at(self, sla, la, depth):
+        if depth is not None and depth < len(self.frames):
+            r = self.frames[-1-depth]
+            if self.target(r, la) is not None:
+                return (self.node(r), la)
+        return find_lvar(self, sla, la)
+
+    def find_var_at(self, sla, la, depth):
+        if depth is not None and depth < len(self.frames):
+            q = self.target(self.frames[-1-depth], la)
+            if q is not None:
+                return self.node(q)
+        return self.find_var(sla, la)
+
+    def find_attr(self, p, la):
+        i = p.id - self.base
+        if not 0 <= i < len(self.cla):
+            raise UndefVar()
+        q = self.target(i, la)
+        if q is None:
+            raise UndefAttr()
+        return Node(self.base + q)
+
+    def push_state(self, sla):
+        r = self.root
+        self.root = self.new_row(-1, [self.intern_label(sla)], [r])
+        self.frames.append(self.root)
+        for w in self.layout.edges.watchers:
+            w.allocated(self.node(self.root), None)
+            w.swung(self.node(self.root), sla, self.node(r))
+        return self
+
+    def pop_state(self, sla, collect = True):
+        r2 = self.target(self.root, sla)
+        if r2 is None:
+            raise NoScope()
+
+        self.root = r2
+        self.frames.pop()
+        if not collect:
+            return self
+
+        return self.gc_state()
+
+    def gc_state(self):
+        'live nodes are renumbered densely in breadth-first order'
+        ids = {self.root: 0}
+        order = [self.root]
+        queue = deque(order)
+        while queue:
+            i = queue.popleft()
+            for j in self.successors(i):
+                if j not in ids:
+                    ids[j] = len(order)
+                    order.append(j)
+                    queue.append(j)
+
+        cla = array('i')
+        off = array('i', [0])
+        shape = array('i')
+        etgt = array('i')
+        vals = []
+        for i in order:
+            cla.append(self.cla[i])
+            shape.append(self.intern_shape(self.row_labels(i)))
+            etgt.extend(ids[j] for j in self.successors(i))
+            off.append(len(etgt))
+            vals.append(self.vals[i])
+
+        base = self.base + len(self.cla)
+        ws = self.layout.edges.watchers
+        if ws:
+            f = {self.node(i): Node(base + j) for i, j in ids.items()}
+        self.cla, self.off, self.shape, self.etgt, self.vals = cla, off, shape, etgt, vals
+        self.base = base
+        self.extra = {}
+        self.root = 0
+        self.frames = [ids[i] for i in self.frames]
+        for w in ws:
+            w.renumbered(f)
+        return self
+
+def init_compact_state_graph():
+    return CompactStateGraph()
+
+
+##
+## end of compact.py
+##$Id$
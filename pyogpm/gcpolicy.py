@@ -0,0 +1,111 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    policies deciding when the state graph is collected
+
+'''
+
+import time
+
+from graph import (
+    Watcher,
+    watch_state,
+    unwatch_state,
+    gc_state)
+
+STMT_EVENT = 'stmt'
+BLOCK_EVENT = 'block'
+SCOPE_EVENT = 'scope'
+
+class GcPolicy(Watcher):
+    'one policy serves one run at a time, from start to stop'
+    def __init__(self):
+        self.requests = 0
+        self.collections = 0
+        self.elapsed = 0.0
+
+    def start(self, sg):
+        pass
+
+    def stop(self, sg):
+        pass
+
+    def due(self, sg, event):
+        return True
+
+    def collect(self, sg, event):
+        self.requests += 1
+        if not self.due(sg, event):
+            return sg
+
+        t = time.perf_counter()
+        sg = gc_state(sg)
+        self.elapsed += time.perf_counter() - t
+        self.collections += 1
+        self.collected(sg)
+        return sg
+
+    def collected(self, sg):
+        pass
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'collections': self.collections,
+            'elapsed': self.elapsed}
+
+class EveryStmt(GcPolicy):
+    pass
+
+class EveryAllocs(GcPolicy):
+    'counts the allocations of the graph it runs on, whatever its backend'
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+        self.allocs = 0
+
+    def start(self, sg):
+        self.allocs = 0
+        watch_state(sg, self)
+
+    def stop(self, sg):
+        unwatch_state(sg, self)
+
+    def allocated(self, p, t):
+        self.allocs += 1
+
+    def due(self, sg, event):
+        return self.allocs >= self.n
+
+    def collected(self, sg):
+        self.allocs = 0
+
+class OnScopeExit(GcPolicy):
+    def due(self, sg, event):
+        return event == SCOPE_EVENT
+
+class NodeThreshold(GcPolicy):
+    'the threshold doubles past the live size so a full heap does not thrash'
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+        self.limit = n
+
+    def due(self, sg, event):
+        return len(sg.layout.nodes) >= self.limit
+
+    def collected(self, sg):
+        self.limit = max(self.n, 2*len(sg.layout.nodes))
+
+class Never(GcPolicy):
+    def due(self, sg, event):
+        return False
+
+
+##
+## end of gcpolicy.py
+##$Id$
@@ -14,10 +14,14 @@ from queue import Queue
 
 from bidict import bidict
 from pp import PrfxPP, sorted_list
+from refcount import RefCounter
 
 from subtype import (
     NULL_TYPE,
+    VALUE_TYPES,
+    Value,
     ValueSet, 
+    VALUE_CONSTRAINTS,
     exists_ty_le_all,
     ty_inf,
     ty_sup)
@@ -32,7 +36,7 @@ PatternGraph = namedtuple('PatternGraph', ['layout', 'types'])
 StateGraph = namedtuple('StateGraph', ['layout', 'types', 'values'])
 Node = namedtuple('Node', ['id'])
 Label = namedtuple('Label', ['id'])
-Edges = namedtuple('Edges', ['labels', 'targets'])
+Edges = namedtuple('Edges', ['labels', 'targets', 'refs', 'watchers', 'frames', 'consts'], defaults = [None, None, None, None])
 
 class GraphError(Exception): pass
 class Mismatch(GraphError):  pass
@@ -44,6 +48,130 @@ class NoScope(GraphError):  pass
 class UndefVar(GraphError):  pass
 class UndefAttr(GraphError):  pass
 
+class Watcher:
+    'notified of changes to the state graphs it watches'
+    def swung(self, p, la, q):
+        pass
+    
+    def dropped(self, p, la, q):
+        'the edge is about to be swung away from q'
+        pass
+    
+    def allocated(self, p, t):
+        't is None for scope frames'
+        pass
+    
+    def freed(self, p, out):
+        'out lists the (la, q) edges p still had'
+        pass
+    
+    def renumbered(self, f):
+        'f maps each surviving node to its new handle, the others were freed'
+        self.reset()
+
+    def reset(self):
+        pass
+
+def watch_state(sg, w):
+    ws = sg.layout.edges.watchers
+    if w not in ws:
+        ws.append(w)
+
+def unwatch_state(sg, w):
+    ws = sg.layout.edges.watchers
+    if w in ws:
+        ws.remove(w)
+
+class GraphIndex(Watcher):
+    '''
+        reverse edges, typed nodes by type and source nodes by label
+        of one graph, built by a scan and then kept up to date from
+        the watcher events. reset rescans g, by default the one last
+        scanned, a full gc_state of a StateGraph builds a new one.
+    '''
+    def __init__(self, g, tm = None):
+        self.reset(g, tm)
+
+    def reset(self, g = None, tm = None):
+        if g is not None:
+            self.g = g
+            self.tm = {} if tm is None else tm
+        ns, es, r = self.g
+        tm = self.tm
+        self.rev = {}
+        self.types = {}
+        self.by_type = {}
+        self.by_label = {}
+        rev = self.rev
+        by_label = self.by_label
+        for p in ns:
+            if p in tm:
+                self.allocated(p, tm[p])
+            for la in es.labels[p]:
+                q = es.targets[(p, la)]
+                if q in rev:
+                    rev[q].add((p, la))
+                else:
+                    rev[q] = {(p, la)}
+                if la in by_label:
+                    by_label[la].add(p)
+                else:
+                    by_label[la] = {p}
+
+    def swung(self, p, la, q):
+        self.rev.setdefault(q, set()).add((p, la))
+        self.by_label.setdefault(la, set()).add(p)
+
+    def dropped(self, p, la, q):
+        self.rev[q].discard((p, la))
+
+    def allocated(self, p, t):
+        if t is not None:
+            self.types[p] = t
+            self.by_type.setdefault(t, set()).add(p)
+
+    def freed(self, p, out):
+        t = self.types.pop(p, None)
+        if t is not None:
+            self.by_type[t].discard(p)
+        for la, q in out:
+            self.by_label[la].discard(p)
+            if q in self.rev:
+                self.rev[q].discard((p, la))
+        self.rev.pop(p, None)
+
+    def renumbered(self, f):
+        self.rev = {f[q]: {(f[p], la) for p, la in es if p in f} for q, es in self.rev.items() if q in f}
+        self.types = {f[p]: t for p, t in self.types.items() if p in f}
+        self.by_type = {t: {f[p] for p in ps if p in f} for t, ps in self.by_type.items()}
+        self.by_label = {la: {f[p] for p in ps if p in f} for la, ps in self.by_label.items()}
+
+    def sources(self, q):
+        '(p, la) for each edge into q'
+        return self.rev.get(q, set())
+
+    def reaching(self, qs):
+        'nodes with a path to any of qs, over the reverse edges'
+        seen = set(qs)
+        stack = list(seen)
+        while stack:
+            for p, la in self.rev.get(stack.pop(), ()):
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+        return seen
+
+def index_layout(g, tm = None):
+    'a GraphIndex maintained by the swings, allocations and collections of g'
+    idx = GraphIndex(g, tm)
+    ws = g.edges.watchers
+    if idx not in ws:
+        ws.append(idx)
+    return idx
+
+def index_state(sg):
+    return index_layout(sg.layout, sg.types)
+    
 def unzip2(s):
     if not s:
         return ([], [])
@@ -66,6 +194,16 @@ def set_inter(ss):
     
     return set()
 
+def run_dfs(f, *args):
+    'runs generator f depth-first, each yielded tuple is a recursive call'
+    stack = [f(*args)]
+    while stack:
+        args = next(stack[-1], None)
+        if args is None:
+            stack.pop()
+        else:
+            stack.append(f(*args))
+
 def layout_graph_to_pp(g):
     ns, es, p = g
     pp = {}
@@ -82,14 +220,50 @@ class NodeFactory:
         self._cur_id += 1
         return Node(self._cur_id)
 
+    def reserve(self, i):
+        'ids up to i are taken by nodes made elsewhere'
+        if self._cur_id < i:
+            self._cur_id = i
+
 NODE_FACTORY = NodeFactory()
 
 def new_node():
     return NODE_FACTORY.new_node()
 
-def init_state_graph():
+class ValueInterner:
+    '''
+        one node and one singleton ValueSet per constant value.
+        value nodes are immutable, but interned ones are no longer
+        distinct, so patterns telling equal values apart by identity
+        (injectivity, shared references) see them as one node.
+    '''
+    def __init__(self):
+        self.nodes = {}
+        self.sets = {}
+
+    def node(self, sg, v):
+        'nodes reclaimed by an incremental collection are re-added'
+        p = self.nodes.get(v)
+        if p is None or p not in sg.layout.nodes:
+            p = add_value_to_state(sg, v)
+            self.nodes[v] = p
+        return p
+
+    def value_set(self, v):
+        vs = self.sets.get(v)
+        if vs is None:
+            vs = ValueSet({v})
+            self.sets[v] = vs
+        return vs
+
+    def collected(self, ns):
+        self.nodes = {v: p for v, p in self.nodes.items() if p in ns}
+
+def init_state_graph(incremental = False, intern = False):
     p = new_node()
-    return StateGraph(LayoutGraph({p}, Edges({p: set()}, {}), p), {}, {})
+    refs = RefCounter(p) if incremental else None
+    consts = ValueInterner() if intern else None
+    return StateGraph(LayoutGraph({p}, Edges({p: set()}, {}, refs, [], [p], consts), p), {}, {})
 
 def gc_layout(g):
     ns, es, r = g
@@ -112,11 +286,31 @@ def gc_layout(g):
     return LayoutGraph(ns2, es2, r)
 
 def gc_state(sg):
+    if type(sg) is not StateGraph:
+        return sg.gc_state()
+    
     g, tm, vm = sg
-    g2 = gc_layout(g)
-    tm2 = {p: t for (p, t) in tm.items() if p in g2.nodes}
-    vm2 = {p: v for (p, v) in vm.items() if p in g2.nodes}
-    return StateGraph(g2, tm2, vm2)
+    if g.edges.refs is not None:
+        g.edges.refs.collect(g, tm, vm)
+        return sg
+    
+    ns2, es2, r = gc_layout(g)
+    if g.edges.watchers:
+        for u in g.nodes - ns2:
+            out = [(la, g.edges.targets[(u, la)]) for la in g.edges.labels[u]]
+            for w in g.edges.watchers:
+                w.freed(u, out)
+    tm2 = {p: t for (p, t) in tm.items() if p in ns2}
+    vm2 = {p: v for (p, v) in vm.items() if p in ns2}
+    es2 = Edges(es2.labels, es2.targets, None, g.edges.watchers, g.edges.frames, g.edges.consts)
+    if es2.consts is not None:
+        es2.consts.collected(ns2)
+    return StateGraph(LayoutGraph(ns2, es2, r), tm2, vm2)
+
+def track_state(sg):
+    (ns, es, r), tm, vm = gc_state(sg)
+    es2 = Edges(es.labels, es.targets, RefCounter.track(ns, es, r), es.watchers, es.frames, es.consts)
+    return StateGraph(LayoutGraph(ns, es2, r), tm, vm)
 
 def extract_pattern(sg, p):
     (ns, es, r), tm, vm = sg
@@ -124,12 +318,44 @@ def extract_pattern(sg, p):
     tm2 = {u: ValueSet({vm[u]}) if u in vm else tm[u] for u in g2.nodes}
     return PatternGraph(g2, tm2)
 
+class ValueTypes:
+    'types of a state graph read as a pattern, values as singleton sets'
+    def __init__(self, tm, vm, consts = None):
+        self.tm = tm
+        self.vm = vm
+        self.consts = consts
+    
+    def __getitem__(self, u):
+        if u in self.vm:
+            if self.consts is not None:
+                return self.consts.value_set(self.vm[u])
+            return ValueSet({self.vm[u]})
+        return self.tm[u]
+    
+    def __contains__(self, u):
+        return u in self.tm
+
+def view_pattern(sg, p):
+    (ns, es, r), tm, vm = sg
+    return PatternGraph(LayoutGraph(ns, es, p), ValueTypes(tm, vm, es.consts))
+
 def swing_layout(g, p, la, q):
     ns, es, r = g
+    if es.refs is not None:
+        es.refs.swing(es, p, la, q)
+    if es.watchers and (p, la) in es.targets:
+        for w in es.watchers:
+            w.dropped(p, la, es.targets[(p, la)])
     es.labels[p].add(la)
     es.targets[(p, la)] = q
+    if es.watchers:
+        for w in es.watchers:
+            w.swung(p, la, q)
     
 def swing_state(sg, p, la, q):
+    if type(sg) is not StateGraph:
+        return sg.swing_state(p, la, q)
+    
     swing_layout(sg.layout, p, la, q)
     
 def add_object_to_layout(g, cla):
@@ -146,9 +372,22 @@ def add_object_to_layout(g, cla):
         es.targets[(p, la)] = q
         qs.append(q)
 
+    if es.refs is not None:
+        es.refs.alloc(p, qs)
+
+    if es.watchers:
+        for w in es.watchers:
+            w.allocated(p, cla)
+            for la, q in zip(las, qs):
+                w.allocated(q, NULL_TYPE)
+                w.swung(p, la, q)
+
     return (p, qs)
 
 def add_object_to_state(sg, cla):
+    if type(sg) is not StateGraph:
+        return sg.add_object_to_state(cla)
+    
     g, tm, vm = sg
     p, qs  = add_object_to_layout(g, cla)
     tm[p] = cla
@@ -157,25 +396,122 @@ def add_object_to_state(sg, cla):
         
     return p
     
+def add_value_to_layout(g, cla):
+    'add_object_to_layout for the attributeless value classes'
+    ns, es, r = g
+    p = new_node()
+    ns.add(p)
+    es.labels[p] = set()
+    if es.refs is not None:
+        es.refs.alloc(p, ())
+
+    if es.watchers:
+        for w in es.watchers:
+            w.allocated(p, cla)
+
+    return p
+
 def add_value_to_state(sg, v):
-    p  = add_object_to_state(sg, v.cla)
+    if type(sg) is not StateGraph:
+        return sg.add_value_to_state(v)
+    
+    p = add_value_to_layout(sg.layout, v.cla)
+    sg.types[p] = v.cla
     sg.values[p] = v
     return p
     
+def value_of(sg, p):
+    'p is a value node or an unboxed Value'
+    if type(p) is Value:
+        return p
+    
+    return sg.values[p]
+
+def box_value(sg, p):
+    'a node for p, unboxed values are allocated only here'
+    if type(p) is Value:
+        consts = sg.layout.edges.consts
+        if consts is not None:
+            return consts.node(sg, p)
+        return add_value_to_state(sg, p)
+    
+    return p
+
+def reuse_value(sg, q, v, w = None):
+    '''
+        v written over the value node q in place of box_value(sg, v),
+        for a q that only the edge being swung refers to. nothing but
+        w may watch sg, and the id box_value would take is taken, so
+        the state differs from boxing only by the garbage it avoids.
+        False if the backend cannot, sg is then left as it was.
+    '''
+    if type(sg) is not StateGraph or v.cla not in VALUE_TYPES:
+        return False
+
+    es = sg.layout.edges
+    ws = es.watchers
+    if es.refs is not None or es.consts is not None or (ws and (len(ws) > 1 or ws[0] is not w)):
+        return False
+
+    new_node()
+    sg.types[q] = v.cla
+    sg.values[q] = v
+    return True
+    
+def fork_state(sg):
+    'a state to try things on, sg itself unless the backend forks cheaply'
+    if hasattr(sg, 'fork'):
+        return sg.fork(True)
+
+    return sg
+
+def join_state(sg, sg2, keep):
+    'sg with the changes made on sg2 = fork_state(sg) kept, or undone'
+    if sg2 is sg:
+        return sg
+
+    if keep:
+        return sg.adopt(sg2)
+
+    return sg.drop(sg2)
+
 def push_state(sg, sla):
+    if type(sg) is not StateGraph:
+        return sg.push_state(sla)
+    
     (ns, es, r), tm, vm = sg
     r2 = new_node()
     ns.add(r2)
     es.labels[r2] = {sla}
     es.targets[(r2, sla)] = r
+    if es.refs is not None:
+        es.refs.push(r2, r)
+    if es.frames is not None:
+        es.frames.append(r2)
+    if es.watchers:
+        for w in es.watchers:
+            w.allocated(r2, None)
+            w.swung(r2, sla, r)
     return StateGraph(LayoutGraph(ns, es, r2), tm, vm)
 
-def pop_state(sg, sla):
+def pop_state(sg, sla, collect = True):
+    if type(sg) is not StateGraph:
+        return sg.pop_state(sla, collect)
+    
     (ns, es, r), tm, vm = sg
     if sla not in es.labels[r]:
         raise NoScope()
     
-    return gc_state(StateGraph(LayoutGraph(ns, es, es.targets[(r, sla)]), tm, vm))
+    r2 = es.targets[(r, sla)]
+    if es.refs is not None:
+        es.refs.reroot(r, r2)
+    if es.frames is not None:
+        es.frames.pop()
+    sg2 = StateGraph(LayoutGraph(ns, es, r2), tm, vm)
+    if not collect:
+        return sg2
+    
+    return gc_state(sg2)
     
 def find_lvar(sg, sla, la):
     (ns, es, r), tm, vm = sg
@@ -187,7 +523,49 @@ def find_lvar(sg, sla, la):
     
     return (r, la)
 
+def frame_at(sg, la, depth):
+    'the frame depth scopes out if it binds la and the frame stack is in step, else None'
+    g = sg.layout
+    es = g.edges
+    frames = es.frames
+    if depth is not None and frames and frames[-1] == g.root and depth < len(frames):
+        r2 = frames[-1-depth]
+        if la in es.labels[r2]:
+            return r2
+    
+    return None
+
+def frame_nodes(sg):
+    'the scope frames, outermost first'
+    if type(sg) is not StateGraph:
+        return sg.frame_nodes()
+
+    return list(sg.layout.edges.frames or ())
+
+def find_lvar_at(sg, sla, la, depth):
+    if type(sg) is not StateGraph:
+        return sg.find_lvar_at(sla, la, depth)
+    
+    r = frame_at(sg, la, depth)
+    if r is not None:
+        return (r, la)
+    
+    return find_lvar(sg, sla, la)
+
+def find_var_at(sg, sla, la, depth):
+    if type(sg) is not StateGraph:
+        return sg.find_var_at(sla, la, depth)
+    
+    r = frame_at(sg, la, depth)
+    if r is not None:
+        return sg.layout.edges.targets[(r, la)]
+    
+    return find_var(sg, sla, la)
+
 def find_var(sg, sla, la):
+    if type(sg) is not StateGraph:
+        return sg.find_var(sla, la)
+    
     return sg.layout.edges.targets[find_lvar(sg, sla, la)]
 
 def find_lattr(sg, p, la):
@@ -201,14 +579,19 @@ def find_lattr(sg, p, la):
     return (p, la)
 
 def find_attr(sg, p, la):
+    if type(sg) is not StateGraph:
+        return sg.find_attr(p, la)
+    
     return sg.layout.edges.targets[find_lattr(sg, p, la)]
 
 def cons_match(g1, g2, le, tau1, tau2):
     ns1, es1, p1 = g1
     ns2, es2, p2 = g2
     f = bidict()
+    stack = [(p1, p2)]
     
-    def dfs_match(es1, p1, es2, p2):
+    while stack:
+        p1, p2 = stack.pop()
         if p1 in f:
             if f[p1] != p2:
                 raise Mismatch()
@@ -220,14 +603,17 @@ def cons_match(g1, g2, le, tau1, tau2):
             
             f[p1] = p2
             
+            qs = []
             for la in es1.labels[p1]:
                 q1 = es1.targets[(p1, la)]
                 if la not in es2.labels[p2]:
                     raise Mismatch()
                 q2 = es2.targets[(p2, la)]
-                dfs_match(es1, q1, es2, q2)
+                qs.append((q1, q2))
+            'reversed, so children pop in the recursive preorder'
+            qs.reverse()
+            stack.extend(qs)
     
-    dfs_match(es1, p1, es2, p2)
     return f
 
 def cons_union(gs):
@@ -255,9 +641,9 @@ def cons_union(gs):
                 jz = [j for j in iz if la in ess[j].labels[ps[j]]]
                 for j in jz:
                     qs[j] = ess[j].targets[(ps[j], la)]
-                dfs_union(jz, qs)
+                yield (jz, qs)
                 
-    dfs_union(list(range(len(gs))), ps)
+    run_dfs(dfs_union, list(range(len(gs))), ps)
     return fs
     
 def cons_inter(gs):
@@ -276,9 +662,9 @@ def cons_inter(gs):
             laz = set_inter(es.labels[p] for es, p in zip(ess, ps))
             for la in laz:
                 qs = [es.targets[(p, la)] for es, p in zip(ess, ps)]
-                dfs_inter(qs)
+                yield (qs,)
     
-    dfs_inter(ps)
+    run_dfs(dfs_inter, ps)
     return fs
 
 def cons_match_conj(pgs):
@@ -312,6 +698,7 @@ def cons_pattern_graph(pattern):
     es = Edges({}, {})
     tm = {}
     rm = bidict()
+    back = {}
     
     def parse(pattern):
         if type(pattern) is LabeledPattern:
@@ -322,12 +709,12 @@ def cons_pattern_graph(pattern):
                 if r in ns:
                     raise RedefRef()
                 'E[p/r]'
-                nlas = [nla for nla, u in es.targets.items() if u == r]
+                nlas = back.pop(r, [])
                 for nla in nlas:
                     es.targets[nla] = p
+                back.setdefault(p, []).extend(nlas)
                 'R[p/r]'
-                las2 = [la2 for la2, u in rm.items() if u == r]
-                for la2 in las2:
+                for la2 in list(rm.inv.get(r, [])):
                     rm[la2] = p
                 
             rm[la] = p
@@ -340,6 +727,7 @@ def cons_pattern_graph(pattern):
             es.labels[p] = set(las)
             for la, q in zip(las, qs):
                 es.targets[(p, la)] = q
+                back.setdefault(q, []).append((p, la))
         elif type(pattern) is PatternRef:
             la = pattern.label
             if la in rm:
@@ -347,7 +735,7 @@ def cons_pattern_graph(pattern):
             else:
                 p = new_node()
                 rm[la] = p    
-        elif type(pattern) is ValueSet:
+        elif type(pattern) is ValueSet or type(pattern) in VALUE_CONSTRAINTS:
             p = new_node()
             ns.add(p)
             es.labels[p] = set()
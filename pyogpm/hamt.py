@@ -0,0 +1,222 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    hash array mapped tries, persistent maps with structural sharing
+
+'''
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+class Bitmap:
+    '''
+        a trie node. entries are ordered by the set bits of bitmap,
+        each a (hash, key, value) leaf, a Bitmap or a Collision. only
+        the map that owns a node changes it in place.
+    '''
+    __slots__ = ('bitmap', 'entries', 'owner')
+
+    def __init__(self, bitmap, entries, owner):
+        self.bitmap = bitmap
+        self.entries = entries
+        self.owner = owner
+
+class Collision:
+    'leaves whose hashes agree on every bit, never changed in place'
+    __slots__ = ('hash', 'leaves')
+
+    def __init__(self, h, leaves):
+        self.hash = h
+        self.leaves = leaves
+
+def hash64(k):
+    return hash(k) & HASH_MASK
+
+def merge_leaves(l1, l2, shift, owner):
+    if shift >= HASH_BITS:
+        return Collision(l1[0], (l1, l2))
+
+    i1 = (l1[0] >> shift) & MASK
+    i2 = (l2[0] >> shift) & MASK
+    if i1 == i2:
+        return Bitmap(1 << i1, [merge_leaves(l1, l2, shift + BITS, owner)], owner)
+    if i1 < i2:
+        return Bitmap((1 << i1) | (1 << i2), [l1, l2], owner)
+    return Bitmap((1 << i1) | (1 << i2), [l2, l1], owner)
+
+def node_leaves(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        es = node.leaves if type(node) is Collision else node.entries
+        for e in es:
+            if type(e) is tuple:
+                yield e
+            else:
+                stack.append(e)
+
+MISSING = object()
+
+class HamtMap:
+    '''
+        a map over a hash array mapped trie. copy is O(1): both maps
+        give up ownership of every node, so each later change copies
+        only the O(log n) nodes on its path and the rest stays shared.
+    '''
+    def __init__(self, root = None, size = 0):
+        self.owner = object()
+        self.root = Bitmap(0, [], self.owner) if root is None else root
+        self.size = size
+
+    def copy(self):
+        self.owner = object()
+        return HamtMap(self.root, self.size)
+
+    def __len__(self):
+        return self.size
+
+    def get(self, k, default = None):
+        h = hash(k) & HASH_MASK
+        node = self.root
+        shift = 0
+        while True:
+            bit = 1 << ((h >> shift) & MASK)
+            if not node.bitmap & bit:
+                return default
+
+            e = node.entries[(node.bitmap & (bit - 1)).bit_count()]
+            if type(e) is tuple:
+                if e[0] == h and e[1] == k:
+                    return e[2]
+                return default
+
+            if type(e) is Collision:
+                for l in e.leaves:
+                    if l[1] == k:
+                        return l[2]
+                return default
+
+            node = e
+            shift += BITS
+
+    def __getitem__(self, k):
+        v = self.get(k, MISSING)
+        if v is MISSING:
+            raise KeyError(k)
+        return v
+
+    def __contains__(self, k):
+        return self.get(k, MISSING) is not MISSING
+
+    def own(self, node):
+        if node.owner is self.owner:
+            return node
+        return Bitmap(node.bitmap, list(node.entries), self.owner)
+
+    def __setitem__(self, k, v):
+        h = hash(k) & HASH_MASK
+        owner = self.owner
+        node = self.root
+        if node.owner is not owner:
+            node = self.root = Bitmap(node.bitmap, list(node.entries), owner)
+        shift = 0
+        while True:
+            bit = 1 << ((h >> shift) & MASK)
+            i = (node.bitmap & (bit - 1)).bit_count()
+            es = node.entries
+            if not node.bitmap & bit:
+                node.bitmap |= bit
+                es.insert(i, (h, k, v))
+                self.size += 1
+                return
+
+            e = es[i]
+            if type(e) is tuple:
+                if e[0] == h and e[1] == k:
+                    es[i] = (h, k, v)
+                else:
+                    es[i] = merge_leaves(e, (h, k, v), shift + BITS, owner)
+                    self.size += 1
+                return
+
+            if type(e) is Collision:
+                ls = tuple(l for l in e.leaves if l[1] != k)
+                if len(ls) == len(e.leaves):
+                    self.size += 1
+                es[i] = Collision(h, ls + ((h, k, v),))
+                return
+
+            if e.owner is not owner:
+                e = es[i] = Bitmap(e.bitmap, list(e.entries), owner)
+            node = e
+            shift += BITS
+
+    def __delitem__(self, k):
+        if k not in self:
+            raise KeyError(k)
+
+        h = hash64(k)
+        path = []
+        node = self.root = self.own(self.root)
+        shift = 0
+        while True:
+            bit = 1 << ((h >> shift) & MASK)
+            i = (node.bitmap & (bit - 1)).bit_count()
+            e = node.entries[i]
+            if type(e) is Bitmap:
+                path.append((node, i))
+                e = node.entries[i] = self.own(e)
+                node = e
+                shift += BITS
+                continue
+
+            if type(e) is Collision:
+                ls = tuple(l for l in e.leaves if l[1] != k)
+                node.entries[i] = ls[0] if len(ls) == 1 else Collision(e.hash, ls)
+            else:
+                node.bitmap &= ~bit
+                del node.entries[i]
+            break
+
+        self.size -= 1
+        'emptied nodes go, single leaves move up'
+        while path:
+            parent, i = path.pop()
+            if node.entries and (len(node.entries) > 1 or type(node.entries[0]) is not tuple):
+                break
+            if node.entries:
+                parent.entries[i] = node.entries[0]
+            else:
+                parent.bitmap &= ~(1 << ((h >> (BITS * len(path))) & MASK))
+                del parent.entries[i]
+            node = parent
+
+    def pop(self, k, default = MISSING):
+        v = self.get(k, MISSING)
+        if v is MISSING:
+            if default is MISSING:
+                raise KeyError(k)
+            return default
+        del self[k]
+        return v
+
+    def items(self):
+        return ((k, v) for h, k, v in node_leaves(self.root))
+
+    def keys(self):
+        return (k for h, k, v in node_leaves(self.root))
+
+    def values(self):
+        return (v for h, k, v in node_leaves(self.root))
+
+    __iter__ = keys
+
+##
+## end of hamt.py
+##$Id$
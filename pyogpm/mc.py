@@ -0,0 +1,234 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    compilation of pattern graphs to matcher functions
+
+'''
+
+from subtype import subtype
+
+from pattern import (
+    PatternConj,
+    PatternDisj,
+    MatchStmt)
+
+from asx import (
+    IfStmt,
+    WhileStmt,
+    BlockStmt,
+    Program)
+
+def pattern_source(pg, name = 'match'):
+    'straight-line source of cons_match(pattern, scrutinee, subtype, ...)'
+    (ns, es, p), tm = pg
+    consts = {'le': subtype}
+    regs = {p: 'v0'}
+    order = [p]
+    lines = [
+        'def {}(pg):'.format(name),
+        '    (ns, es, v0), ts = pg',
+        '    labels = es.labels',
+        '    targets = es.targets']
+
+    def const(prefix, x):
+        k = '{}{}'.format(prefix, len(consts))
+        consts[k] = x
+        return k
+
+    stack = [p]
+    while stack:
+        u = stack.pop()
+        v = regs[u]
+        lines.append('    if not le(ts[{}], {}):'.format(v, const('T', tm[u])))
+        lines.append('        return None')
+        las = list(es.labels[u])
+        if las:
+            lines.append('    s = labels[{}]'.format(v))
+        for la in las:
+            k = const('L', la)
+            lines.append('    if {} not in s:'.format(k))
+            lines.append('        return None')
+            q = es.targets[(u, la)]
+            if q in regs:
+                lines.append('    if targets[({}, {})] != {}:'.format(v, k, regs[q]))
+                lines.append('        return None')
+            else:
+                regs[q] = 'v{}'.format(len(order))
+                order.append(q)
+                lines.append('    {} = targets[({}, {})]'.format(regs[q], v, k))
+                stack.append(q)
+
+    vs = ', '.join(regs[u] for u in order)
+    if len(order) > 1:
+        lines.append('    if len({{{}}}) != {}:'.format(vs, len(order)))
+        lines.append('        return None')
+    lines.append('    return {{{}}}'.format(', '.join('{}: {}'.format(const('U', u), regs[u]) for u in order)))
+    return ('\n'.join(lines), consts)
+
+def compile_pattern(pg):
+    src, consts = pattern_source(pg)
+    exec(src, consts)
+    return consts['match']
+
+def pattern_tests(pg):
+    '''
+        tests of a pattern graph against paths from the scrutinee root,
+        each test only reads paths established by earlier tests
+    '''
+    (ns, es, p), tm = pg
+    paths = {p: ()}
+    tests = []
+    stack = [p]
+    while stack:
+        u = stack.pop()
+        path = paths[u]
+        t = tm[u]
+        tests.append(('type', path, type(t), t))
+        for la in es.labels[u]:
+            tests.append(('has', path, la))
+            q = es.targets[(u, la)]
+            if q in paths:
+                tests.append(('same', path + (la,), paths[q]))
+            else:
+                paths[q] = path + (la,)
+                stack.append(q)
+
+    if len(paths) > 1:
+        tests.append(('inj', tuple(paths.values())))
+    return (tests, paths)
+
+class TreeNode:
+    def __init__(self, known, test, row):
+        self.known = known
+        self.test = test
+        self.row = row
+        self.yes = None
+        self.no = None
+
+class PathEval:
+    'a scrutinee seen through paths, each path resolved once'
+    def __init__(self, pg):
+        (ns, es, p), ts = pg
+        self.labels = es.labels
+        self.targets = es.targets
+        self.types = ts
+        self.nodes = {(): p}
+
+    def node(self, path):
+        u = self.nodes.get(path)
+        if u is None:
+            u = self.targets[(self.node(path[:-1]), path[-1])]
+            self.nodes[path] = u
+        return u
+
+    def test(self, t):
+        kind = t[0]
+        if kind == 'type':
+            return subtype(self.types[self.node(t[1])], t[3])
+        if kind == 'has':
+            return t[2] in self.labels[self.node(t[1])]
+        if kind == 'same':
+            return self.node(t[1]) == self.node(t[2])
+        us = [self.node(path) for path in t[1]]
+        return len(set(us)) == len(us)
+
+class DecisionTree:
+    '''
+        cases of a match statement merged into one decision tree,
+        built lazily as scrutinees reach new branches.
+        rows are (case index, alternative index, [(tests, paths)]).
+    '''
+    def __init__(self, rows):
+        self.rows = rows
+        self.nodes = {}
+        self.root = self.node({})
+
+    def node(self, known):
+        key = frozenset(known.items())
+        n = self.nodes.get(key)
+        if n is None:
+            n = self.build(known)
+            self.nodes[key] = n
+        return n
+
+    def build(self, known):
+        for row in self.rows:
+            k, j, parts = row
+            tests = [t for ts, paths in parts for t in ts]
+            if any(known.get(t) is False for t in tests):
+                continue
+            for t in tests:
+                if t not in known:
+                    return TreeNode(known, t, None)
+            return TreeNode(known, None, row)
+        return TreeNode(known, None, None)
+
+    def run(self, pg):
+        ev = PathEval(pg)
+        n = self.root
+        while n.test is not None:
+            if ev.test(n.test):
+                if n.yes is None:
+                    n.yes = self.node({**n.known, n.test: True})
+                n = n.yes
+            else:
+                if n.no is None:
+                    n.no = self.node({**n.known, n.test: False})
+                n = n.no
+
+        if n.row is None:
+            return None
+
+        k, j, parts = n.row
+        fs = [{u: ev.node(path) for u, path in paths.items()} for ts, paths in parts]
+        return (k, j, fs)
+
+def match_rows(cas):
+    rows = []
+    for k, (junc, s, extra) in enumerate(cas):
+        if type(junc) is PatternConj:
+            pgs = extra.get()[0]
+            rows.append((k, None, [pattern_tests(pg) for pg in pgs]))
+        elif type(junc) is PatternDisj:
+            pgs = extra.get()[0]
+            rows.extend((k, j, [pattern_tests(pg)]) for j, pg in enumerate(pgs))
+        else:
+            pg = extra.get()[0]
+            rows.append((k, None, [pattern_tests(pg)]))
+    return rows
+
+def compile_match(m):
+    x, cas = m
+    if not cas:
+        return None
+    
+    tree = DecisionTree(match_rows(cas))
+    for ca in cas:
+        ca.extra.tree = tree
+    return tree
+
+def compile_matches(s):
+    'decision trees for every type-checked match statement in s'
+    if type(s) is MatchStmt:
+        compile_match(s)
+        for ca in s.cas:
+            compile_matches(ca.stmt)
+    elif type(s) is IfStmt:
+        compile_matches(s.then_stmt)
+        compile_matches(s.else_stmt)
+    elif type(s) is WhileStmt:
+        compile_matches(s.stmt)
+    elif type(s) is BlockStmt:
+        for s2 in s.stmts:
+            compile_matches(s2)
+    elif type(s) is Program:
+        compile_matches(s.block)
+
+
+##
+## end of mc.py
+##$Id$
@@ -0,0 +1,194 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    match results memoized by the structure of the scrutinee
+
+'''
+
+from collections import OrderedDict, deque
+
+from graph import (
+    Watcher,
+    watch_state,
+    view_pattern)
+
+class Canon:
+    '''
+        canonical form of the subgraph reachable from a node.
+        out-edges are uniquely labelled, so numbering nodes by first
+        visit over sorted labels is already the fixpoint of a
+        Weisfeiler-Lehman refinement, and the form is exact.
+    '''
+    def __init__(self, sg, p):
+        (ns, es, r), tm, vm = sg
+        ids = {p: 0}
+        order = [p]
+        rows = []
+        queue = deque(order)
+        while queue:
+            u = queue.popleft()
+            row = []
+            for la in sorted(es.labels[u]):
+                q = es.targets[(u, la)]
+                if q not in ids:
+                    ids[q] = len(order)
+                    order.append(q)
+                    queue.append(q)
+                row.append((la, ids[q]))
+            t = tm[u] if u in tm else None
+            v = vm[u] if u in vm else None
+            rows.append((type(t), t, v, tuple(row)))
+
+        self.form = tuple(rows)
+        self.hashcode_cache = hash(('Canon', self.form))
+        self.order = order
+        self.ids = ids
+
+    def __hash__(self):
+        return self.hashcode_cache
+
+    def __eq__(self, y):
+        return self is y or (self.hashcode_cache == y.hashcode_cache and self.form == y.form)
+
+class CanonTable(Watcher):
+    '''
+        canons of the nodes of one graph, least recently used first out.
+        a canon is dropped once a swing touches its region or a
+        collection frees its root.
+    '''
+    def __init__(self, cache):
+        self.cache = cache
+        self.canons = OrderedDict()
+        self.regions = {}
+
+    def swung(self, p, la, q):
+        self.touched(p)
+
+    def freed(self, p, out):
+        self.touched(p)
+
+    def touched(self, u):
+        for r in self.regions.pop(u, ()):
+            self.drop_canon(r)
+            self.cache.invalidations += 1
+
+    def reset(self):
+        self.cache.invalidations += len(self.canons)
+        self.canons.clear()
+        self.regions.clear()
+
+    def drop_canon(self, p):
+        c = self.canons.pop(p, None)
+        if c is not None:
+            for u in c.order:
+                rs = self.regions.get(u)
+                if rs is not None:
+                    rs.discard(p)
+                    if not rs:
+                        del self.regions[u]
+
+    def canon(self, sg, p):
+        c = self.canons.get(p)
+        if c is not None:
+            self.canons.move_to_end(p)
+            return c
+
+        c = Canon(sg, p)
+        self.canons[p] = c
+        for u in c.order:
+            self.regions.setdefault(u, set()).add(p)
+        if len(self.canons) > self.cache.maxsize:
+            self.drop_canon(next(iter(self.canons)))
+        return c
+
+class MatchCache:
+    '''
+        results keyed by (first case Extra, scrutinee canon), least
+        recently used first out, and shared by every graph the cache
+        serves. canons are per graph, as node handles of different
+        graphs may coincide. building a canon walks the whole region
+        reachable from the scrutinee, so it is memoized until that
+        region changes and a hit costs one dictionary probe.
+        the tables of the least recently used graphs are detached past
+        maxgraphs, and a run detaches the table of its graph on stop.
+    '''
+    def __init__(self, maxsize = 1024, maxgraphs = 16):
+        self.maxsize = maxsize
+        self.maxgraphs = maxgraphs
+        self.results = OrderedDict()
+        self.tables = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations}
+
+    def stop(self, sg):
+        ws = sg.layout.edges.watchers
+        if ws is not None and id(ws) in self.tables:
+            self.release(id(ws))
+
+    def release(self, k):
+        ws, t = self.tables.pop(k)
+        if t in ws:
+            ws.remove(t)
+
+    def table(self, sg):
+        'the watcher list identifies a graph across collections, and is kept so its id stays unique'
+        ws = sg.layout.edges.watchers
+        wt = self.tables.get(id(ws))
+        if wt is not None:
+            self.tables.move_to_end(id(ws))
+            return wt[1]
+
+        wt = (ws, CanonTable(self))
+        self.tables[id(ws)] = wt
+        watch_state(sg, wt[1])
+        if len(self.tables) > self.maxgraphs:
+            self.release(next(iter(self.tables)))
+        return wt[1]
+
+    def lookup(self, sg, p, cas, match):
+        if not cas:
+            return None
+
+        if sg.layout.edges.watchers is None:
+            return match(view_pattern(sg, p), cas)
+
+        c = self.table(sg).canon(sg, p)
+        key = (cas[0].extra, c)
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            km = self.results[key]
+            if km is None:
+                return None
+            k, m = km
+            return (k, [(la, c.order[i]) for la, i in m])
+
+        self.misses += 1
+        km = match(view_pattern(sg, p), cas)
+        if km is None:
+            self.results[key] = None
+        else:
+            k, m = km
+            self.results[key] = (k, [(la, c.ids[q]) for la, q in m])
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last = False)
+            self.evictions += 1
+        return km
+
+
+##
+## end of mcache.py
+##$Id$
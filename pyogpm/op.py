@@ -13,6 +13,11 @@ from collections import namedtuple
 
 import operator
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from subtype import (
     Value,
     INT_TYPE,
@@ -21,9 +26,13 @@ from subtype import (
 
 from graph import (
     Label,
-    add_value_to_state)
+    value_of)
+
+class Unbatchable(Exception):
+    'lanes the batch ops cannot run, the records go through the scalar path'
+    pass
 
-OpDef = namedtuple('OpDef', ['op', 'par_types', 'res_type', 'f'])
+OpDef = namedtuple('OpDef', ['op', 'par_types', 'res_type', 'f', 'vf'], defaults = [None])
 
 OP_TAB = {}
 
@@ -34,106 +43,200 @@ def get_op(la):
     return OP_TAB[la]
 
 def invoke_op(sg, op, args):
+    'args are nodes or unboxed values, the result is unboxed'
     f = OP_TAB[op].f
-    return f(sg, *args)
+    return f(*[value_of(sg, p) for p in args])
 
-def op_binary(sg, x, y, t, f):
-    g, tm, vm = sg
-    return add_value_to_state(sg, Value(t, f(vm[x].value, vm[y].value)))
+def op_binary(x, y, t, f):
+    return Value(t, f(x.value, y.value))
 
-def op_unary(sg, x, t, f):
-    g, ts, vs = sg
-    return add_value_to_state(sg, t, Value(t, f(vs[x].value)))
+def op_unary(x, t, f):
+    return Value(t, f(x.value))
 
-def op_add(sg, x, y):
-    return op_binary(sg, x, y, INT_TYPE, operator.add)
+def op_add(x, y):
+    return op_binary(x, y, INT_TYPE, operator.add)
     
-def op_sub(sg, x, y):
-    return op_binary(sg, x, y, INT_TYPE, operator.sub)
+def op_sub(x, y):
+    return op_binary(x, y, INT_TYPE, operator.sub)
 
-def op_mul(sg, x, y):
-    return op_binary(sg, x, y, INT_TYPE, operator.mul)
+def op_mul(x, y):
+    return op_binary(x, y, INT_TYPE, operator.mul)
 
-def op_div(sg, x, y):
-    return op_binary(sg, x, y, INT_TYPE, operator.floordiv)
+def op_div(x, y):
+    return op_binary(x, y, INT_TYPE, operator.floordiv)
 
-def op_mod(sg, x, y):
-    return op_binary(sg, x, y, INT_TYPE, operator.mod)
+def op_mod(x, y):
+    return op_binary(x, y, INT_TYPE, operator.mod)
 
-def op_neg(sg, x):
-    return op_unary(sg, x, INT_TYPE, operator.neg)
+def op_neg(x):
+    return op_unary(x, INT_TYPE, operator.neg)
 
-def op_not(sg, x):
-    return op_unary(sg, x, BOOL_TYPE, operator.not_)
+def op_not(x):
+    return op_unary(x, BOOL_TYPE, operator.not_)
 
-def op_cat(sg, x, y):
-    return op_binary(sg, x, y, STR_TYPE, operator.concat)
+def op_cat(x, y):
+    return op_binary(x, y, STR_TYPE, operator.concat)
 
-def op_lower(sg, x):
-    return op_unary(sg, x, STR_TYPE, lambda x: x.lower())
+def op_lower(x):
+    return op_unary(x, STR_TYPE, lambda x: x.lower())
 
-def op_upper(sg, x):
-    return op_unary(sg, x, STR_TYPE, lambda x: x.lower())
+def op_upper(x):
+    return op_unary(x, STR_TYPE, lambda x: x.upper())
 
-def op_ieq(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.eq)
+def op_ieq(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.eq)
 
-def op_ine(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.ne)
+def op_ine(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.ne)
 
-def op_ilt(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.lt)
+def op_ilt(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.lt)
 
-def op_ile(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.le)
+def op_ile(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.le)
 
-def op_igt(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.gt)
+def op_igt(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.gt)
 
-def op_ige(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.ge)
+def op_ige(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.ge)
 
-def op_seq(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.eq)
+def op_seq(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.eq)
 
-def op_sne(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.ne)
+def op_sne(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.ne)
 
-def op_slt(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.lt)
+def op_slt(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.lt)
 
-def op_sle(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.le)
+def op_sle(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.le)
 
-def op_sgt(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.gt)
+def op_sgt(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.gt)
 
-def op_sge(sg, x, y):
-    return op_binary(sg, x, y, BOOL_TYPE, operator.ge)
+def op_sge(x, y):
+    return op_binary(x, y, BOOL_TYPE, operator.ge)
 
 OP_TAB = {
-    Label('add'): OpDef(Label('add'), [INT_TYPE, INT_TYPE], INT_TYPE, op_add),
-    Label('sub'): OpDef(Label('sub'), [INT_TYPE, INT_TYPE], INT_TYPE, op_sub),
-    Label('mul'): OpDef(Label('mul'), [INT_TYPE, INT_TYPE], INT_TYPE, op_mul),
-    Label('div'): OpDef(Label('div'), [INT_TYPE, INT_TYPE], INT_TYPE, op_div),
-    Label('mod'): OpDef(Label('mod'), [INT_TYPE, INT_TYPE], INT_TYPE, op_mod),
+    Label('add'): OpDef(Label('add'), [INT_TYPE, INT_TYPE], INT_TYPE, op_add, operator.add),
+    Label('sub'): OpDef(Label('sub'), [INT_TYPE, INT_TYPE], INT_TYPE, op_sub, operator.sub),
+    Label('mul'): OpDef(Label('mul'), [INT_TYPE, INT_TYPE], INT_TYPE, op_mul, operator.mul),
+    Label('div'): OpDef(Label('div'), [INT_TYPE, INT_TYPE], INT_TYPE, op_div, operator.floordiv),
+    Label('mod'): OpDef(Label('mod'), [INT_TYPE, INT_TYPE], INT_TYPE, op_mod, operator.mod),
     Label('neg'): OpDef(Label('neg'), [INT_TYPE], INT_TYPE, op_neg),
     Label('not'): OpDef(Label('not'), [BOOL_TYPE], BOOL_TYPE, op_not),
-    Label('cat'): OpDef(Label('cat'), [STR_TYPE, STR_TYPE], STR_TYPE, op_cat),
+    Label('cat'): OpDef(Label('cat'), [STR_TYPE, STR_TYPE], STR_TYPE, op_cat, operator.concat),
     Label('lower'): OpDef(Label('lower'), [STR_TYPE], STR_TYPE, op_lower),
     Label('upper'): OpDef(Label('upper'), [STR_TYPE], STR_TYPE, op_upper),
-    Label('ieq'): OpDef(Label('ieq'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ieq),
-    Label('ine'): OpDef(Label('ine'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ine),
-    Label('ilt'): OpDef(Label('ilt'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ilt),
-    Label('ile'): OpDef(Label('ile'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ile),
-    Label('igt'): OpDef(Label('igt'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_igt),
-    Label('ige'): OpDef(Label('ige'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ige),
-    Label('seq'): OpDef(Label('seq'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_seq),
-    Label('sne'): OpDef(Label('sne'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_sne),
-    Label('slt'): OpDef(Label('slt'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_slt),
-    Label('sle'): OpDef(Label('sle'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_sle),
-    Label('sgt'): OpDef(Label('sgt'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_sgt),
-    Label('sge'): OpDef(Label('sge'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_sge)}
+    Label('ieq'): OpDef(Label('ieq'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ieq, operator.eq),
+    Label('ine'): OpDef(Label('ine'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ine, operator.ne),
+    Label('ilt'): OpDef(Label('ilt'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ilt, operator.lt),
+    Label('ile'): OpDef(Label('ile'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ile, operator.le),
+    Label('igt'): OpDef(Label('igt'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_igt, operator.gt),
+    Label('ige'): OpDef(Label('ige'), [INT_TYPE, INT_TYPE], BOOL_TYPE, op_ige, operator.ge),
+    Label('seq'): OpDef(Label('seq'), [STR_TYPE, STR_TYPE], BOOL_TYPE, op_seq, operator.eq),
+    Label('sne'): OpDef(Label('sne'), [STR_TYPE, STR_TYPE], BOOL_TYPE, op_sne, operator.ne),
+    Label('slt'): OpDef(Label('slt'), [STR_TYPE, STR_TYPE], BOOL_TYPE, op_slt, operator.lt),
+    Label('sle'): OpDef(Label('sle'), [STR_TYPE, STR_TYPE], BOOL_TYPE, op_sle, operator.le),
+    Label('sgt'): OpDef(Label('sgt'), [STR_TYPE, STR_TYPE], BOOL_TYPE, op_sgt, operator.gt),
+    Label('sge'): OpDef(Label('sge'), [STR_TYPE, STR_TYPE], BOOL_TYPE, op_sge, operator.ge)}
+
+
+INT_BOUND = 1 << 62
+
+def pack_values(vs):
+    'a column of unboxed values, int64 or bool only where exact'
+    if all(type(v) is bool for v in vs):
+        return numpy.array(vs, dtype = bool)
+
+    if all(type(v) is int and -INT_BOUND < v < INT_BOUND for v in vs):
+        return numpy.array(vs, dtype = numpy.int64)
+
+    xs = numpy.empty(len(vs), dtype = object)
+    xs[:] = vs
+    return xs
+
+def fits(xs, bound):
+    return xs.dtype == numpy.int64 and (len(xs) == 0 or int(numpy.abs(xs).max()) < bound)
+
+def batch_int(name, bound):
+    'int64 while the result cannot overflow, python ints otherwise'
+    def run(x, y):
+        f = getattr(numpy, name)
+        if fits(x, bound) and fits(y, bound):
+            return f(x, y)
+        return f(x.astype(object), y.astype(object))
+    return run
+
+def batch_div(name):
+    def run(x, y):
+        if fits(y, INT_BOUND) and (y == 0).any():
+            raise Unbatchable()
+        return batch_int(name, INT_BOUND)(x, y)
+    return run
+
+def batch_cmp(name):
+    def run(x, y):
+        f = getattr(numpy, name)
+        if x.dtype != y.dtype or x.dtype == object:
+            x, y = x.astype(object), y.astype(object)
+        return f(x, y).astype(bool)
+    return run
+
+def batch_neg(x):
+    if fits(x, INT_BOUND):
+        return numpy.negative(x)
+    return numpy.negative(x.astype(object))
+
+def batch_not(x):
+    if x.dtype == bool:
+        return numpy.logical_not(x)
+    return batch_scalar(OP_TAB[Label('not')])(x)
+
+def batch_cat(x, y):
+    return numpy.add(x.astype(object), y.astype(object))
+
+def batch_scalar(d):
+    'the scalar op mapped over the lanes'
+    f = numpy.frompyfunc(
+        lambda *vs: d.f(*[Value(t, v) for t, v in zip(d.par_types, vs)]).value,
+        len(d.par_types), 1)
+    def run(*xs):
+        if len(xs[0]) == 0:
+            return numpy.empty(0, dtype = object)
+        return f(*xs)
+    return run
+
+def invoke_batch_op(op, args):
+    'args are columns of unboxed values, one lane per record'
+    f = BATCH_TAB.get(op)
+    if f is None:
+        f = batch_scalar(OP_TAB[op])
+    return f(*args)
+
+BATCH_TAB = {
+    Label('add'): batch_int('add', INT_BOUND),
+    Label('sub'): batch_int('subtract', INT_BOUND),
+    Label('mul'): batch_int('multiply', 1 << 31),
+    Label('div'): batch_div('floor_divide'),
+    Label('mod'): batch_div('remainder'),
+    Label('neg'): batch_neg,
+    Label('not'): batch_not,
+    Label('cat'): batch_cat,
+    Label('ieq'): batch_cmp('equal'),
+    Label('ine'): batch_cmp('not_equal'),
+    Label('ilt'): batch_cmp('less'),
+    Label('ile'): batch_cmp('less_equal'),
+    Label('igt'): batch_cmp('greater'),
+    Label('ige'): batch_cmp('greater_equal'),
+    Label('seq'): batch_cmp('equal'),
+    Label('sne'): batch_cmp('not_equal'),
+    Label('slt'): batch_cmp('less'),
+    Label('sle'): batch_cmp('less_equal'),
+    Label('sgt'): batch_cmp('greater'),
+    Label('sge'): batch_cmp('greater_equal')}
 
 
 ##
@@ -22,6 +22,9 @@ MatchStmt = namedtuple('MatchStmt', ['expr', 'cas'])
 class Extra:
     def __init__(self, extra = None):
         self.extra = extra
+        self.tree = None
+        self.closure = None
+        self.bytecode = None
     
     def put(self, extra):
         self.extra = extra
@@ -0,0 +1,278 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    persistent state graphs, copy on write over hash array mapped tries
+
+'''
+
+from subtype import NULL_TYPE
+
+from graph import (
+    NoScope,
+    new_node,
+    find_lvar,
+    find_lattr)
+
+from hamt import HamtMap
+
+class PersistentNodes:
+    def __init__(self, g):
+        self.g = g
+
+    def __len__(self):
+        return len(self.g.labels)
+
+    def __contains__(self, p):
+        return p in self.g.labels
+
+    def __iter__(self):
+        return self.g.labels.keys()
+
+class PersistentEdges:
+    'labels map each node to a frozenset, so no row is shared mutably'
+    def __init__(self, g):
+        self.g = g
+        self.refs = None
+        self.watchers = []
+        self.frames = None
+        self.consts = None
+
+    @property
+    def labels(self):
+        return self.g.labels
+
+    @property
+    def targets(self):
+        return self.g.targets
+
+class PersistentLayout:
+    def __init__(self, g):
+        self.g = g
+        self.nodes = PersistentNodes(g)
+        self.edges = PersistentEdges(g)
+
+    @property
+    def root(self):
+        return self.g.root
+
+    def __iter__(self):
+        return iter((self.nodes, self.edges, self.root))
+
+class PersistentStateGraph:
+    '''
+        every map is a HamtMap, so fork is O(1) and each later change
+        to either graph costs O(log n) without touching the other.
+        frames and suspects are cons lists (head, tail), shared by
+        forks too. suspects holds the nodes allocated, dropped to or
+        popped since the last collection, the only ones that can have
+        become garbage. forks start without watchers unless watched.
+    '''
+    def __init__(self, g = None):
+        if g is None:
+            self.labels = HamtMap()
+            self.targets = HamtMap()
+            self.types = HamtMap()
+            self.values = HamtMap()
+            self.root = new_node()
+            self.labels[self.root] = frozenset()
+            self.frames = (self.root, None)
+            self.suspects = None
+        else:
+            self.labels = g.labels.copy()
+            self.targets = g.targets.copy()
+            self.types = g.types.copy()
+            self.values = g.values.copy()
+            self.root = g.root
+            self.frames = g.frames
+            self.suspects = g.suspects
+        self.layout = PersistentLayout(self)
+
+    def __iter__(self):
+        return iter((self.layout, self.types, self.values))
+
+    def fork(self, watched = False):
+        'a snapshot, free to evolve separately, a watched one notifies our watchers'
+        g = PersistentStateGraph(self)
+        if watched:
+            g.layout.edges.watchers = self.layout.edges.watchers
+        return g
+
+    def adopt(self, g):
+        'takes over the state of a watched fork g, which is not used again'
+        self.labels = g.labels
+        self.targets = g.targets
+        self.types = g.types
+        self.values = g.values
+        self.root = g.root
+        self.frames = g.frames
+        self.suspects = g.suspects
+        return self
+
+    def drop(self, g):
+        'frees, for the shared watchers, what a watched fork g allocated'
+        s = g.suspects
+        while s is not None and s is not self.suspects:
+            p, s = s
+            if p not in self.labels:
+                g.free_from(p, lambda q: q not in self.labels)
+        return self
+
+    def suspect(self, p):
+        self.suspects = (p, self.suspects)
+
+    def add_object_to_state(self, cla):
+        ws = self.layout.edges.watchers
+        p = new_node()
+        las = frozenset(cla.attrs)
+        self.labels[p] = las
+        self.types[p] = cla
+        self.suspect(p)
+        for w in ws:
+            w.allocated(p, cla)
+        for la in las:
+            q = new_node()
+            self.labels[q] = frozenset()
+            self.types[q] = NULL_TYPE
+            self.targets[(p, la)] = q
+            for w in ws:
+                w.allocated(q, NULL_TYPE)
+                w.swung(p, la, q)
+        return p
+
+    def add_value_to_state(self, v):
+        p = self.add_object_to_state(v.cla)
+        self.values[p] = v
+        return p
+
+    def swing_state(self, p, la, q):
+        ws = self.layout.edges.watchers
+        las = self.labels[p]
+        if la in las:
+            q0 = self.targets[(p, la)]
+            self.suspect(q0)
+            for w in ws:
+                w.dropped(p, la, q0)
+        else:
+            self.labels[p] = las | {la}
+        self.targets[(p, la)] = q
+        for w in ws:
+            w.swung(p, la, q)
+
+    def frame_at(self, la, depth):
+        'as graph.frame_at, over the frame list'
+        fs = self.frames
+        if depth is None or fs[0] != self.root:
+            return None
+
+        for i in range(depth):
+            fs = fs[1]
+            if fs is None:
+                return None
+
+        if la in self.labels[fs[0]]:
+            return fs[0]
+
+        return None
+
+    def frame_nodes(self):
+        ps = []
+        fs = self.frames
+        while fs is not None:
+            ps.append(fs[0])
+            fs = fs[1]
+        return ps[::-1]
+
+    def find_var(self, sla, la):
+        return self.targets[find_lvar(self, sla, la)]
+
+    def find_lvar_at(self, sla, la, depth):
+        r = self.frame_at(la, depth)
+        if r is not None:
+            return (r, la)
+
+        return find_lvar(self, sla, la)
+
+    def find_var_at(self, sla, la, depth):
+        r = self.frame_at(la, depth)
+        if r is not None:
+            return self.targets[(r, la)]
+
+        return self.find_var(sla, la)
+
+    def find_attr(self, p, la):
+        return self.targets[find_lattr(self, p, la)]
+
+    def push_state(self, sla):
+        r2 = new_node()
+        self.labels[r2] = frozenset([sla])
+        self.targets[(r2, sla)] = self.root
+        self.suspect(r2)
+        for w in self.layout.edges.watchers:
+            w.allocated(r2, None)
+            w.swung(r2, sla, self.root)
+        self.root = r2
+        self.frames = (r2, self.frames)
+        return self
+
+    def pop_state(self, sla, collect = True):
+        if sla not in self.labels[self.root]:
+            raise NoScope()
+
+        self.suspect(self.root)
+        self.root = self.targets[(self.root, sla)]
+        if self.frames[1] is not None:
+            self.frames = self.frames[1]
+        if not collect:
+            return self
+
+        return self.gc_state()
+
+    def free_from(self, p, dead):
+        'deletes p and every node it reaches that is dead too'
+        ws = self.layout.edges.watchers
+        stack = [p]
+        while stack:
+            p = stack.pop()
+            if p not in self.labels or not dead(p):
+                continue
+
+            las = self.labels.pop(p)
+            out = [(la, self.targets.pop((p, la))) for la in las]
+            self.types.pop(p, None)
+            self.values.pop(p, None)
+            for w in ws:
+                w.freed(p, out)
+            stack.extend(q for la, q in out)
+
+    def gc_state(self):
+        '''
+            marks from the root and sweeps from the suspects only,
+            unreachable nodes are deleted so forks keep sharing the rest
+        '''
+        live = {self.root}
+        stack = [self.root]
+        while stack:
+            p = stack.pop()
+            for la in self.labels[p]:
+                q = self.targets[(p, la)]
+                if q not in live:
+                    live.add(q)
+                    stack.append(q)
+
+        s, self.suspects = self.suspects, None
+        while s is not None:
+            p, s = s
+            self.free_from(p, lambda q: q not in live)
+        return self
+
+def init_persistent_state_graph():
+    return PersistentStateGraph()
+
+
+##
+## end of persistent.py
+##$Id$
@@ -0,0 +1,80 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    heap queries, every node a pattern matches at
+
+'''
+
+from collections import namedtuple
+
+from subtype import (
+    Cla,
+    VALUE_TYPES,
+    subtype,
+    classof)
+
+from graph import (
+    PatternGraph,
+    GraphIndex,
+    view_pattern,
+    cons_pattern_graph)
+
+from mc import compile_pattern
+
+Query = namedtuple('Query', ['graph', 'refs', 'match'])
+
+def compile_query(pattern):
+    g, tm, rm = cons_pattern_graph(pattern)
+    pg = PatternGraph(g, tm)
+    return Query(pg, rm, compile_pattern(pg))
+
+def type_nodes(index, t):
+    'nodes whose type may be viewed below t'
+    c = classof(t) if type(t) is not Cla else None
+    ps = []
+    for t2, us in index.by_type.items():
+        if t2 in VALUE_TYPES and type(t) is not Cla:
+            if c is None or subtype(t2, c):
+                ps.append(us)
+        elif subtype(t2, t):
+            ps.append(us)
+    return ps
+
+def candidates(index, t, las):
+    'roots passing the class and label tests, from the smallest index set'
+    tss = type_nodes(index, t)
+    lss = [index.by_label.get(la, set()) for la in las]
+    n = sum(len(ts) for ts in tss)
+    if not lss or n <= min(len(ls) for ls in lss):
+        return [p for ts in tss for p in ts if all(p in ls for ls in lss)]
+
+    ls = min(lss, key = len)
+    return [p for p in ls if all(p in s for s in lss) and any(p in ts for ts in tss)]
+
+def query(sg, q, index = None):
+    '''
+        (p, bindings) for each node p the query pattern matches at,
+        bindings as from a single pattern case. index is a GraphIndex
+        of sg, a snapshot is taken when none is given. scope frames
+        have no type and are never candidates.
+    '''
+    if index is None:
+        index = GraphIndex(sg.layout, sg.types)
+
+    (ns, es, p1), tm = q.graph
+    rs = []
+    for p in candidates(index, tm[p1], es.labels[p1]):
+        f = q.match(view_pattern(sg, p))
+        if f is not None:
+            rs.append((p, [(la, f[u]) for la, u in q.refs.items()]))
+    rs.sort(key = lambda r: r[0].id)
+    return rs
+
+
+##
+## end of query.py
+##$Id$
@@ -0,0 +1,136 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    incremental reference-counting collection of state graphs
+
+'''
+
+
+class RefCounter:
+    'in-degrees of a state graph, the root pinned by one extra count'
+    def __init__(self, root):
+        self.counts = {root: 1}
+        self.zct = set()
+        self.cands = set()
+        self.collections = 0
+        self.freed = 0
+
+    @staticmethod
+    def track(ns, es, r):
+        rc = RefCounter(r)
+        for u in ns:
+            rc.counts.setdefault(u, 0)
+        for q in es.targets.values():
+            rc.counts[q] += 1
+        rc.zct = {u for u, c in rc.counts.items() if c == 0}
+        rc.cands = {u for u in ns if es.labels[u]}
+        return rc
+
+    def inc(self, q):
+        self.counts[q] += 1
+
+    def dec(self, q):
+        c = self.counts[q] - 1
+        self.counts[q] = c
+        if c == 0:
+            self.zct.add(q)
+        else:
+            self.cands.add(q)
+
+    def alloc(self, p, qs):
+        self.counts[p] = 0
+        self.zct.add(p)
+        for q in qs:
+            self.counts[q] = 1
+
+    def swing(self, es, p, la, q):
+        self.inc(q)
+        if la in es.labels[p]:
+            self.dec(es.targets[(p, la)])
+
+    def push(self, r2, r):
+        'the pin of r becomes the edge from r2'
+        self.counts[r2] = 1
+
+    def reroot(self, r, r2):
+        self.inc(r2)
+        self.dec(r)
+
+    def collect(self, g, tm, vm):
+        ns, es, r = g
+        self.collections += 1
+        self.free_zct(ns, es, tm, vm)
+        self.free_cycles(ns, es, tm, vm, r)
+
+    def free_node(self, u, ns, es, tm, vm, white = ()):
+        ns.discard(u)
+        tm.pop(u, None)
+        vm.pop(u, None)
+        del self.counts[u]
+        self.zct.discard(u)
+        self.cands.discard(u)
+        self.freed += 1
+        if es.watchers:
+            out = [(la, es.targets[(u, la)]) for la in es.labels[u]]
+            for w in es.watchers:
+                w.freed(u, out)
+        for la in es.labels.pop(u):
+            q = es.targets.pop((u, la))
+            if q not in white:
+                self.dec(q)
+
+    def free_zct(self, ns, es, tm, vm):
+        'a node referenced again since its count hit zero may now be on a cycle'
+        while self.zct:
+            u = self.zct.pop()
+            c = self.counts.get(u)
+            if c == 0:
+                self.free_node(u, ns, es, tm, vm)
+            elif c is not None:
+                self.cands.add(u)
+
+    def free_cycles(self, ns, es, tm, vm, r):
+        'synchronous trial deletion from the candidates'
+        cands = [u for u in self.cands if u in self.counts and u != r and es.labels[u]]
+        self.cands = set()
+        if not cands:
+            return
+
+        gray = set(cands)
+        stack = list(cands)
+        while stack:
+            u = stack.pop()
+            for la in es.labels[u]:
+                q = es.targets[(u, la)]
+                if q not in gray:
+                    gray.add(q)
+                    stack.append(q)
+
+        rcs = {u: self.counts[u] for u in gray}
+        for u in gray:
+            for la in es.labels[u]:
+                rcs[es.targets[(u, la)]] -= 1
+
+        black = set()
+        stack = [u for u, c in rcs.items() if c > 0]
+        while stack:
+            u = stack.pop()
+            if u not in black:
+                black.add(u)
+                stack.extend(es.targets[(u, la)] for la in es.labels[u])
+
+        white = gray - black
+        for u in white:
+            self.free_node(u, ns, es, tm, vm, white)
+
+        self.cands = set()
+        self.free_zct(ns, es, tm, vm)
+
+
+##
+## end of refcount.py
+##$Id$
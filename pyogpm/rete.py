@@ -0,0 +1,128 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    incremental pattern matching over a mutating state graph
+
+'''
+
+from graph import (
+    GraphIndex,
+    view_pattern)
+
+from mc import pattern_tests
+
+from query import query
+
+class Production:
+    '''
+        a registered query. steps[la] holds, reversed, the path from
+        the pattern root to each pattern node with an out-edge la.
+    '''
+    def __init__(self, q, matched, unmatched):
+        self.q = q
+        self.matched = matched
+        self.unmatched = unmatched
+        self.matches = {}
+        self.dirty = set()
+        (ns, es, p), tm = q.graph
+        tests, paths = pattern_tests(q.graph)
+        self.steps = {}
+        for u, path in paths.items():
+            for la in es.labels[u]:
+                rpath = tuple(reversed(path))
+                if rpath not in self.steps.setdefault(la, []):
+                    self.steps[la].append(rpath)
+
+class ReteNetwork(GraphIndex):
+    '''
+        swings and allocations mark the roots whose match could have
+        changed, found by walking the reverse edges back along the
+        pattern paths. flush re-runs the matcher on those roots only
+        and reports the matches started and stopped.
+    '''
+    def __init__(self, sg):
+        self.productions = []
+        GraphIndex.__init__(self, sg.layout, sg.types)
+        ws = sg.layout.edges.watchers
+        if self not in ws:
+            ws.append(self)
+
+    def register(self, sg, q, matched = None, unmatched = None):
+        pr = Production(q, matched, unmatched)
+        self.productions.append(pr)
+        for p, bs in query(sg, q, self):
+            pr.matches[p] = bs
+            if matched is not None:
+                matched(p, bs)
+        return pr
+
+    def back_walk(self, p, rpath):
+        xs = {p}
+        for la in rpath:
+            xs = {s for x in xs for s, la2 in self.rev.get(x, ()) if la2 == la}
+            if not xs:
+                break
+        return xs
+
+    def swung(self, p, la, q):
+        GraphIndex.swung(self, p, la, q)
+        for pr in self.productions:
+            for rpath in pr.steps.get(la, ()):
+                pr.dirty |= self.back_walk(p, rpath)
+
+    def allocated(self, p, t):
+        GraphIndex.allocated(self, p, t)
+        if t is not None:
+            for pr in self.productions:
+                pr.dirty.add(p)
+
+    def freed(self, p, out):
+        GraphIndex.freed(self, p, out)
+        for pr in self.productions:
+            if p in pr.matches:
+                pr.dirty.add(p)
+            else:
+                pr.dirty.discard(p)
+
+    def reset(self, g = None, tm = None):
+        'after a rescan any root may have changed'
+        GraphIndex.reset(self, g, tm)
+        for pr in self.productions:
+            pr.dirty = set(self.types) | set(pr.matches)
+
+    def renumbered(self, f):
+        'matches of freed roots stay under their old handles until flush drops them'
+        GraphIndex.renumbered(self, f)
+        for pr in self.productions:
+            pr.dirty = {f.get(p, p) for p in pr.dirty} | {p for p in pr.matches if p not in f}
+            pr.matches = {f.get(p, p): [(la, f.get(q, q)) for la, q in bs] for p, bs in pr.matches.items()}
+
+    def flush(self, sg):
+        'brings the matches up to date with sg'
+        for pr in self.productions:
+            dirty, pr.dirty = pr.dirty, set()
+            for p in dirty:
+                f = None
+                if p in self.types:
+                    f = pr.q.match(view_pattern(sg, p))
+                if f is None:
+                    if p in pr.matches:
+                        del pr.matches[p]
+                        if pr.unmatched is not None:
+                            pr.unmatched(p)
+                    continue
+
+                bs = [(la, f[u]) for la, u in pr.q.refs.items()]
+                if pr.matches.get(p) != bs:
+                    pr.matches[p] = bs
+                    if pr.matched is not None:
+                        pr.matched(p, bs)
+
+
+##
+## end of rete.py
+##$Id$
@@ -9,7 +9,8 @@
 
 '''
 
-from bidict import dict_union, bidict_union
+from collections import namedtuple
+from functools import partial
 
 from subtype import (
     Value,
@@ -20,17 +21,19 @@ from subtype import (
 from graph import (
     Mismatch,
     Label,
-    gc_state,
     push_state,
     pop_state,
     add_object_to_state,
-    add_value_to_state,
     swing_state,
-    find_var,
-    find_lvar,
+    fork_state,
+    join_state,
+    find_var_at,
+    find_lvar_at,
     find_attr,
     find_lattr,
-    extract_pattern,
+    value_of,
+    box_value,
+    view_pattern,
     cons_match)
 
 from pattern import (
@@ -56,16 +59,30 @@ from asx import (
 from op import (
     invoke_op)
 
+from gcpolicy import (
+    STMT_EVENT,
+    BLOCK_EVENT,
+    SCOPE_EVENT,
+    EveryStmt)
+
 SCOPE_LABEL = Label('$')
 
+Interp = namedtuple('Interp', ['policy', 'cache'])
+
+def interp(policy = None, cache = None):
+    return Interp(EveryStmt() if policy is None else policy, cache)
+
+def collect(sg, event, ip):
+    return ip.policy.collect(sg, event)
+
 def eval_value(x, sg):
-    return add_value_to_state(sg, x)
+    return x
 
 def eval_var(x, sg):
-    return find_var(sg, SCOPE_LABEL, x.label)
+    return find_var_at(sg, SCOPE_LABEL, x.label, x.depth)
 
 def eval_lvar(x, sg):
-    return find_lvar(sg, SCOPE_LABEL, x.label)
+    return find_lvar_at(sg, SCOPE_LABEL, x.label, x.depth)
 
 def eval_attr(x, sg):
     p = eval_expr(x.expr, sg)
@@ -86,8 +103,7 @@ def eval_and(x, sg):
     left, right = x
     p = eval_expr(left, sg)
 
-    g, tm, vm = sg
-    if vm[p].value != True:
+    if value_of(sg, p).value != True:
         return p
     
     return eval_expr(right, sg)
@@ -96,8 +112,7 @@ def eval_or(x, sg):
     left, right = x
     p = eval_expr(left, sg)
 
-    g, tm, vm = sg
-    if vm[p].value != False:
+    if value_of(sg, p).value != False:
         return p
 
     return eval_expr(right, sg)
@@ -121,99 +136,144 @@ LEXPR_TAB = {
 def eval_lexpr(lx, sg):
     return LEXPR_TAB[type(lx)](lx, sg)
     
-def st_var_decl(vd, sg):
+def st_var_decl(vd, sg, ip):
     la, cla = vd
     sg = push_state(sg, SCOPE_LABEL)
     q = add_object_to_state(sg, NULL_TYPE)
     swing_state(sg, sg.layout.root, la, q)
-    return gc_state(sg)
+    return collect(sg, STMT_EVENT, ip)
 
-def st_var_end(ve, sg):
+def st_var_end(ve, sg, ip):
     la = ve.label
-    return pop_state(sg, SCOPE_LABEL)
+    return collect(pop_state(sg, SCOPE_LABEL, False), SCOPE_EVENT, ip)
 
-def st_print(pr, sg):
-    def to_str(p):
-        cla = sg.types[p]
-        
-        if cla is NULL_TYPE:
-            return 'null'
-        
-        if cla in VALUE_TYPES:
-            return str(sg.values[p].value)
-        
-        return '{}@({})'.format(cla.tag, p.id)
+def node_str(sg, p):
+    if type(p) is Value:
+        return str(p.value)
+    
+    cla = sg.types[p]
     
-    rs = [to_str(eval_expr(x, sg)) for x in pr.args]
+    if cla is NULL_TYPE:
+        return 'null'
+    
+    if cla in VALUE_TYPES:
+        return str(sg.values[p].value)
+    
+    return '{}@({})'.format(cla.tag, p.id)
+
+def st_print(pr, sg, ip):
+    rs = [node_str(sg, eval_expr(x, sg)) for x in pr.args]
     print(', '.join(rs))
     return sg
 
-def st_assign(s, sg):
+def st_assign(s, sg, ip):
     lx, x = s
     (p, la) = eval_lexpr(lx, sg)
-    q = eval_expr(x, sg)
+    q = box_value(sg, eval_expr(x, sg))
     swing_state(sg, p, la, q)
-    return gc_state(sg)
+    return collect(sg, STMT_EVENT, ip)
 
-def st_if(s, sg):
+def st_if(s, sg, ip):
     x, thens, elses = s
     p = eval_expr(x, sg)
-    if sg.values[p].value == True:
-        return st_stmt(thens, sg)
+    if value_of(sg, p).value == True:
+        return st_stmt(thens, sg, ip)
     else:
-        return st_stmt(elses, sg)
+        return st_stmt(elses, sg, ip)
 
-def st_while(s, sg):
+def st_while(s, sg, ip):
     x, ws = s
     p = eval_expr(x, sg)
-    while sg.values[p].value == True:
-        sg = st_stmt(ws, sg)
+    while value_of(sg, p).value == True:
+        sg = st_stmt(ws, sg, ip)
         p = eval_expr(x, sg)
     
-    return gc_state(sg)
+    return collect(sg, STMT_EVENT, ip)
 
-def st_block(blk, sg):
+def st_block(blk, sg, ip):
     for s in blk.stmts:
-        sg = st_scope(s, sg)
+        sg = st_scope(s, sg, ip)
         
-    return gc_state(sg)
+    return collect(sg, BLOCK_EVENT, ip)
 
-def st_scope(s, sg):
+def st_scope(s, sg, ip):
     if type(s) is VarDecl:
-        return st_var_decl(s, sg)
+        return st_var_decl(s, sg, ip)
     
     if type(s) is VarEnd:
-        return st_var_end(s, sg)
+        return st_var_end(s, sg, ip)
     
-    return st_stmt(s, sg)
+    return st_stmt(s, sg, ip)
     
-def st_match(s, sg):
+def st_match(s, sg, ip):
     x, cas = s
-    p = eval_expr(x, sg)
-    pg = extract_pattern(sg, p)
+    sg, km = fork_match(sg, partial(eval_expr, x), cas, ip)
+    if km is None:
+        return sg
+    
+    k, m = km
+    sg = st_stmt(cas[k].stmt, enter_case(sg, m), ip)
+    return leave_case(sg, ip)
+
+def fork_match(sg, e, cas, ip):
+    'the scrutinee e(sg) is evaluated on a fork, kept only if a case matches'
+    sg2 = fork_state(sg)
+    p = box_value(sg2, e(sg2))
+    if ip.cache is None:
+        km = match_cases(view_pattern(sg2, p), cas)
+    else:
+        km = ip.cache.lookup(sg2, p, cas, match_cases)
+    return (join_state(sg, sg2, km is not None), km)
+
+def enter_case(sg, m):
+    sg = push_state(sg, SCOPE_LABEL)
+    for la, q in m:
+        swing_state(sg, sg.layout.root, la, q)
+    return sg
+
+def leave_case(sg, ip):
+    return collect(pop_state(sg, SCOPE_LABEL, False), SCOPE_EVENT, ip)
+
+def match_cases(pg, cas):
+    if cas and cas[0].extra.tree is not None:
+        return match_tree(pg, cas, cas[0].extra.tree)
     
-    for junc, s, extra in cas:
+    for k, (junc, s, extra) in enumerate(cas):
         m = match_junc(pg, junc, extra.get())
         if m is not None:
-            sg = push_state(sg, SCOPE_LABEL)
-            for la, q in m:
-                swing_state(sg, sg.layout.root, la, q)
-            sg = st_stmt(s, sg)
-            return pop_state(sg, SCOPE_LABEL)
+            return (k, m)
         
-    return sg
+    return None
+
+def match_tree(pg, cas, tree):
+    kjfs = tree.run(pg)
+    if kjfs is None:
+        return None
+    
+    k, j, fs = kjfs
+    junc, s, extra = cas[k]
+    if type(junc) is PatternConj:
+        pgs1, fs1, rms1, ms1, bt1 = extra.get()
+        return (k, bind_conj(fs, bt1))
+    
+    if type(junc) is PatternDisj:
+        pgs1, fs1, rms1, ms1, bts1 = extra.get()
+        return (k, bind_disj(fs[0], bts1[j]))
+    
+    pg1, rm1, m1 = extra.get()
+    return (k, bind_one(fs[0], rm1))
 
 def match_junc(pg, junc, extra):
     if type(junc) is PatternConj:
-        pgs1, fs1, rms1 = extra
-        return match_conj(pg, pgs1, rms1)
+        pgs1, fs1, rms1, ms1, bt1 = extra
+        return match_conj(pg, ms1, bt1)
     
     if type(junc) is PatternDisj:
-        pgs1, fs1, rms1 = extra
-        return match_disj(pg, pgs1, fs1, rms1)
+        pgs1, fs1, rms1, ms1, bts1 = extra
+        return match_disj(pg, ms1, bts1)
     
-    pg1, rm1 = extra
-    return match_one(pg, pg1, rm1)
+    pg1, rm1, m1 = extra
+    return match_one(pg, m1, rm1)
 
 def match_patterns(pg1, pg2):
     g1, ts1 = pg1
@@ -225,32 +285,37 @@ def match_patterns(pg1, pg2):
     except Mismatch:
         return None
 
-def match_one(pg, pg1, rm1):
-    f = match_patterns(pg, pg1)
+def match_one(pg, m1, rm1):
+    f = m1(pg)
     
     if f is None:
         return None
     
+    return bind_one(f, rm1)
+
+def bind_one(f, rm1):
     return [(la, f[q]) for la, q in rm1.items()]
 
-def match_disj(pg, pgs1, fs1, rms1):
-    for pg1 in pgs1:
-        f = match_patterns(pg, pg1)
+def match_disj(pg, ms1, bts1):
+    for m1, bt1 in zip(ms1, bts1):
+        f = m1(pg)
         if f is not None:
-            rm1 = dict_union(rms1)
-            f1 = bidict_union(fs1)
-            return [(la, f[(set(f1.inv[f1[u]]) & set(f)).pop()]) for la, u in rm1.items()]
+            return bind_disj(f, bt1)
         
     return None
 
-def match_conj(pg, pgs1, rms1):
-    fs = [match_patterns(pg, pg1) for pg1 in pgs1]
+def bind_disj(f, bt1):
+    return [(la, f[u]) for la, u in bt1]
+
+def match_conj(pg, ms1, bt1):
+    fs = [m1(pg) for m1 in ms1]
     if any(f is None for f in fs):
         return None
     
-    rm1 = dict_union(rms1)
-    f = bidict_union(fs)
-    return [(la, f[u]) for la, u in rm1.items()]
+    return bind_conj(fs, bt1)
+
+def bind_conj(fs, bt1):
+    return [(la, fs[k][u]) for la, k, u in bt1]
 
 STMT_TAB = {
     MatchStmt: st_match,
@@ -260,11 +325,24 @@ STMT_TAB = {
     PrintStmt: st_print,
     BlockStmt: st_block}
 
-def st_stmt(s, sg):
-    return STMT_TAB[type(s)](s, sg)
+def st_stmt(s, sg, ip = None):
+    if ip is None:
+        ip = interp()
+    return STMT_TAB[type(s)](s, sg, ip)
 
-def st_program(prog, sg):
-    return st_block(prog.block, sg)
+def run_interp(run, sg, policy = None, cache = None):
+    'run(sg, ip) with the policy and the cache watching sg meanwhile'
+    ip = interp(policy, cache)
+    ip.policy.start(sg)
+    try:
+        return run(sg, ip)
+    finally:
+        ip.policy.stop(sg)
+        if ip.cache is not None:
+            ip.cache.stop(sg)
+
+def st_program(prog, sg, policy = None, cache = None):
+    return run_interp(lambda sg, ip: st_block(prog.block, sg, ip), sg, policy, cache)
 
 
 ##
@@ -26,6 +26,74 @@ def is_anon_tag(tag):
     return not tag or tag.id[0] == '*'
 
 CLA_TAB = {}
+TAG_BITS = {}
+
+def tag_bit(tag):
+    'each tag owns one bit of the class masks'
+    bit = TAG_BITS.get(tag)
+    if bit is None:
+        bit = 1 << len(TAG_BITS)
+        TAG_BITS[tag] = bit
+    return bit
+
+def tags_mask(tags):
+    mask = 0
+    for tag in tags:
+        mask |= tag_bit(tag)
+    return mask
+
+class Memo:
+    'bounded table, oldest entries out first'
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.table = {}
+        self.calls = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def clear(self):
+        self.table.clear()
+
+    def put(self, key, r):
+        if len(self.table) >= self.maxsize:
+            del self.table[next(iter(self.table))]
+            self.evictions += 1
+        self.table[key] = r
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'hits': self.hits,
+            'evictions': self.evictions,
+            'size': len(self.table)}
+
+SUBTYPE_MEMO = Memo(4096)
+ANON_TAB = Memo(4096)
+JUNC_MEMO = Memo(4096)
+
+def hash_cons(cla):
+    'the shared anonymous class with the same tags and attrs as cla'
+    ANON_TAB.calls += 1
+    key = (cla.mask, frozenset(cla.attrs.items()))
+    hit = ANON_TAB.table.get(key)
+    if hit is None:
+        ANON_TAB.put(key, cla)
+        return cla
+    ANON_TAB.hits += 1
+    return hit
+
+def junc_memo(op, cs, f):
+    'operands are kept with the result so their ids stay unique'
+    JUNC_MEMO.calls += 1
+    cs = tuple(cs)
+    key = (op, tuple(id(cla) for cla in cs))
+    hit = JUNC_MEMO.table.get(key)
+    if hit is None:
+        hit = (cs, hash_cons(f(cs)))
+        JUNC_MEMO.put(key, hit)
+    else:
+        JUNC_MEMO.hits += 1
+    return hit[1]
 
 class Cla:
     def __init__(self, tag, supers = [], attrs = [], tags = []):
@@ -33,16 +101,19 @@ class Cla:
             if tag in CLA_TAB:
                 raise DuplicateClassError()
             CLA_TAB[tag] = self
+            SUBTYPE_MEMO.clear()
         
         self.tag = tag
         self.tags = set(tags)
         if not is_anon_tag(tag):
             self.tags.add(tag)
             
+        self.mask = tags_mask(self.tags)
         self.attrs = dict(attrs)
         
         for su in supers:
             self.tags.update(su.tags)
+            self.mask |= su.mask
             for la, ty in su.attrs.items():
                 if la in self.attrs:
                     if self.attrs[la] != ty:
@@ -70,7 +141,7 @@ class Cla:
         if not is_anon_tag(self.tag) and self.tag == y.tag:
             return True
         
-        return self.tags == y.tags
+        return self.mask == y.mask
     
     def __hash__(self):
         return self.hashcode_cache
@@ -82,7 +153,7 @@ class Cla:
         if not is_anon_tag(self.tag) and self.tag == y.tag:
             return True
 
-        return self.tags >= y.tags
+        return self.mask & y.mask == y.mask
     
     def to_pp(self):
         pp = {}
@@ -99,17 +170,22 @@ class Cla:
     
     @staticmethod
     def reset():
-        CLA_TAB = {}
+        CLA_TAB.clear()
+        SUBTYPE_MEMO.clear()
+        ANON_TAB.clear()
+        JUNC_MEMO.clear()
 
     @staticmethod
     def inter(cs):
-        return Cla(None, cs)
+        return junc_memo('inter', cs, lambda cs: Cla(None, cs))
 
     @staticmethod
     def union(cs):
-        tags = set.intersection(*(cla.tags for cla in cs))
-        attrs = set.intersection(*(set(cla.attrs.items()) for cla in cs))
-        return Cla(None, [], attrs, tags)
+        def union(cs):
+            tags = set.intersection(*(cla.tags for cla in cs))
+            attrs = set.intersection(*(set(cla.attrs.items()) for cla in cs))
+            return Cla(None, [], attrs, tags)
+        return junc_memo('union', cs, union)
     
 NO_TYPE = Cla(Tag('*TOP'))
 NULL_TYPE = Cla(Tag('NULL'), set(), {})
@@ -127,25 +203,167 @@ class ValueSet:
         s = list(self.values)
         s.sort()
         self.vector = tuple(s)
+        self.hashcode_cache = hash(('ValueSet', self.vector))
         
     def __hash__(self):
-        return hash(('ValueSet', self.vector))
+        return self.hashcode_cache
     
     def __eq__(self, y):
         return self.vector == y.vector
+
+class ValueConstraint:
+    'values of one class described without enumerating them'
+    def __hash__(self):
+        return hash((type(self).__name__, self.key))
+
+    def __eq__(self, y):
+        return type(self) is type(y) and self.key == y.key
+
+    def admits(self, v):
+        return v.cla == self.cla and self.contains(v.value)
+
+    def within(self, vs):
+        return False
+
+class IntRange(ValueConstraint):
+    'lo <= x <= hi, None for an open end'
+    cla = INT_TYPE
+
+    def __init__(self, lo = None, hi = None):
+        self.lo = lo
+        self.hi = hi
+        self.key = (lo, hi)
+
+    def empty(self):
+        return self.lo is not None and self.hi is not None and self.lo > self.hi
+
+    def contains(self, x):
+        return type(x) is int and (self.lo is None or self.lo <= x) and (self.hi is None or x <= self.hi)
+
+    def le(self, y):
+        if self.empty():
+            return True
+        return ((y.lo is None or self.lo is not None and y.lo <= self.lo) and
+            (y.hi is None or self.hi is not None and self.hi <= y.hi))
+
+    def within(self, vs):
+        if self.empty():
+            return True
+        if self.lo is None or self.hi is None or self.hi - self.lo >= len(vs):
+            return False
+        return all(Value(INT_TYPE, x) in vs for x in range(self.lo, self.hi + 1))
+
+    def inter(self, y):
+        lo = self.lo if y.lo is None else y.lo if self.lo is None else max(self.lo, y.lo)
+        hi = self.hi if y.hi is None else y.hi if self.hi is None else min(self.hi, y.hi)
+        r = IntRange(lo, hi)
+        return ValueSet(set()) if r.empty() else r
+
+    def hull(self, y):
+        lo = None if self.lo is None or y.lo is None else min(self.lo, y.lo)
+        hi = None if self.hi is None or y.hi is None else max(self.hi, y.hi)
+        return IntRange(lo, hi)
+
+    @staticmethod
+    def point(x):
+        return IntRange(x, x)
+
+class StrPrefix(ValueConstraint):
+    cla = STR_TYPE
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.key = prefix
+
+    def contains(self, x):
+        return type(x) is str and x.startswith(self.prefix)
+
+    def le(self, y):
+        return self.prefix.startswith(y.prefix)
+
+    def inter(self, y):
+        if self.prefix.startswith(y.prefix):
+            return self
+        if y.prefix.startswith(self.prefix):
+            return y
+        return ValueSet(set())
+
+    def hull(self, y):
+        n = 0
+        for a, b in zip(self.prefix, y.prefix):
+            if a != b:
+                break
+            n += 1
+        return StrPrefix(self.prefix[:n])
+
+    @staticmethod
+    def point(x):
+        return StrPrefix(x)
+
+class BoolConst(ValueConstraint):
+    cla = BOOL_TYPE
+
+    def __init__(self, value):
+        self.value = value
+        self.key = value
+
+    def contains(self, x):
+        return type(x) is bool and x == self.value
+
+    def le(self, y):
+        return self.value == y.value
+
+    def within(self, vs):
+        return Value(BOOL_TYPE, self.value) in vs
+
+    def inter(self, y):
+        return self if self.value == y.value else ValueSet(set())
+
+    def hull(self, y):
+        return self if self.value == y.value else BOOL_TYPE
+
+    @staticmethod
+    def point(x):
+        return BoolConst(x)
+
+VALUE_CONSTRAINTS = {IntRange, StrPrefix, BoolConst}
         
 def subtype(x, y):
+    memo = SUBTYPE_MEMO
+    memo.calls += 1
     if x is NULL_TYPE:
         return True
     
     if type(x) is Cla and type(y) is Cla:
         return x <= y
-    
+
+    key = (type(x), x, type(y), y)
+    r = memo.table.get(key)
+    if r is not None:
+        memo.hits += 1
+        return r
+
+    r = subtype_uncached(x, y)
+    memo.put(key, r)
+    return r
+
+def subtype_uncached(x, y):
     if type(x) is ValueSet and type(y) is ValueSet:
         return x.values <= y.values
     
     if type(x) is ValueSet and type(y) is Cla:
-        return all(v.cla == y for v in x.values) 
+        return all(v.cla <= y for v in x.values) 
+
+    if type(x) is ValueSet and type(y) in VALUE_CONSTRAINTS:
+        return all(y.admits(v) for v in x.values)
+
+    if type(x) in VALUE_CONSTRAINTS:
+        if type(y) is Cla:
+            return x.cla <= y
+        if type(y) is type(x):
+            return x.le(y)
+        if type(y) is ValueSet:
+            return x.within(y.values)
     
     return False
 
@@ -166,6 +384,9 @@ def classof(x, path = []):
         if len(clas) != 1:
             return None
         return clas.pop()
+
+    if type(x) in VALUE_CONSTRAINTS:
+        return None if path else x.cla
     
     if type(x) is Cla:
         cla = x 
@@ -187,25 +408,55 @@ def exists_ty_le_all(ts):
     
     return True
 
+def constraint_inter(cs):
+    c = cs[0]
+    for c2 in cs[1:]:
+        if type(c2) is not type(c):
+            return ValueSet(set())
+        c = c.inter(c2)
+    return c
+
+def constraint_hull(cs):
+    c = cs[0]
+    for c2 in cs[1:]:
+        if type(c2) is not type(c):
+            return None
+        c = c.hull(c2)
+    return c
+
 def ty_inf(ts):
     clas = [classof(t) for t in ts]
     if any(cla in VALUE_TYPES for cla in clas):
         vss = [t for t in ts if type(t) is ValueSet]
+        cs = [t for t in ts if type(t) in VALUE_CONSTRAINTS]
+        c = constraint_inter(cs) if cs else None
+        if c is not None and (type(c) is ValueSet or not vss):
+            return c
         if vss:
-            return ValueSet(set().union(*[vs.values for vs in vss]))
-        else:
-            return clas[0]
+            vs = set.intersection(*[vs.values for vs in vss])
+            return ValueSet(v for v in vs if c is None or c.admits(v))
+        return clas[0]
     else:
         return Cla.inter(clas)
 
 def ty_sup(ts):
+    'the base value type when constraints do not combine, the class union when classes differ'
     clas = [classof(t) for t in ts]
     if any(cla in VALUE_TYPES for cla in clas):
-        vss = [t for t in ts if type(t) is ValueSet]
-        if vss:
-            return ValueSet(set().intersection(*[vs.values for vs in vss]))
-        else:
+        if any(cla is None for cla in clas) or len(set(clas)) != 1:
+            return Cla.union({v.cla for t in ts if type(t) is ValueSet for v in t.values} |
+                {classof(t) for t in ts if type(t) is not ValueSet})
+        if any(type(t) is Cla for t in ts):
             return clas[0]
+        vss = [t for t in ts if type(t) is ValueSet]
+        cs = [t for t in ts if type(t) in VALUE_CONSTRAINTS]
+        vs = set().union(*[vs.values for vs in vss])
+        if cs:
+            k = type(cs[0])
+            cs.extend(k.point(v.value) for v in vs)
+            c = constraint_hull(cs)
+            return clas[0] if c is None else c
+        return ValueSet(vs)
     else:
         return Cla.union(clas)
 
@@ -9,6 +9,8 @@
 
 '''
 
+from bidict import dict_union, bidict_union
+
 from subtype import (
     Cla,
     Value,
@@ -47,24 +49,82 @@ from graph import (
     cons_pattern_graph,
     cons_match_conj,
     cons_match_disj,
+    run_dfs,
     unzip4)
 
+from mc import compile_pattern
+
+class SymbolTable:
+    '''
+        one dict of binding stacks shared by every Env of a program.
+        envs holds the chain of scopes currently applied to stacks,
+        using an Env first unwinds the scopes opened after it.
+    '''
+    def __init__(self):
+        self.stacks = {}
+        self.envs = []
+
+    def apply(self, env):
+        for k, v in env.tab.items():
+            self.stacks.setdefault(k, []).append((env.level, v))
+        self.envs.append(env)
+
+    def unapply(self):
+        env = self.envs.pop()
+        for k in env.tab:
+            s = self.stacks[k]
+            s.pop()
+            if not s:
+                del self.stacks[k]
+
+    def focus(self, env):
+        envs = self.envs
+        if envs and envs[-1] is env:
+            return
+
+        chain = []
+        while env is not None and not (env.level < len(envs) and envs[env.level] is env):
+            chain.append(env)
+            env = env.outer
+
+        level = env.level + 1 if env is not None else 0
+        while len(envs) > level:
+            self.unapply()
+        for env in reversed(chain):
+            self.apply(env)
+
 class Env:
     def __init__(self, outer = None, items = []):
         self.tab = dict(items)
         self.outer = outer
+        if outer is None:
+            self.sym = SymbolTable()
+            self.level = 0
+        else:
+            self.sym = outer.sym
+            self.level = outer.level + 1
+        self.sym.focus(self)
 
     def __contains__(self, k):
-        return k in self.tab or (self.outer is not None and k in self.outer)
+        self.sym.focus(self)
+        return k in self.sym.stacks
 
     def __getitem__(self, k):
-        if k in self.tab:
-            return self.tab[k]
-        else:
-            return self.outer[k]
+        self.sym.focus(self)
+        return self.sym.stacks[k][-1][1]
         
     def __setitem__(self, k, v):
+        self.sym.focus(self)
+        s = self.sym.stacks.setdefault(k, [])
+        if k in self.tab:
+            s.pop()
         self.tab[k] = v
+        s.append((self.level, v))
+
+    def depth(self, k):
+        'scopes between this one and the one declaring k'
+        self.sym.focus(self)
+        return self.level - self.sym.stacks[k][-1][0]
         
     def top(self):
         return set(self.tab)
@@ -105,16 +165,22 @@ def tc_node(p, env, es, types):
     if p not in types:
         raise NodeTypeError()
     
-    t = types[p]
-    env2 = Env(env, {p: t})
+    visited = {p}
     
-    for la in es.labels[p]:
-        q = es.targets[(p, la)]
-        s = tc_node(q, env2, es, types)
-        if not subtype(s, classof(t, [la])):
-            raise NodeSubtypeError()
+    def dfs_node(p):
+        t = types[p]
+        for la in es.labels[p]:
+            q = es.targets[(p, la)]
+            if q not in visited:
+                if q not in types:
+                    raise NodeTypeError()
+                visited.add(q)
+                yield (q,)
+            if not subtype(types[q], classof(t, [la])):
+                raise NodeSubtypeError()
     
-    return t
+    run_dfs(dfs_node, p)
+    return types[p]
 
 def tc_graph(pg, env):
     (ns, es, p), types = pg
@@ -150,18 +216,27 @@ def tc_disj(patterns, env):
     pts = [t for t in ts]
     return (th, pts, rtm2, pgs, fs, rms)
 
+def conj_bindings(pgs, rms):
+    rm = dict_union(rms)
+    return [(la, k, u) for la, u in rm.items() for k, pg in enumerate(pgs) if u in pg.layout.nodes]
+
+def disj_bindings(pgs, fs, rms):
+    rm = dict_union(rms)
+    f = bidict_union(fs)
+    return [[(la, (set(f.inv[f[u]]) & pg.layout.nodes).pop()) for la, u in rm.items()] for pg in pgs]
+
 def tc_case(ca, env):
     junc, stmt, extra = ca
     
     if type(junc) is PatternConj:
         t, pts, rtm, pgs, fs, rms = tc_conj(junc.patterns, env)
-        extra.put((pgs, fs, rms))
+        extra.put((pgs, fs, rms, [compile_pattern(pg) for pg in pgs], conj_bindings(pgs, rms)))
     elif type(junc) is PatternDisj:
         t, pts, rtm, pgs, fs, rms = tc_disj(junc.patterns, env)
-        extra.put((pgs, fs, rms))
+        extra.put((pgs, fs, rms, [compile_pattern(pg) for pg in pgs], disj_bindings(pgs, fs, rms)))
     else:    
         t, rtm, pg, rm = tc_pattern(junc, env)
-        extra.put((pg, rm))
+        extra.put((pg, rm, compile_pattern(pg)))
 
     env2 = Env(env, rtm)
         
@@ -179,6 +254,10 @@ def tc_var(x, env):
         env.show()
         raise UndefVarError()
     
+    d = env.depth(la)
+    if 'depth' in vars(x) and x.depth != d:
+        d = None
+    x.depth = d
     return env[la]
 
 def tc_attr(x, env):
@@ -9,9 +9,23 @@
 
 '''
 
+import io
+import os
+import sys
+import random
+import tempfile
+
+from contextlib import redirect_stdout
+
 from pp import pprint
 
+from bidict import (
+    dict_union,
+    bidict_union)
+
 from subtype import (
+    ANON_TAB,
+    JUNC_MEMO,
     Tag,
     Lazy,
     Cla,
@@ -21,7 +35,12 @@ from subtype import (
     BOOL_TYPE,
     NO_TYPE,
     Value,
-    ValueSet)
+    ValueSet,
+    IntRange,
+    StrPrefix,
+    BoolConst,
+    ty_inf,
+    ty_sup)
 
 from pattern import (
     LabeledPattern,
@@ -36,9 +55,36 @@ from pattern import (
 
 from graph import (
     Label,
+    LayoutGraph,
+    Edges,
+    Mismatch,
+    new_node,
+    NODE_FACTORY,
+    cons_match,
+    cons_union,
+    cons_inter,
+    view_pattern,
+    extract_pattern,
     cons_pattern_graph,
     layout_graph_to_pp,
-    init_state_graph)
+    init_state_graph,
+    add_object_to_state,
+    add_value_to_state,
+    swing_state,
+    gc_state,
+    index_state,
+    watch_state,
+    Watcher,
+    gc_layout,
+    push_state,
+    pop_state,
+    find_var_at,
+    find_lvar_at,
+    value_of,
+    frame_nodes,
+    unwatch_state,
+    GraphIndex,
+    box_value)
 
 from asx import (
     VarDecl,
@@ -59,11 +105,59 @@ from asx import (
 from tc import (
     tc_stmt,
     tc_program,
-    Env)
+    Env,
+    OpArgTypeError)
 
 from st import (
+    SCOPE_LABEL,
+    match_cases,
+    match_patterns,
     st_stmt,
-    st_program)
+    st_block,
+    st_program,
+    run_interp)
+
+from batch import (
+    batch_program,
+    scalar_program)
+
+from gcpolicy import (
+    EveryStmt,
+    EveryAllocs,
+    OnScopeExit,
+    NodeThreshold,
+    Never)
+
+from compact import init_compact_state_graph
+
+from mc import (
+    PathEval,
+    pattern_source,
+    compile_pattern,
+    compile_match)
+
+from query import (
+    compile_query,
+    candidates,
+    query)
+
+from rete import ReteNetwork
+
+from mcache import MatchCache
+
+from persistent import init_persistent_state_graph
+
+from checkpoint import (
+    save_state,
+    load_state,
+    open_state,
+    save_query,
+    load_query)
+
+from op import OP_TAB
+
+import cc
+import vm
 
 
 def test_subtype():
@@ -226,16 +320,8 @@ def test_subtype():
     sg = st_stmt(s1, init_state_graph())
     
 
-def test_fig2():
-    print(
-'''
-----
----- figure 2 ----
-----
-''')
-
-    Cla.reset()
-    
+def fig2_program():
+    'the class, the pattern and the program of figure 2'
     e = Label('e')
     l = Label('l')
     r = Label('r')
@@ -255,8 +341,6 @@ def test_fig2():
             r: T_lz
         }).resolve_lazy()
     
-    pprint(T.to_pp())
-    
     pattern = ClassPattern(
         T,
         {
@@ -275,9 +359,6 @@ def test_fig2():
             r: LabeledPattern(z, ClassPattern(T, {}))
         })
     
-    g, tm, rm = cons_pattern_graph(pattern)
-    pprint(layout_graph_to_pp(g))
-    
     o = Label('o')
     
     s1 = BlockStmt([
@@ -305,21 +386,31 @@ def test_fig2():
                 ]), Extra())
             ]),
         VarEnd(o)])
-        
-    env = tc_stmt(s1, Env())
-    sg = st_stmt(s1, init_state_graph())
 
-    
-def test_fig3():
+    return (T, pattern, Program(s1))
+
+def test_fig2():
     print(
 '''
 ----
----- figure 3 ----
+---- figure 2 ----
 ----
 ''')
 
     Cla.reset()
     
+    T, pattern, prog = fig2_program()
+    pprint(T.to_pp())
+    
+    g, tm, rm = cons_pattern_graph(pattern)
+    pprint(layout_graph_to_pp(g))
+    
+    env = tc_program(prog, Env())
+    sg = st_program(prog, init_state_graph())
+
+    
+def fig3_program():
+    'the classes and the program of figure 3'
     a = Label('a')
     b = Label('b')
     c = Label('c')
@@ -336,7 +427,6 @@ def test_fig3():
             d: STR_TYPE
         })
 
-    pprint(X.to_pp())
 
     Y = Cla(Tag('Y'),
         [X], 
@@ -344,7 +434,6 @@ def test_fig3():
             a: INT_TYPE,
         })
     
-    pprint(Y.to_pp())
 
     Z = Cla(Tag('Z'),
         [X], 
@@ -352,13 +441,11 @@ def test_fig3():
             e: BOOL_TYPE,
         })
     
-    pprint(Z.to_pp())
 
     W = Cla(Tag('W'),
         [Y, Z],
         {})
     
-    pprint(W.to_pp())
     
     p1 = ClassPattern(
         Y,
@@ -452,21 +539,29 @@ def test_fig3():
         VarEnd(u),
         VarEnd(q),
         VarEnd(o)]))
-    
-    env = tc_program(prog, Env())
-    sg = st_program(prog, init_state_graph())
-    
 
-def test_gcd():
+    return ([X, Y, Z, W], prog)
+
+def test_fig3():
     print(
 '''
 ----
----- gcd ----
+---- figure 3 ----
 ----
 ''')
-    
+
     Cla.reset()
     
+    clas, prog = fig3_program()
+    for cla in clas:
+        pprint(cla.to_pp())
+    
+    env = tc_program(prog, Env())
+    sg = st_program(prog, init_state_graph())
+    
+
+def gcd_program():
+    'the gcd of 210 and 120, with a scope per iteration'
     m = Label('m')
     n = Label('n')
     t = Label('t')
@@ -507,16 +602,1697 @@ def test_gcd():
         VarEnd(n),
         VarEnd(m)
         ])
+
+    return Program(s1)
+
+def test_gcd():
+    print(
+'''
+----
+---- gcd ----
+----
+''')
     
-    env = tc_stmt(s1, Env())
-    sg = st_stmt(s1, init_state_graph())
+    Cla.reset()
+    
+    prog = gcd_program()
+    env = tc_program(prog, Env())
+    sg = st_program(prog, init_state_graph())
+    
+
+def test_incremental_gc():
+    print(
+'''
+----
+---- incremental gc ----
+----
+''')
+    
+    Cla.reset()
+    
+    l = Label('l')
+    r = Label('r')
+    o = Label('o')
+    x = Label('x')
+    
+    N_lz = Lazy(Tag('N'))
+    
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            r: N_lz
+        }).resolve_lazy()
+    
+    prog = Program(BlockStmt([
+        VarDecl(o, N),
+        VarDecl(x, N),
+        AssignStmt(VarExpr(o), NewExpr(N)),
+        AssignStmt(AttrExpr(VarExpr(o), l), NewExpr(N)),
+        AssignStmt(AttrExpr(AttrExpr(VarExpr(o), l), l), VarExpr(o)),
+        AssignStmt(AttrExpr(AttrExpr(VarExpr(o), l), r), NewExpr(N)),
+        AssignStmt(VarExpr(x), AttrExpr(VarExpr(o), l)),
+        AssignStmt(VarExpr(o), NewExpr(N)),
+        AssignStmt(VarExpr(x), VarExpr(o)),
+        AssignStmt(AttrExpr(VarExpr(o), r), VarExpr(o)),
+        AssignStmt(VarExpr(o), NewExpr(N)),
+        VarEnd(x),
+        VarEnd(o)]))
+    
+    env = tc_program(prog, Env())
+    sg = st_program(prog, init_state_graph())
+    sg2 = st_program(prog, init_state_graph(True))
+    print(len(sg.layout.nodes), len(sg2.layout.nodes))
+    print(sg2.layout.edges.refs.freed)
+
+    'a fresh node closed into a cycle before any collection'
+    sg3 = init_state_graph(True)
+    p = add_object_to_state(sg3, N)
+    swing_state(sg3, p, l, p)
+    sg3 = gc_state(sg3)
+    assert p not in sg3.layout.nodes
+    assert len(sg3.layout.nodes) == 1
+
+    'random swings, scopes and collections leave the same live nodes as gc_state'
+    v = Label('v')
+    for seed in range(40):
+        rnd = random.Random(seed)
+        full = init_state_graph()
+        inc = init_state_graph(True)
+        twin = {full.layout.root: inc.layout.root}
+        depth = 0
+        for step in range(120):
+            live = [p for p in gc_layout(full.layout).nodes if full.types.get(p) is N]
+            op = rnd.random()
+            if op < 0.25 or not live:
+                p = add_object_to_state(full, N)
+                twin[p] = add_object_to_state(inc, N)
+                for la in [l, r]:
+                    twin[full.layout.edges.targets[(p, la)]] = inc.layout.edges.targets[(twin[p], la)]
+                src, la = rnd.choice([(full.layout.root, v)] + [(q, rnd.choice([l, r])) for q in live])
+                swing_state(full, src, la, p)
+                swing_state(inc, twin[src], la, twin[p])
+            elif op < 0.7:
+                p, q = rnd.choice(live), rnd.choice(live)
+                la = rnd.choice([l, r])
+                swing_state(full, p, la, q)
+                swing_state(inc, twin[p], la, twin[q])
+            elif op < 0.8:
+                full = push_state(full, SCOPE_LABEL)
+                inc = push_state(inc, SCOPE_LABEL)
+                twin[full.layout.root] = inc.layout.root
+                depth += 1
+                p = rnd.choice(live)
+                swing_state(full, full.layout.root, v, p)
+                swing_state(inc, inc.layout.root, v, twin[p])
+            elif op < 0.9 and depth:
+                full = pop_state(full, SCOPE_LABEL, False)
+                inc = pop_state(inc, SCOPE_LABEL, False)
+                depth -= 1
+            else:
+                full = gc_state(full)
+                inc = gc_state(inc)
+                assert {twin[p] for p in full.layout.nodes} == set(inc.layout.nodes)
+                assert {twin[p]: t for p, t in full.types.items()} == dict(inc.types)
+        full = gc_state(full)
+        inc = gc_state(inc)
+        assert {twin[p] for p in full.layout.nodes} == set(inc.layout.nodes)
+    
+def test_value_constraints():
+    print(
+'''
+----
+---- value constraints ----
+----
+''')
+
+    Cla.reset()
+
+    SMALL = IntRange(0, 10)
+    BIG = IntRange(0, 10**6)
+    print(subtype(ValueSet({Value(INT_TYPE, 3)}), BIG))
+    print(subtype(ValueSet({Value(INT_TYPE, -3)}), BIG))
+    print(subtype(SMALL, BIG), subtype(BIG, SMALL), subtype(BIG, INT_TYPE))
+    print(subtype(IntRange(1, 2), ValueSet(set(Value(INT_TYPE, x) for x in range(3)))))
+    print(subtype(StrPrefix('app'), StrPrefix('ap')), subtype(StrPrefix('b'), StrPrefix('ap')))
+    print(subtype(BoolConst(False), BOOL_TYPE), subtype(BoolConst(False), BoolConst(True)))
+
+    print(ty_inf([IntRange(0, 10), IntRange(5, None)]).key)
+    print(ty_sup([IntRange(0, 10), IntRange(20, 30)]).key)
+    print(ty_sup([StrPrefix('apple'), StrPrefix('apricot')]).key)
+    print(ty_inf([StrPrefix('apple'), StrPrefix('b')]).vector)
+
+    n = Label('n')
+    s = Label('s')
+    o = Label('o')
+    x = Label('x')
+
+    R = Cla(Tag('R'),
+        [],
+        {
+            n: INT_TYPE,
+            s: STR_TYPE
+        })
+
+    prog = Program(BlockStmt([
+        VarDecl(o, R),
+        AssignStmt(VarExpr(o), NewExpr(R)),
+        AssignStmt(AttrExpr(VarExpr(o), n), Value(INT_TYPE, 4321)),
+        AssignStmt(AttrExpr(VarExpr(o), s), Value(STR_TYPE, 'apricot')),
+        MatchStmt(VarExpr(o), [
+            Case(ClassPattern(R, {n: SMALL}), PrintStmt([Value(STR_TYPE, 'small, This should not match.')]), Extra()),
+            Case(ClassPattern(R, {n: LabeledPattern(x, BIG), s: StrPrefix('ap')}),
+                PrintStmt([Value(STR_TYPE, 'big'), VarExpr(x)]), Extra())
+            ]),
+        VarEnd(o)]))
+
+    env = tc_program(prog, Env())
+    sg = st_program(prog, init_state_graph())
+    
+def test_batch():
+    print(
+'''
+----
+---- batch ----
+----
+''')
+
+    Cla.reset()
+
+    a = Label('a')
+    b = Label('b')
+    s = Label('s')
+
+    prog = Program(BlockStmt([
+        VarDecl(s, STR_TYPE),
+        IfStmt(
+            AndExpr(
+                OpExpr(Label('ine'), [VarExpr(b), Value(INT_TYPE, 0)]),
+                OpExpr(Label('ieq'), [OpExpr(Label('mod'), [VarExpr(a), VarExpr(b)]), Value(INT_TYPE, 0)])),
+            AssignStmt(VarExpr(s), Value(STR_TYPE, 'divides')),
+            AssignStmt(VarExpr(s), Value(STR_TYPE, 'does not divide'))),
+        WhileStmt(
+            OpExpr(Label('igt'), [VarExpr(a), Value(INT_TYPE, 100)]),
+            AssignStmt(VarExpr(a), OpExpr(Label('div'), [VarExpr(a), Value(INT_TYPE, 10)]))),
+        PrintStmt([VarExpr(b), VarExpr(s), VarExpr(a)]),
+        VarEnd(s)]))
+
+    env = tc_program(prog, Env(None, {a: INT_TYPE, b: INT_TYPE}))
+    records = [{a: Value(INT_TYPE, x), b: Value(INT_TYPE, y)} for x, y in [(12, 4), (12345, 5), (7, 0), (-9, 2), (10**20, 3)]]
+    scalar_program(prog, records)
+    assert batch_program(prog, records)
+
+    'records the lanes cannot hold fall back to the scalar path'
+    assert not batch_program(prog, records[:2] + [{**records[2], Label('c'): Value(INT_TYPE, 1)}])
+
+    'anything else is a bug and is not swallowed'
+    try:
+        batch_program(prog, [{a: Value(INT_TYPE, 1), b: Value(STR_TYPE, 'x')}])
+        assert False
+    except TypeError:
+        pass
+    
+def test_gc_policies():
+    print(
+'''
+----
+---- gc policies ----
+----
+''')
+
+    Cla.reset()
+
+    n = Label('n')
+    t = Label('t')
+
+    prog = Program(BlockStmt([
+        VarDecl(n, INT_TYPE),
+        AssignStmt(VarExpr(n), Value(INT_TYPE, 20)),
+        WhileStmt(
+            OpExpr(Label('igt'), [VarExpr(n), Value(INT_TYPE, 0)]),
+            BlockStmt([
+                VarDecl(t, INT_TYPE),
+                AssignStmt(VarExpr(t), OpExpr(Label('sub'), [VarExpr(n), Value(INT_TYPE, 1)])),
+                AssignStmt(VarExpr(n), VarExpr(t)),
+                VarEnd(t)])),
+        PrintStmt([Value(STR_TYPE, 'n'), VarExpr(n)]),
+        VarEnd(n)]))
+
+    env = tc_program(prog, Env())
+    for init in [init_state_graph, init_compact_state_graph]:
+        runs = {}
+        for name, policy in [
+                ('every stmt', EveryStmt()),
+                ('every 16 allocs', EveryAllocs(16)),
+                ('on scope exit', OnScopeExit()),
+                ('node threshold', NodeThreshold(32)),
+                ('never', Never())]:
+            sg = st_program(prog, init(), policy)
+            assert not sg.layout.edges.watchers
+            runs[name] = policy.stats()
+            print(init.__name__, name, policy.stats()['collections'], 'of', policy.stats()['requests'])
+
+        'every run asks the same questions, only the answers differ'
+        assert len({r['requests'] for r in runs.values()}) == 1
+        assert runs['every stmt']['collections'] == runs['every stmt']['requests']
+        assert runs['never']['collections'] == 0
+        assert runs['on scope exit']['collections'] == 1 + 20
+        assert 0 < runs['every 16 allocs']['collections'] < runs['every stmt']['collections']
+        assert 0 < runs['node threshold']['collections'] < runs['every stmt']['collections']
+
+    'the policy belongs to the run, not to the module'
+    outer = Never()
+    def inner(sg, ip):
+        sg = st_program(Program(BlockStmt([])), sg, EveryStmt())
+        return st_block(prog.block, sg, ip)
+    sg = run_interp(inner, init_state_graph(), outer)
+    assert outer.stats()['collections'] == 0 and outer.stats()['requests'] > 0
+    
+def test_compact_gc():
+    print(
+'''
+----
+---- compact gc ----
+----
+''')
+
+    Cla.reset()
+
+    l = Label('l')
+    r = Label('r')
+    v = Label('v')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            r: N_lz
+        }).resolve_lazy()
+
+    sg = init_compact_state_graph()
+    root = sg.layout.root
+    a = add_object_to_state(sg, N)
+    b = add_object_to_state(sg, N)
+    c = add_object_to_state(sg, N)
+    d = add_object_to_state(sg, N)
+    swing_state(sg, a, l, b)
+    swing_state(sg, c, l, d)
+    swing_state(sg, root, v, a)
+
+    idx = index_state(sg)
+    gone = []
+    net = ReteNetwork(sg)
+    pr = net.register(sg, compile_query(ClassPattern(N, {l: ClassPattern(N, {})})), None, gone.append)
+    assert set(pr.matches) == {a, b, c, d}
+
+    sg = gc_state(sg)
+    print(len(sg.layout.nodes))
+
+    'handles issued before the collection are stale, never aliases'
+    for p in [a, b, c, d]:
+        assert p not in sg.layout.nodes
+    try:
+        swing_state(sg, a, l, a)
+        assert False
+    except KeyError:
+        pass
+
+    a2 = sg.layout.edges.targets[(sg.layout.root, v)]
+    b2 = sg.layout.edges.targets[(a2, l)]
+    for w in [idx, net]:
+        assert w.types[a2] is N and w.types[b2] is N
+        assert w.sources(b2) == {(a2, l)}
+        assert len(w.by_type[N]) == 2
+
+    net.flush(sg)
+    assert set(gone) == {c, d}
+    assert set(pr.matches) == {a2, b2}
+
+    'matching reads rows through their shapes, also across renumberings'
+    for program in [fig2_program, fig3_program]:
+        Cla.reset()
+        prog = program()[-1]
+        tc_program(prog, Env())
+        ref = printed(st_program, prog, init_state_graph(), Never())
+        for policy in [EveryStmt(), Never()]:
+            assert printed(st_program, prog, init_compact_state_graph(), policy) == ref
     
+def test_deep_match():
+    print(
+'''
+----
+---- deep match ----
+----
+''')
+
+    Cla.reset()
+
+    nx = Label('next')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            nx: N_lz
+        }).resolve_lazy()
+
+    'chains well past the recursion limit, built directly as the parser still recurses'
+    k = 3*sys.getrecursionlimit()
+    def chain(cycle):
+        ps = [new_node() for i in range(k)]
+        es = Edges({p: {nx} for p in ps}, {(p, nx): q for p, q in zip(ps, ps[1:])})
+        if cycle:
+            es.targets[(ps[-1], nx)] = ps[0]
+        else:
+            es.labels[ps[-1]] = set()
+        return (LayoutGraph(set(ps), es, ps[0]), {p: N for p in ps}, ps)
+
+    sg = init_state_graph()
+    qs = [add_object_to_state(sg, N) for i in range(k)]
+    for p, q in zip(qs, qs[1:]):
+        swing_state(sg, p, nx, q)
+    pg = view_pattern(sg, qs[0])
+
+    g1, tm1, ps1 = chain(False)
+    f = cons_match(g1, pg.layout, subtype, tm1, pg.types)
+    assert [f[p] for p in ps1] == qs
+
+    g2, tm2, ps2 = chain(True)
+    try:
+        cons_match(g2, pg.layout, subtype, tm2, pg.types)
+        assert False
+    except Mismatch:
+        pass
+
+    fs = cons_union([g1, g2])
+    assert len(set(fs[0].values())) == k and fs[0][ps1[-1]] == fs[1][ps2[-1]]
+
+    fs = cons_inter([g1, g2])
+    assert len(set(fs[0].values())) == k and len(fs[1]) == k
+    print(k, 'deep')
+    
+def test_pattern_view():
+    print(
+'''
+----
+---- pattern view ----
+----
+''')
+
+    Cla.reset()
+
+    l = Label('l')
+    e = Label('e')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            e: INT_TYPE
+        }).resolve_lazy()
+
+    sg = init_state_graph()
+    p = add_object_to_state(sg, N)
+    q = add_object_to_state(sg, N)
+    swing_state(sg, p, l, q)
+    swing_state(sg, q, l, p)
+    swing_state(sg, p, e, add_value_to_state(sg, Value(INT_TYPE, 5)))
+    swing_state(sg, q, e, add_value_to_state(sg, Value(INT_TYPE, 7)))
+    add_object_to_state(sg, N)
+
+    'the view reads the state graph in place and agrees with the copy'
+    pv = view_pattern(sg, p)
+    px = extract_pattern(sg, p)
+    assert pv.layout.nodes is sg.layout.nodes
+    assert len(px.layout.nodes) < len(sg.layout.nodes)
+    for u in px.layout.nodes:
+        assert pv.types[u] == px.types[u]
+        assert set(pv.layout.edges.labels[u]) == set(px.layout.edges.labels[u])
+
+    for hi, ok in [(9, True), (6, False)]:
+        g, tm, rm = cons_pattern_graph(ClassPattern(N, {
+            e: IntRange(0, 9),
+            l: ClassPattern(N, {e: IntRange(0, hi)})}))
+        fs = []
+        for pg in [pv, px]:
+            try:
+                fs.append(dict(cons_match(g, pg.layout, subtype, tm, pg.types)))
+            except Mismatch:
+                fs.append(None)
+        assert fs[0] == fs[1] and (fs[0] is not None) == ok
+        print(hi, ok)
+    
+def test_compiled_match():
+    print(
+'''
+----
+---- compiled match ----
+----
+''')
+
+    Cla.reset()
+
+    l = Label('l')
+    r = Label('r')
+    e = Label('e')
+    x = Label('x')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            r: N_lz,
+            e: INT_TYPE
+        }).resolve_lazy()
+
+    'a path back to the labeled root, with a payload test on the way'
+    cycle = LabeledPattern(x, ClassPattern(N, {l: ClassPattern(N, {e: IntRange(0, 4), r: PatternRef(x)})}))
+    'three pattern nodes, which must match three distinct nodes'
+    fork = ClassPattern(N, {l: ClassPattern(N, {}), r: ClassPattern(N, {})})
+
+    sg = init_state_graph()
+    a, b, c, d, t = [add_object_to_state(sg, N) for k in range(5)]
+    for p, k in [(a, 1), (b, 3), (c, 1), (d, 7), (t, 2)]:
+        swing_state(sg, p, e, add_value_to_state(sg, Value(INT_TYPE, k)))
+    swing_state(sg, a, l, b)
+    swing_state(sg, b, r, a)
+    swing_state(sg, c, l, b)
+    swing_state(sg, c, r, b)
+    swing_state(sg, d, l, d)
+    swing_state(sg, d, r, d)
+    swing_state(sg, t, l, a)
+    swing_state(sg, t, r, b)
+
+    for pattern, cases in [
+        (cycle, [(a, True), (c, False), (d, False), (t, False)]),
+        (fork, [(t, True), (c, False), (d, False)])]:
+        g, tm, rm = cons_pattern_graph(pattern)
+        pg = (g, tm)
+        src, consts = pattern_source(pg)
+        assert 'for ' not in src and 'while ' not in src
+        m = compile_pattern(pg)
+        for p, ok in cases:
+            view = view_pattern(sg, p)
+            f = match_patterns(view, pg)
+            assert (f is not None) == ok
+            assert m(view) == (None if f is None else dict(f))
+            if ok and x in rm:
+                assert m(view)[rm[x]] == p
+        print(len(src.splitlines()), 'lines', [ok for p, ok in cases])
+
+def test_decision_tree():
+    print(
+'''
+----
+---- decision tree ----
+----
+''')
+
+    Cla.reset()
+
+    o = Label('o')
+    l = Label('l')
+    e = Label('e')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            e: INT_TYPE
+        }).resolve_lazy()
+
+    'the first three cases share the root and payload tests, the last takes anything'
+    juncs = [
+        ClassPattern(N, {e: IntRange(0, 1), l: ClassPattern(N, {e: IntRange(0, 1)})}),
+        ClassPattern(N, {e: IntRange(0, 1), l: ClassPattern(N, {e: IntRange(2, 9)})}),
+        ClassPattern(N, {e: IntRange(0, 1)}),
+        ClassPattern(N, {})]
+    m = MatchStmt(VarExpr(o), [Case(junc, BlockStmt([]), Extra()) for junc in juncs])
+    tc_stmt(m, Env(None, {o: N}))
+
+    sg = init_state_graph()
+    def node(k, q = None):
+        p = add_object_to_state(sg, N)
+        swing_state(sg, p, e, add_value_to_state(sg, Value(INT_TYPE, k)))
+        if q is not None:
+            swing_state(sg, p, l, q)
+        return p
+    ps = [node(0, node(1)), node(1, node(5)), node(0), node(5, node(0))]
+
+    'every scrutinee also matches the cases after its own, the first one wins'
+    seq = [match_cases(view_pattern(sg, p), m.cas)[0] for p in ps]
+    assert seq == [0, 1, 2, 3]
+    tree = compile_match(m)
+    assert all(ca.extra.tree is tree for ca in m.cas)
+    assert [match_cases(view_pattern(sg, p), m.cas)[0] for p in ps] == seq
+
+    'a scrutinee walks one path of the tree, which repeats no test'
+    for p in ps:
+        ev = PathEval(view_pattern(sg, p))
+        n = tree.root
+        tests = []
+        while n.test is not None:
+            tests.append(n.test)
+            n = n.yes if ev.test(n.test) else n.no
+        assert len(set(tests)) == len(tests)
+        print(len(tests), 'tests', n.row[0])
+
+def test_junction_bindings():
+    print(
+'''
+----
+---- junction bindings ----
+----
+''')
+
+    Cla.reset()
+
+    o = Label('o')
+    x = Label('x')
+    y = Label('y')
+    l = Label('l')
+    r = Label('r')
+    e = Label('e')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            r: N_lz,
+            e: INT_TYPE
+        }).resolve_lazy()
+
+    conj = PatternConj([
+        ClassPattern(N, {l: LabeledPattern(x, ClassPattern(N, {}))}),
+        ClassPattern(N, {l: ClassPattern(N, {e: IntRange(0, 6)}), r: LabeledPattern(y, ClassPattern(N, {}))})])
+    disj = PatternDisj([
+        ClassPattern(N, {l: LabeledPattern(x, ClassPattern(N, {e: IntRange(0, 4)}))}),
+        ClassPattern(N, {l: LabeledPattern(x, ClassPattern(N, {})), r: ClassPattern(N, {e: IntRange(5, 9)})})])
+    m = MatchStmt(VarExpr(o), [Case(junc, BlockStmt([]), Extra()) for junc in [conj, disj]])
+    tc_stmt(m, Env(None, {o: N}))
+
+    'the bindings as they were worked out per match, before the tables'
+    def conj_ref(pg, pgs1, rms1):
+        fs = [match_patterns(pg, pg1) for pg1 in pgs1]
+        if any(f is None for f in fs):
+            return None
+        f = bidict_union(fs)
+        return [(la, f[u]) for la, u in dict_union(rms1).items()]
+
+    def disj_ref(pg, pgs1, fs1, rms1):
+        for pg1 in pgs1:
+            f = match_patterns(pg, pg1)
+            if f is not None:
+                f1 = bidict_union(fs1)
+                return [(la, f[(set(f1.inv[f1[u]]) & set(f)).pop()]) for la, u in dict_union(rms1).items()]
+        return None
+
+    'each label is tabled against the conjunct, or per disjunct the node, it binds'
+    pgs1, fs1, rms1, ms1, bt1 = m.cas[0].extra.get()
+    pgs2, fs2, rms2, ms2, bts2 = m.cas[1].extra.get()
+    assert sorted((la.id, k) for la, k, u in bt1) == [('x', 0), ('y', 1)]
+    assert all(u is rms1[k][la] for la, k, u in bt1)
+    assert [[la for la, u in bt] for bt in bts2] == [[x], [x]]
+    assert all(u in pg.layout.nodes for pg, bt in zip(pgs2, bts2) for la, u in bt)
+
+    sg = init_state_graph()
+    def node(k, lq = None, rq = None):
+        p = add_object_to_state(sg, N)
+        swing_state(sg, p, e, add_value_to_state(sg, Value(INT_TYPE, k)))
+        for la, q in [(l, lq), (r, rq)]:
+            if q is not None:
+                swing_state(sg, p, la, q)
+        return p
+
+    a, b, c, d, t = node(3), node(1), node(8), node(7), node(2)
+    'both conjuncts, the second disjunct, the first as the conjunction is not injective, none'
+    for p, km in [
+        (node(0, a, b), (0, [(x, a), (y, b)])),
+        (node(0, c, d), (1, [(x, c)])),
+        (node(0, t, t), (1, [(x, t)])),
+        (node(0), None)]:
+        pg = view_pattern(sg, p)
+        km2 = match_cases(pg, m.cas)
+        assert (km2 if km2 is None else (km2[0], sorted(km2[1]))) == km
+        if km is not None and km[0] == 0:
+            assert sorted(conj_ref(pg, pgs1, rms1)) == km[1]
+        elif km is not None:
+            assert conj_ref(pg, pgs1, rms1) is None and disj_ref(pg, pgs2, fs2, rms2) == km[1]
+        print(None if km is None else km[0])
+    
+def test_match_cache():
+    print(
+'''
+----
+---- match cache ----
+----
+''')
+
+    Cla.reset()
+
+    o = Label('o')
+    v = Label('v')
+    l = Label('l')
+    e = Label('e')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            e: INT_TYPE
+        }).resolve_lazy()
+
+    juncs = [
+        ClassPattern(N, {e: IntRange(0, 1), l: ClassPattern(N, {e: IntRange(0, 1)})}),
+        ClassPattern(N, {e: IntRange(0, 1)}),
+        ClassPattern(N, {})]
+    m = MatchStmt(VarExpr(o), [Case(junc, BlockStmt([]), Extra()) for junc in juncs])
+    tc_stmt(m, Env(None, {o: N}))
+
+    'the same handles in two compact graphs name different structures'
+    cache = MatchCache()
+    kms = []
+    for x in [0, 5]:
+        sg = init_compact_state_graph()
+        p = add_object_to_state(sg, N)
+        swing_state(sg, p, e, add_value_to_state(sg, Value(INT_TYPE, x)))
+        km = cache.lookup(sg, p, m.cas, match_cases)
+        assert km == match_cases(view_pattern(sg, p), m.cas)
+        kms.append((p, km[0]))
+    assert kms[0][0] == kms[1][0] and kms[0][1] != kms[1][1]
+
+    sg = init_state_graph()
+    def node(k, q = None):
+        p = add_object_to_state(sg, N)
+        swing_state(sg, p, e, add_value_to_state(sg, Value(INT_TYPE, k)))
+        if q is not None:
+            swing_state(sg, p, l, q)
+        return p
+
+    'a repeated scrutinee reuses its canon, an equal structure its result'
+    t = node(9)
+    b = node(1, t)
+    p = node(0, b)
+    g = node(0, node(1, node(9)))
+    swing_state(sg, sg.layout.root, v, p)
+    for q in [p, b]:
+        assert cache.lookup(sg, q, m.cas, match_cases) == match_cases(view_pattern(sg, q), m.cas)
+    table = cache.table(sg)
+    c = table.canons[p]
+    hits = cache.hits
+    assert cache.lookup(sg, p, m.cas, match_cases)[0] == 0
+    assert cache.hits == hits + 1 and table.canons[p] is c
+    assert cache.lookup(sg, g, m.cas, match_cases)[0] == 0
+    assert cache.hits == hits + 2 and table.canons[g] == c
+
+    'a swing at the far end of a region drops every canon over it'
+    invalidations = cache.invalidations
+    swing_state(sg, t, e, add_value_to_state(sg, Value(INT_TYPE, 2)))
+    assert p not in table.canons and b not in table.canons and g in table.canons
+    assert cache.invalidations == invalidations + 2
+    misses = cache.misses
+    assert cache.lookup(sg, p, m.cas, match_cases) == match_cases(view_pattern(sg, p), m.cas)
+    assert cache.misses == misses + 1
+
+    'a collection drops the canons of the roots it frees'
+    sg = gc_state(sg)
+    assert set(table.canons) == {p}
+    print(cache.stats()['hits'], cache.stats()['misses'], cache.stats()['invalidations'])
+
+    'tables of the least recently used graphs are detached'
+    sgs = [init_compact_state_graph() for i in range(2*cache.maxgraphs)]
+    for sg2 in sgs:
+        cache.lookup(sg2, add_object_to_state(sg2, N), m.cas, match_cases)
+    assert len(cache.tables) == cache.maxgraphs
+    assert not any(sg2.layout.edges.watchers for sg2 in sgs[:cache.maxgraphs])
+    assert all(sg2.layout.edges.watchers for sg2 in sgs[cache.maxgraphs:])
+
+    'a run leaves no canons watching its graph'
+    prog = fig2_program()[-1]
+    tc_program(prog, Env())
+    misses = cache.misses
+    sg2 = st_program(prog, init_state_graph(), Never(), cache)
+    assert cache.misses > misses
+    assert not sg2.layout.edges.watchers
+    
+def test_tag_masks():
+    print(
+'''
+----
+---- tag masks ----
+----
+''')
+
+    Cla.reset()
+
+    rnd = random.Random(0)
+    clas = []
+    for i in range(60):
+        supers = rnd.sample(clas, min(len(clas), rnd.randrange(4)))
+        clas.append(Cla(Tag('M{}'.format(i)), supers, {}))
+
+    'masks agree with the tag sets they encode'
+    n = 0
+    for x in clas:
+        for y in clas:
+            assert subtype(x, y) == (x.tags >= y.tags) == (x <= y)
+            assert (x == y) == (x.tags == y.tags)
+            n += subtype(x, y)
+    print(n, 'of', len(clas)**2)
+
+    for i in range(20):
+        cs = rnd.sample(clas, 3)
+        ci = Cla.inter(cs)
+        cu = Cla.union(cs)
+        assert ci.tags == set().union(*(c.tags for c in cs))
+        assert cu.tags == set.intersection(*(c.tags for c in cs))
+        for c in cs:
+            assert subtype(ci, c) and subtype(c, cu)
+    
+def test_hash_cons():
+    print(
+'''
+----
+---- hash cons ----
+----
+''')
+
+    Cla.reset()
+
+    rnd = random.Random(1)
+    clas = []
+    for i in range(40):
+        supers = rnd.sample(clas, min(len(clas), rnd.randrange(3)))
+        clas.append(Cla(Tag('J{}'.format(i)), supers, {}))
+
+    'equal anonymous classes are one object, whichever operands built them'
+    a, b, c = clas[10:13]
+    assert Cla.inter([a, b]) is Cla.inter([a, b])
+    assert Cla.inter([a, b, a]) is Cla.inter([b, a])
+    assert Cla.union([a, b]) is Cla.union([b, a])
+
+    'the tables stay within their bounds and are emptied by a reset'
+    saved = (ANON_TAB.maxsize, JUNC_MEMO.maxsize)
+    ANON_TAB.maxsize = JUNC_MEMO.maxsize = 16
+    try:
+        for i in range(200):
+            cs = rnd.sample(clas, 2)
+            assert Cla.inter(cs) == Cla(None, cs)
+            assert len(ANON_TAB.table) <= 16 and len(JUNC_MEMO.table) <= 16
+        assert ANON_TAB.evictions > 0 and JUNC_MEMO.evictions > 0
+    finally:
+        ANON_TAB.maxsize, JUNC_MEMO.maxsize = saved
+    Cla.reset()
+    assert not ANON_TAB.table and not JUNC_MEMO.table
+    print(JUNC_MEMO.stats()['hits'] > 0)
+    
+def value_of_py(x):
+    return Value({bool: BOOL_TYPE, int: INT_TYPE, str: STR_TYPE}[type(x)], x)
+
+def value_set(*xs):
+    return ValueSet({value_of_py(x) for x in xs})
+
+VALUE_UNIVERSE = [value_of_py(x) for x in list(range(-3, 13)) + ['', 'a', 'ab', 'abc', 'b', 'ba', True, False]]
+
+def test_ty_inf():
+    print(
+'''
+----
+---- ty_inf ----
+----
+''')
+
+    Cla.reset()
+
+    'the infimum admits exactly the values every operand admits'
+    tss = [
+        [IntRange(0, 9), IntRange(5, None)],
+        [IntRange(0, 3), IntRange(5, 9)],
+        [IntRange(None, 4), INT_TYPE],
+        [IntRange(0, 9), value_set(1, 5, 11)],
+        [value_set(1, 2, 3), value_set(2, 3, 4)],
+        [value_set(1, 2), value_set(1, 2, 3), IntRange(2, None)],
+        [value_set(1, 2), INT_TYPE],
+        [StrPrefix('a'), StrPrefix('ab')],
+        [StrPrefix('a'), StrPrefix('b')],
+        [StrPrefix('a'), value_set('ab', 'ba')],
+        [value_set('a', 'b'), value_set('b', 'ba')],
+        [BoolConst(True), BoolConst(True)],
+        [BoolConst(True), BoolConst(False)],
+        [BoolConst(False), value_set(True, False)],
+        [value_set(True), BOOL_TYPE]]
+    for ts in tss:
+        t = ty_inf(ts)
+        for v in VALUE_UNIVERSE:
+            vs = ValueSet({v})
+            assert subtype(vs, t) == all(subtype(vs, t2) for t2 in ts)
+        print(type(t).__name__, sorted(x.value for x in VALUE_UNIVERSE if subtype(ValueSet({x}), t)))
+    
+def test_ty_sup():
+    print(
+'''
+----
+---- ty_sup ----
+----
+''')
+
+    Cla.reset()
+
+    'the supremum admits every value some operand admits'
+    tss = [
+        [IntRange(0, 3), IntRange(5, 9)],
+        [IntRange(0, 3), value_set(7)],
+        [IntRange(0, 3), INT_TYPE],
+        [value_set(1, 2), value_set(2, 3)],
+        [StrPrefix('ab'), StrPrefix('abc'), value_set('a')],
+        [BoolConst(True), BoolConst(False)],
+        [IntRange(0, 3), StrPrefix('a')],
+        [value_set(1), value_set('a')],
+        [BoolConst(True), value_set('b'), INT_TYPE]]
+    for ts in tss:
+        t = ty_sup(ts)
+        for v in VALUE_UNIVERSE:
+            vs = ValueSet({v})
+            if any(subtype(vs, t2) for t2 in ts):
+                assert subtype(vs, t)
+        for t2 in ts:
+            assert subtype(t2, t)
+        print(type(t).__name__, sorted(str(x.value) for x in VALUE_UNIVERSE if subtype(ValueSet({x}), t)))
+
+    assert ty_sup([value_set(1, 2), value_set(2, 3)]) == value_set(1, 2, 3)
+    assert ty_sup([IntRange(0, 3), IntRange(5, 9)]) == IntRange(0, 9)
+    assert ty_sup([IntRange(0, 3), INT_TYPE]) is INT_TYPE
+    
+def test_var_depths():
+    print(
+'''
+----
+---- var depths ----
+----
+''')
+
+    Cla.reset()
+
+    x = Label('x')
+    y = Label('y')
+    shared = VarExpr(x)
+    inner = VarExpr(x)
+    outer = VarExpr(x)
+
+    prog = Program(BlockStmt([
+        VarDecl(x, INT_TYPE),
+        AssignStmt(VarExpr(x), Value(INT_TYPE, 1)),
+        VarDecl(y, INT_TYPE),
+        AssignStmt(VarExpr(y), outer),
+        PrintStmt([shared]),
+        VarDecl(x, INT_TYPE),
+        AssignStmt(VarExpr(x), Value(INT_TYPE, 2)),
+        PrintStmt([shared, inner, VarExpr(y)]),
+        VarEnd(x),
+        VarEnd(y),
+        VarEnd(x)]))
+
+    'depths live on the nodes, a node read at two depths has none'
+    tc_program(prog, Env())
+    assert outer.depth == 1 and inner.depth == 0 and shared.depth is None
+    tc_program(prog, Env())
+    assert outer.depth == 1 and inner.depth == 0 and shared.depth is None
+
+    for run in [st_program, cc.run_program, vm.run_program]:
+        run(prog, init_state_graph())
+    
+def test_symbol_table():
+    print(
+'''
+----
+---- symbol table ----
+----
+''')
+
+    Cla.reset()
+
+    'the scope chain walk the flat table replaced'
+    def chain_lookup(env, k):
+        d = 0
+        while env is not None:
+            if k in env.tab:
+                return (env.tab[k], d)
+            env = env.outer
+            d += 1
+        return None
+
+    rnd = random.Random(2)
+    ks = [Label(c) for c in 'abcde']
+    ts = [INT_TYPE, STR_TYPE, BOOL_TYPE]
+    root = Env(None, {ks[0]: INT_TYPE})
+    envs = [root]
+    for i in range(300):
+        env = rnd.choice(envs)
+        op = rnd.randrange(4)
+        if op == 0 and len(envs) < 40:
+            'a nested scope, often shadowing'
+            envs.append(Env(env, {k: rnd.choice(ts) for k in rnd.sample(ks, rnd.randrange(3))}))
+        elif op == 1:
+            env[rnd.choice(ks)] = rnd.choice(ts)
+        else:
+            k = rnd.choice(ks)
+            r = chain_lookup(env, k)
+            assert (k in env) == (r is not None)
+            if r is not None:
+                assert env[k] is r[0] and env.depth(k) == r[1]
+    print(len(envs), 'scopes')
+    
+def test_compiled_programs():
+    print(
+'''
+----
+---- compiled programs ----
+----
+''')
+
+    Cla.reset()
+
+    n = Label('n')
+    blk = BlockStmt([
+        VarDecl(n, INT_TYPE),
+        AssignStmt(VarExpr(n), Value(INT_TYPE, 3)),
+        WhileStmt(
+            OpExpr(Label('igt'), [VarExpr(n), Value(INT_TYPE, 0)]),
+            AssignStmt(VarExpr(n), OpExpr(Label('sub'), [VarExpr(n), Value(INT_TYPE, 1)]))),
+        PrintStmt([Value(STR_TYPE, 'n'), VarExpr(n)]),
+        VarEnd(n)])
+
+    'the compiled form lives on the program it was compiled from'
+    p1 = Program(blk)
+    p2 = Program(blk)
+    tc_program(p1, Env())
+    assert p1.extra is not p2.extra
+    f = cc.cc_program(p1)
+    assert cc.cc_program(p1) is f and p1.extra.closure is f
+    assert p2.extra.closure is None
+    b = vm.vm_program(p1)
+    assert vm.vm_program(p1) is b and p1.extra.bytecode is b
+    assert p2.extra.bytecode is None
+    cc.run_program(p1, init_state_graph())
+    vm.run_program(p1, init_state_graph())
+
+    'a scalar node written over in place must not be one a read shared'
+    v = Label('v')
+    x = Label('x')
+    y = Label('y')
+    o = Label('o')
+    B = Cla(Tag('B'), [], {v: INT_TYPE})
+    prog = Program(BlockStmt([
+        VarDecl(x, INT_TYPE),
+        VarDecl(y, INT_TYPE),
+        VarDecl(o, B),
+        VarDecl(n, INT_TYPE),
+        AssignStmt(VarExpr(x), Value(INT_TYPE, 0)),
+        AssignStmt(VarExpr(n), Value(INT_TYPE, 0)),
+        AssignStmt(VarExpr(o), NewExpr(B)),
+        WhileStmt(
+            OpExpr(Label('ilt'), [VarExpr(n), Value(INT_TYPE, 5)]),
+            BlockStmt([
+                AssignStmt(VarExpr(x), OpExpr(Label('add'), [VarExpr(x), Value(INT_TYPE, 1)])),
+                IfStmt(
+                    OpExpr(Label('ieq'), [VarExpr(n), Value(INT_TYPE, 2)]),
+                    BlockStmt([
+                        AssignStmt(VarExpr(y), VarExpr(x)),
+                        AssignStmt(AttrExpr(VarExpr(o), v), VarExpr(x))]),
+                    BlockStmt([])),
+                AssignStmt(VarExpr(n), OpExpr(Label('add'), [VarExpr(n), Value(INT_TYPE, 1)]))])),
+        AssignStmt(VarExpr(x), OpExpr(Label('add'), [VarExpr(x), Value(INT_TYPE, 10)])),
+        PrintStmt([VarExpr(x), VarExpr(y), AttrExpr(VarExpr(o), v)]),
+        VarEnd(n),
+        VarEnd(o),
+        VarEnd(y),
+        VarEnd(x)]))
+    tc_program(prog, Env())
+
+    def run(f, policy):
+        'output, node ids taken and nodes left'
+        i = NODE_FACTORY._cur_id
+        out = io.StringIO()
+        with redirect_stdout(out):
+            sg = f(prog, init_state_graph(), policy)
+        return (out.getvalue(), NODE_FACTORY._cur_id - i, len(sg.layout.nodes))
+
+    for policy in [Never(), EveryStmt(), EveryAllocs(3)]:
+        o1, i1, n1 = run(st_program, policy)
+        o2, i2, n2 = run(cc.run_program, policy)
+        print(policy.__class__.__name__, o2.strip())
+        assert o1 == o2 and i1 == i2
+        if type(policy) is Never:
+            assert n2 < n1
+
+    'every engine prints what st prints'
+    for program in [fig2_program, fig3_program, gcd_program]:
+        Cla.reset()
+        prog = program()
+        prog = prog if type(prog) is Program else prog[-1]
+        tc_program(prog, Env())
+        for policy in [Never(), EveryStmt()]:
+            ref = printed(st_program, prog, init_state_graph(), policy)
+            assert printed(cc.run_program, prog, init_state_graph(), policy) == ref
+            assert printed(vm.run_program, prog, init_state_graph(), policy) == ref
+        print(program.__name__, len(ref.splitlines()), 'lines')
+
+
+def test_string_ops():
+    print(
+'''
+----
+---- string ops ----
+----
+''')
+
+    Cla.reset()
+
+    assert OP_TAB[Label('upper')].f(Value(STR_TYPE, 'aBc')) == Value(STR_TYPE, 'ABC')
+    assert OP_TAB[Label('lower')].f(Value(STR_TYPE, 'aBc')) == Value(STR_TYPE, 'abc')
+
+    words = ['', 'a', 'ab', 'b', 'B']
+    for name, f in [('seq', '=='), ('sne', '!='), ('slt', '<'), ('sle', '<='), ('sgt', '>'), ('sge', '>=')]:
+        d = OP_TAB[Label(name)]
+        assert d.par_types == [STR_TYPE, STR_TYPE]
+        for x in words:
+            for y in words:
+                assert d.f(Value(STR_TYPE, x), Value(STR_TYPE, y)).value == eval('x ' + f + ' y')
+
+    a = Label('a')
+    b = Label('b')
+    s = Label('s')
+
+    prog = Program(BlockStmt([
+        VarDecl(s, STR_TYPE),
+        IfStmt(
+            OpExpr(Label('slt'), [VarExpr(a), VarExpr(b)]),
+            AssignStmt(VarExpr(s), OpExpr(Label('upper'), [VarExpr(a)])),
+            AssignStmt(VarExpr(s), OpExpr(Label('lower'), [VarExpr(b)]))),
+        PrintStmt([VarExpr(a), VarExpr(b), VarExpr(s), OpExpr(Label('seq'), [VarExpr(a), VarExpr(b)])]),
+        VarEnd(s)]))
+
+    env = tc_program(prog, Env(None, {a: STR_TYPE, b: STR_TYPE}))
+    records = [{a: Value(STR_TYPE, x), b: Value(STR_TYPE, y)} for x, y in [('ab', 'b'), ('Xy', 'Ab'), ('q', 'q')]]
+    scalar_program(prog, records)
+    batch_program(prog, records)
+
+    'integer operands no longer type as string comparisons'
+    try:
+        tc_program(Program(BlockStmt([PrintStmt([OpExpr(Label('slt'), [Value(INT_TYPE, 1), Value(INT_TYPE, 2)])])])), Env())
+        assert False
+    except OpArgTypeError:
+        pass
+
+def test_value_interner():
+    print(
+'''
+----
+---- value interner ----
+----
+''')
+
+    Cla.reset()
+
+    a = Label('a')
+    b = Label('b')
+
+    for incremental in [False, True]:
+        sg = init_state_graph(incremental, True)
+        r = sg.layout.root
+        zero = Value(INT_TYPE, 0)
+
+        'equal constants share one node and one singleton ValueSet'
+        p = box_value(sg, zero)
+        assert box_value(sg, Value(INT_TYPE, 0)) is p
+        assert box_value(sg, Value(INT_TYPE, 1)) is not p
+        pg = view_pattern(sg, p)
+        assert pg.types[p] is sg.layout.edges.consts.value_set(zero)
+
+        'a reachable interned node survives a collection and stays shared'
+        swing_state(sg, r, a, p)
+        sg = gc_state(sg)
+        assert p in sg.layout.nodes
+        assert box_value(sg, zero) is p
+
+        'once unreachable it is reclaimed, and interning it again adds a fresh node'
+        swing_state(sg, r, a, box_value(sg, Value(INT_TYPE, 2)))
+        sg = gc_state(sg)
+        assert p not in sg.layout.nodes
+        q = box_value(sg, zero)
+        assert q is not p and q in sg.layout.nodes and sg.values[q] == zero
+        swing_state(sg, r, b, q)
+        assert box_value(sg, zero) is q
+        print('incremental' if incremental else 'full', len(sg.values), 'value nodes')
+
+    'a loop over constants allocates each of them once'
+    n = Label('n')
+    prog = Program(BlockStmt([
+        VarDecl(n, INT_TYPE),
+        VarDecl(b, BOOL_TYPE),
+        AssignStmt(VarExpr(n), Value(INT_TYPE, 50)),
+        WhileStmt(
+            OpExpr(Label('igt'), [VarExpr(n), Value(INT_TYPE, 0)]),
+            BlockStmt([
+                AssignStmt(VarExpr(b), Value(BOOL_TYPE, True)),
+                AssignStmt(VarExpr(n), OpExpr(Label('sub'), [VarExpr(n), Value(INT_TYPE, 1)]))])),
+        VarEnd(b),
+        VarEnd(n)]))
+    tc_program(prog, Env())
+    plain = st_program(prog, init_state_graph(), Never())
+    interned = st_program(prog, init_state_graph(False, True), Never())
+    print('value nodes', len(plain.values), 'plain,', len(interned.values), 'interned')
+    assert len(interned.values) < len(plain.values)
+
+def test_query():
+    print(
+'''
+----
+---- query ----
+----
+''')
+
+    Cla.reset()
+
+    l = Label('l')
+    e = Label('e')
+    x = Label('x')
+    h = Label('h')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            e: INT_TYPE
+        }).resolve_lazy()
+
+    M = Cla(Tag('M'),
+        [],
+        {
+            l: N
+        })
+
+    sg = init_state_graph()
+    ns = []
+    for k in range(8):
+        p = add_object_to_state(sg, N)
+        swing_state(sg, p, e, add_value_to_state(sg, Value(INT_TYPE, k)))
+        if ns:
+            swing_state(sg, p, l, ns[-1])
+        ns.append(p)
+    ms = [add_object_to_state(sg, M) for k in range(4)]
+    for k, p in enumerate(ms):
+        swing_state(sg, p, l, ns[2*k])
+    swing_state(sg, sg.layout.root, h, ns[-1])
+    for p in ms:
+        sg = push_state(sg, SCOPE_LABEL)
+        swing_state(sg, sg.layout.root, h, p)
+
+    q1 = compile_query(LabeledPattern(x, ClassPattern(N, {e: IntRange(0, 1)})))
+    q2 = compile_query(ClassPattern(M, {l: ClassPattern(N, {e: IntRange(4, 9)})}))
+    q3 = compile_query(IntRange(6, 9))
+    index = index_state(sg)
+
+    'the class index keeps M objects, values and frames from being tried as N'
+    assert set(candidates(index, N, [e])) == set(ns)
+    assert set(candidates(index, M, [l])) == set(ms)
+    assert not set(candidates(index, INT_TYPE, [])) & set(ns + ms + frame_nodes(sg))
+    assert query(sg, q1, index) == [(p, [(x, p)]) for p in ns[:2]]
+    assert query(sg, q2, index) == [(p, []) for p in ms[2:]]
+    'null attributes view below the range too, the values in it are the last two'
+    assert [value_of(sg, p).value for p, bs in query(sg, q3, index) if p in sg.values] == [6, 7]
+
+    'the label index holds the sources of h, the frames, of which none is an N'
+    assert index.by_label[h] == set(frame_nodes(sg))
+    assert candidates(index, N, [h]) == []
+
+    'the maintained index answers as a fresh scan after swings and a collection'
+    swing_state(sg, ms[0], l, ns[7])
+    swing_state(sg, ns[5], e, add_value_to_state(sg, Value(INT_TYPE, 0)))
+    sg = gc_state(sg)
+    for q in [q1, q2, q3]:
+        assert query(sg, q, index) == query(sg, q)
+    assert query(sg, q1, index) == [(p, [(x, p)]) for p in [ns[0], ns[1], ns[5]]]
+    assert query(sg, q2, index) == [(p, []) for p in [ms[0], ms[2], ms[3]]]
+    print([len(query(sg, q, index)) for q in [q1, q2, q3]])
+
+def test_graph_index():
+    print(
+'''
+----
+---- graph index ----
+----
+''')
+
+    Cla.reset()
+
+    l = Label('l')
+    r = Label('r')
+    e = Label('e')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            r: N_lz,
+            e: INT_TYPE
+        }).resolve_lazy()
+
+    'a, b and c in a cycle over l, with r edges from a and b into c'
+    sg = init_state_graph()
+    idx = index_state(sg)
+    a, b, c = [add_object_to_state(sg, N) for k in range(3)]
+    swing_state(sg, a, l, b)
+    swing_state(sg, b, l, c)
+    swing_state(sg, c, l, a)
+    swing_state(sg, a, r, c)
+    swing_state(sg, b, r, c)
+    v = add_value_to_state(sg, Value(INT_TYPE, 1))
+    swing_state(sg, c, e, v)
+    assert idx.sources(c) == {(b, l), (a, r), (b, r)}
+    assert idx.sources(v) == {(c, e)}
+    assert idx.by_type[N] == {a, b, c} and idx.types[v] is INT_TYPE
+    assert idx.by_label[e] == {a, b, c} and idx.by_label[l] == {a, b, c}
+    assert idx.reaching([v]) == {a, b, c, v}
+
+    'a swing moves the reverse edge, the old target loses it'
+    swing_state(sg, b, r, a)
+    assert idx.sources(c) == {(b, l), (a, r)}
+    assert (b, r) in idx.sources(a)
+
+    'a collection renumbers nothing in a dict graph, and drops the edges of the freed'
+    swing_state(sg, sg.layout.root, Label('h'), c)
+    swing_state(sg, c, l, c)
+    sg = gc_state(sg)
+    assert a not in idx.types and b not in idx.types
+    assert idx.sources(c) == {(c, l), (sg.layout.root, Label('h'))}
+    assert idx.reaching([v]) == {sg.layout.root, c, v}
+
+    ps = [add_object_to_state(sg, N) for k in range(6)]
+    for p in ps:
+        swing_state(sg, p, l, ps[0])
+
+    def fields(idx):
+        return (idx.rev, idx.types, {t: ps for t, ps in idx.by_type.items() if ps}, {la: ps for la, ps in idx.by_label.items() if ps})
+
+    'swings the index does not see are picked up by a reset'
+    unwatch_state(sg, idx)
+    idx = GraphIndex(sg.layout, sg.types)
+    for i, p in enumerate(ps):
+        swing_state(sg, p, r, ps[-1-i])
+    assert fields(idx) != fields(GraphIndex(sg.layout, sg.types))
+    idx.reset()
+    assert fields(idx) == fields(GraphIndex(sg.layout, sg.types))
+
+    'a collection builds a new layout, which the reset is given'
+    swing_state(sg, sg.layout.root, Label('h'), ps[0])
+    sg = gc_state(sg)
+    idx.reset(sg.layout, sg.types)
+    assert fields(idx) == fields(GraphIndex(sg.layout, sg.types))
+    assert set(idx.types) == set(sg.types)
+
+    'the default type map is not shared between indexes'
+    assert GraphIndex(sg.layout).tm is not GraphIndex(sg.layout).tm
+
+    'labels aliasing a forward reference follow it to the labeled node'
+    x = Label('x')
+    y = Label('y')
+    g, tm, rm = cons_pattern_graph(LabeledPattern(x, ClassPattern(N, {l: LabeledPattern(y, PatternRef(x)), r: PatternRef(y)})))
+    assert rm[x] is g.root and rm[y] is g.root
+    assert g.edges.targets[(g.root, l)] is g.root and g.edges.targets[(g.root, r)] is g.root
+    assert rm.inv[g.root] == [x, y] or rm.inv[g.root] == [y, x]
+    print(len(idx.types), 'typed nodes after gc')
+
+def test_rete_flush():
+    print(
+'''
+----
+---- rete flush ----
+----
+''')
+
+    Cla.reset()
+
+    l = Label('l')
+    e = Label('e')
+    x = Label('x')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            e: INT_TYPE
+        }).resolve_lazy()
+
+    sg = init_state_graph()
+    def node(k):
+        p = add_object_to_state(sg, N)
+        swing_state(sg, p, e, add_value_to_state(sg, Value(INT_TYPE, k)))
+        swing_state(sg, sg.layout.root, Label('h{}'.format(p.id)), p)
+        return p
+    a, b, c, d = node(0), node(1), node(0), node(2)
+    others = [node(7) for k in range(10)]
+    swing_state(sg, a, l, b)
+    swing_state(sg, c, l, d)
+
+    'a payload one edge below the root, and a cycle of two back to it'
+    big = compile_query(LabeledPattern(x, ClassPattern(N, {l: ClassPattern(N, {e: IntRange(5, 9)})})))
+    loop = compile_query(LabeledPattern(x, ClassPattern(N, {l: ClassPattern(N, {l: PatternRef(x)})})))
+    net = ReteNetwork(sg)
+    events = []
+    def on_match(tag):
+        return (lambda p, bs: events.append((tag, '+', p)), lambda p: events.append((tag, '-', p)))
+    prs = [net.register(sg, q, *on_match(tag)) for tag, q in [('big', big), ('loop', loop)]]
+    assert events == [] and all(pr.matches == {} for pr in prs)
+
+    'each swing starts or stops matches, found from the swung edge alone'
+    v = add_value_to_state(sg, Value(INT_TYPE, 7))
+    for p, la, q, expected in [
+        (b, e, v, [('big', '+', a)]),
+        (a, l, c, [('big', '-', a)]),
+        (d, l, c, [('loop', '+', c), ('loop', '+', d)]),
+        (d, l, a, [('loop', '-', c), ('loop', '-', d)]),
+        (c, e, v, [('big', '+', a)])]:
+        swing_state(sg, p, la, q)
+        assert not any(pr.dirty & set(others) for pr in prs)
+        del events[:]
+        net.flush(sg)
+        assert sorted(events, key = lambda ev: (ev[0], ev[2].id)) == expected
+        for pr, q2 in zip(prs, [big, loop]):
+            assert pr.matches == dict(query(sg, q2))
+        print([len(pr.matches) for pr in prs])
+
+    'a collection that frees matching roots stops their matches'
+    swing_state(sg, d, l, c)
+    swing_state(sg, a, l, b)
+    net.flush(sg)
+    del events[:]
+    swing_state(sg, sg.layout.root, Label('h{}'.format(c.id)), a)
+    swing_state(sg, sg.layout.root, Label('h{}'.format(d.id)), a)
+    sg = gc_state(sg)
+    net.flush(sg)
+    assert sorted(events, key = lambda ev: (ev[0], ev[2].id)) == [('big', '-', d), ('loop', '-', c), ('loop', '-', d)]
+    assert all(pr.matches == dict(query(sg, q2)) for pr, q2 in zip(prs, [big, loop]))
+
+    'a reset rescans and marks every root, the matches stay the same'
+    before = [dict(pr.matches) for pr in prs]
+    net.reset(sg.layout, sg.types)
+    assert all(pr.dirty for pr in prs)
+    net.flush(sg)
+    assert [pr.matches for pr in prs] == before
+
+def test_persistent():
+    print(
+'''
+----
+---- persistent ----
+----
+''')
+
+    Cla.reset()
+
+    l = Label('l')
+    r = Label('r')
+    a = Label('a')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            r: N_lz
+        }).resolve_lazy()
+
+    'forks are snapshots, each side changes without the other seeing it'
+    sg = init_persistent_state_graph()
+    p = add_object_to_state(sg, N)
+    swing_state(sg, sg.layout.root, a, p)
+    sg2 = sg.fork()
+    q = add_object_to_state(sg2, N)
+    swing_state(sg2, p, l, q)
+    assert q not in sg.layout.nodes and sg.layout.edges.targets[(p, l)] is not q
+    assert sg2.layout.edges.targets[(p, l)] is q
+
+    'a fork of a fork keeps what the first fork had when it was taken'
+    sg3 = sg2.fork()
+    swing_state(sg2, p, l, p)
+    assert sg3.layout.edges.targets[(p, l)] is q and sg2.layout.edges.targets[(p, l)] is p
+    assert sg.layout.edges.targets[(p, l)] not in (p, q)
+
+    'depth picks the frame, past shadowing bindings'
+    for k in range(3):
+        sg = push_state(sg, SCOPE_LABEL)
+        swing_state(sg, sg.layout.root, a, add_value_to_state(sg, Value(INT_TYPE, k)))
+    for d in range(3):
+        assert value_of(sg, find_var_at(sg, SCOPE_LABEL, a, d)).value == 2 - d
+    assert find_var_at(sg, SCOPE_LABEL, a, 3) is p
+    assert value_of(sg, find_var_at(sg, SCOPE_LABEL, a, None)).value == 2
+    lv = find_lvar_at(sg, SCOPE_LABEL, a, 1)
+    sg = pop_state(sg, SCOPE_LABEL, False)
+    assert value_of(sg, find_var_at(sg, SCOPE_LABEL, a, 0)).value == 1
+    assert find_lvar_at(sg, SCOPE_LABEL, a, 0) == lv
+
+    'a collection frees exactly the unreachable nodes'
+    class Freed(Watcher):
+        def __init__(self):
+            self.ps = set()
+
+        def freed(self, p, out):
+            self.ps.add(p)
+
+    'a chain off the root, with an edge back into it, cut twice'
+    w = Freed()
+    watch_state(sg, w)
+    ps = [add_object_to_state(sg, N) for i in range(8)]
+    swing_state(sg, sg.layout.root, Label('h'), ps[0])
+    for p1, p2 in zip(ps, ps[1:]):
+        swing_state(sg, p1, l, p2)
+    swing_state(sg, ps[7], r, ps[3])
+    for k, tail in [(5, ps[5:]), (2, ps[2:5])]:
+        swing_state(sg, ps[k-1], l, ps[k-1])
+        live = gc_layout(sg.layout).nodes
+        garbage = set(sg.layout.nodes) - live
+        w.ps.clear()
+        sg = gc_state(sg)
+        assert w.ps == garbage and set(sg.layout.nodes) == live
+        assert set(ps) & w.ps == set(tail)
+        print(k, len(garbage), 'freed of', len(live) + len(garbage))
+
+    'a match no case takes leaves the state, and its watchers, as they were'
+    x = Label('x')
+    def match_prog(n):
+        return Program(BlockStmt([
+            MatchStmt(Value(INT_TYPE, n), [
+                Case(LabeledPattern(x, IntRange(0, 1)), PrintStmt([Value(STR_TYPE, 'small'), VarExpr(x)]), Extra())])]))
+
+    for run in [st_program, cc.run_program, vm.run_program]:
+        for n, grows in [(5, False), (0, True)]:
+            prog = match_prog(n)
+            tc_program(prog, Env())
+            sg = init_persistent_state_graph()
+            idx = index_state(sg)
+            ns = set(sg.layout.nodes)
+            sg = run(prog, sg, Never())
+            assert (set(sg.layout.nodes) != ns) == grows
+            assert set(idx.types) == set(sg.types)
+
+            'plain state graphs have no forks and keep the boxed scrutinee'
+            sg = init_state_graph()
+            n0 = len(sg.layout.nodes)
+            sg = run(prog, sg, Never())
+            assert len(sg.layout.nodes) > n0
+
+def test_checkpoint():
+    print(
+'''
+----
+---- checkpoint ----
+----
+''')
+
+    Cla.reset()
+
+    l = Label('l')
+    e = Label('e')
+    t = Label('t')
+    b = Label('b')
+    a = Label('a')
+    x = Label('x')
+
+    N_lz = Lazy(Tag('N'))
+
+    N = Cla(N_lz.tag,
+        [],
+        {
+            l: N_lz,
+            e: INT_TYPE,
+            t: STR_TYPE,
+            b: BOOL_TYPE
+        }).resolve_lazy()
+
+    'ints past int64 are written as decimal strings'
+    big = 1 << 70
+    values = [Value(INT_TYPE, k) for k in [0, -1, (1 << 63) - 1, -(1 << 63), 1 << 63, big, -big]]
+    values += [Value(STR_TYPE, w) for w in ['', 'apple', 'pr\u00fcfen']]
+    values += [Value(BOOL_TYPE, w) for w in [False, True]]
+
+    'every kind of constraint, with big and open bounds'
+    pattern = LabeledPattern(x, ClassPattern(N, {
+        e: IntRange(-big, None),
+        t: StrPrefix('ap'),
+        b: BoolConst(True),
+        l: ClassPattern(N, {e: ValueSet({Value(INT_TYPE, big), Value(INT_TYPE, -1)})})}))
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'values.ck')
+        sg = init_state_graph()
+        qs = [add_value_to_state(sg, v) for v in values]
+        for k, q in enumerate(qs):
+            swing_state(sg, sg.layout.root, Label('v{}'.format(k)), q)
+        save_state(path, sg)
+        sg2 = load_state(path)
+        mg = open_state(path)
+        assert [sg2.values[q] for q in qs] == values
+        assert [mg.values[q] for q in qs] == values
+        assert all(mg.types[q] is v.cla for q, v in zip(qs, values))
+        mg.close()
+
+        'objects the pattern matches, and misses by one attribute each'
+        def node(k, w, y, q = None):
+            p = add_object_to_state(sg, N)
+            for la, v in [(e, Value(INT_TYPE, k)), (t, Value(STR_TYPE, w)), (b, Value(BOOL_TYPE, y))]:
+                swing_state(sg, p, la, add_value_to_state(sg, v))
+            if q is not None:
+                swing_state(sg, p, l, q)
+            return p
+        c = node(big, 'x', False)
+        ps = [node(1 << 64, 'apple', True, c), node(-big - 1, 'apple', True, c),
+            node(0, 'bat', True, c), node(0, 'ap', False, c), node(0, 'ap', True, node(big - 1, 'x', False))]
+        for k, p in enumerate(ps):
+            swing_state(sg, sg.layout.root, Label('p{}'.format(k)), p)
+
+        q = compile_query(pattern)
+        save_query(path, q)
+        q2 = load_query(path)
+        assert q2.graph.types == q.graph.types and q2.refs == q.refs
+        assert query(sg, q2) == query(sg, q) == [(ps[0], [(x, ps[0])])]
+
+        'the loaded state matches as the saved one did'
+        save_state(path, sg)
+        sg2 = load_state(path)
+        mg = open_state(path)
+        assert query(sg2, q2) == query(mg, q2) == query(sg, q)
+        mg.close()
+        print(len(values), 'values', len(q.graph.types), 'pattern nodes')
+
+        path = os.path.join(d, 'state.ck')
+        path = os.path.join(d, 'state.ck')
+        for init in [init_state_graph, init_compact_state_graph, init_persistent_state_graph]:
+            sg = init()
+            p = add_object_to_state(sg, N)
+            swing_state(sg, sg.layout.root, a, p)
+            for k in range(3):
+                sg = push_state(sg, SCOPE_LABEL)
+                q = add_value_to_state(sg, Value(INT_TYPE, big + k))
+                swing_state(sg, sg.layout.root, a, q)
+                swing_state(sg, p, e, q)
+            frames = frame_nodes(sg)
+            assert len(frames) == 4 and frames[-1] == sg.layout.root
+
+            'the frames are written for every kind of state graph'
+            save_state(path, sg)
+            sg2 = load_state(path)
+            assert frame_nodes(sg2) == frames
+            for k in range(4):
+                assert find_var_at(sg2, SCOPE_LABEL, a, k) == find_var_at(sg, SCOPE_LABEL, a, k)
+
+            'edges of a mapped graph are looked up per node'
+            mg = open_state(path)
+            assert frame_nodes(mg) == frames
+            ts = mg.layout.edges.targets
+            assert ts[(p, e)] == sg.layout.edges.targets[(p, e)]
+            assert value_of(mg, ts[(p, e)]).value == big + 2
+            assert ts.get((p, Label('missing'))) is None and (p, a) not in ts
+            mg.close()
+            print(init.__name__, len(sg2.layout.nodes), 'nodes', len(frames), 'frames')
+
+def printed(run, *args):
+    'what run(*args) prints'
+    out = io.StringIO()
+    with redirect_stdout(out):
+        run(*args)
+    return out.getvalue()
+
+def test_match_backends():
+    print(
+'''
+----
+---- match backends ----
+----
+''')
+
+    'match programs print the same on every state graph and every engine'
+    for program in [fig2_program, fig3_program]:
+        Cla.reset()
+        prog = program()[-1]
+        tc_program(prog, Env())
+        ref = printed(st_program, prog, init_state_graph())
+        for init in [init_state_graph, init_compact_state_graph, init_persistent_state_graph]:
+            for run in [st_program, cc.run_program, vm.run_program]:
+                assert printed(run, prog, init()) == ref
+        print(program.__name__, len(ref.splitlines()), 'lines')
 
 if __name__ == '__main__':
     test_subtype()
     test_fig2()
     test_fig3()
     test_gcd()
+    test_incremental_gc()
+    test_value_constraints()
+    test_batch()
+    test_gc_policies()
+    test_compact_gc()
+    test_deep_match()
+    test_pattern_view()
+    test_compiled_match()
+    test_decision_tree()
+    test_junction_bindings()
+    test_match_cache()
+    test_tag_masks()
+    test_hash_cons()
+    test_ty_inf()
+    test_ty_sup()
+    test_var_depths()
+    test_symbol_table()
+    test_compiled_programs()
+    test_string_ops()
+    test_value_interner()
+    test_query()
+    test_graph_index()
+    test_rete_flush()
+    test_persistent()
+    test_checkpoint()
+    test_match_backends()
 
 
 ##
@@ -0,0 +1,452 @@
+'''
+    ----
+    (c) 2021 Wei Ke & Ka-Hou Chan
+    license:          GPL-3
+    license-file:     LICENSE
+    ----
+
+    register bytecode for type-checked programs
+
+'''
+
+from array import array
+
+from subtype import (
+    Value,
+    ValueSet,
+    subtype)
+
+from graph import (
+    push_state,
+    pop_state,
+    add_object_to_state,
+    swing_state,
+    find_var_at,
+    find_lvar_at,
+    find_attr,
+    find_lattr,
+    value_of,
+    box_value,
+    fork_state,
+    join_state)
+
+from pattern import (
+    PatternConj,
+    PatternDisj,
+    MatchStmt)
+
+from asx import (
+    AssignStmt,
+    IfStmt,
+    WhileStmt,
+    PrintStmt,
+    BlockStmt,
+    VarDecl,
+    VarEnd,
+    VarExpr,
+    AttrExpr,
+    OpExpr,
+    NewExpr,
+    AndExpr,
+    OrExpr)
+
+from op import get_op
+
+from gcpolicy import (
+    STMT_EVENT,
+    BLOCK_EVENT,
+    SCOPE_EVENT)
+
+from st import (
+    SCOPE_LABEL,
+    collect,
+    node_str,
+    run_interp,
+    st_var_decl,
+    st_var_end)
+
+'opcode operands'
+OP_VALUE = 0        # dst, value
+OP_NEW = 1          # dst, cla
+OP_VAR = 2          # dst, label, depth
+OP_ATTR = 3         # dst, src, label
+OP_CALL = 4         # dst, op, n, src * n
+OP_BINOP = 5        # dst, vf, cla, src, src
+OP_MOVE = 6         # dst, src
+OP_JUMP = 7         # target
+OP_JNTRUE = 8       # src, target
+OP_JNFALSE = 9      # src, target
+OP_SETVAR = 10      # label, depth, src
+OP_SETATTR = 11     # obj, label, src
+OP_COLLECT = 12     # event
+OP_PRINT = 13       # n, src * n
+OP_DECL = 14        # var decl
+OP_END = 15         # var end
+OP_TYPE = 16        # src, type, fail
+OP_EDGE = 17        # dst, src, label, fail
+OP_SAME = 18        # src, label, src, fail
+OP_DISTINCT = 19    # fail, n, src * n
+OP_BIND = 20        # label, src
+OP_ENTER = 21
+OP_LEAVE = 22
+OP_BOX = 23         # src
+OP_HALT = 24
+OP_FORK = 25
+OP_JOIN = 26        # keep
+
+OP_NAMES = {v: k for k, v in globals().items() if k.startswith('OP_')}
+
+class Compiler:
+    def __init__(self):
+        self.code = array('i')
+        self.consts = []
+        self.const_ids = {}
+        self.nregs = 0
+
+    def const(self, x):
+        k = self.const_ids.get(id(x))
+        if k is None:
+            k = len(self.consts)
+            self.const_ids[id(x)] = k
+            self.consts.append(x)
+        return k
+
+    def reg(self):
+        self.nregs += 1
+        return self.nregs - 1
+
+    def emit(self, *xs):
+        'labels among the operands are jump targets, patched when placed'
+        for x in xs:
+            if type(x) is list:
+                x.append(len(self.code))
+                self.code.append(-1)
+            else:
+                self.code.append(x)
+
+    def label(self):
+        return []
+
+    def place(self, lab):
+        for i in lab:
+            self.code[i] = len(self.code)
+
+    def expr(self, x):
+        if type(x) is Value:
+            r = self.reg()
+            self.emit(OP_VALUE, r, self.const(x))
+        elif type(x) is VarExpr:
+            r = self.reg()
+            d = x.depth
+            self.emit(OP_VAR, r, self.const(x.label), -1 if d is None else d)
+        elif type(x) is AttrExpr:
+            src = self.expr(x.expr)
+            r = self.reg()
+            self.emit(OP_ATTR, r, src, self.const(x.label))
+        elif type(x) is OpExpr:
+            d = get_op(x.op)
+            srcs = [self.expr(arg) for arg in x.args]
+            r = self.reg()
+            if d.vf is not None and len(srcs) == 2:
+                self.emit(OP_BINOP, r, self.const(d.vf), self.const(d.res_type), *srcs)
+            else:
+                self.emit(OP_CALL, r, self.const(d.f), len(srcs), *srcs)
+        elif type(x) is NewExpr:
+            r = self.reg()
+            self.emit(OP_NEW, r, self.const(x.cla))
+        else:
+            r = self.expr(x.left)
+            done = self.label()
+            self.emit(OP_JNTRUE if type(x) is AndExpr else OP_JNFALSE, r, done)
+            self.emit(OP_MOVE, r, self.expr(x.right))
+            self.place(done)
+        return r
+
+    def stmt(self, s):
+        if type(s) is VarDecl:
+            self.emit(OP_DECL, self.const(s))
+        elif type(s) is VarEnd:
+            self.emit(OP_END, self.const(s))
+        elif type(s) is AssignStmt:
+            lx, x = s
+            if type(lx) is VarExpr:
+                src = self.expr(x)
+                d = lx.depth
+                self.emit(OP_SETVAR, self.const(lx.label), -1 if d is None else d, src)
+            else:
+                obj = self.expr(lx.expr)
+                src = self.expr(x)
+                self.emit(OP_SETATTR, obj, self.const(lx.label), src)
+            self.emit(OP_COLLECT, self.const(STMT_EVENT))
+        elif type(s) is IfStmt:
+            els = self.label()
+            done = self.label()
+            self.emit(OP_JNTRUE, self.expr(s.expr), els)
+            self.stmt(s.then_stmt)
+            self.emit(OP_JUMP, done)
+            self.place(els)
+            self.stmt(s.else_stmt)
+            self.place(done)
+        elif type(s) is WhileStmt:
+            top = len(self.code)
+            done = self.label()
+            self.emit(OP_JNTRUE, self.expr(s.expr), done)
+            self.stmt(s.stmt)
+            self.emit(OP_JUMP, top)
+            self.place(done)
+            self.emit(OP_COLLECT, self.const(STMT_EVENT))
+        elif type(s) is PrintStmt:
+            srcs = [self.expr(x) for x in s.args]
+            self.emit(OP_PRINT, len(srcs), *srcs)
+        elif type(s) is BlockStmt:
+            for s2 in s.stmts:
+                self.stmt(s2)
+            self.emit(OP_COLLECT, self.const(BLOCK_EVENT))
+        elif type(s) is MatchStmt:
+            self.match(s)
+
+    def pattern(self, pg, src, fail):
+        'the tests of mc.pattern_source, returns the register of each pattern node'
+        (ns, es, p), tm = pg
+        regs = {p: src}
+        stack = [p]
+        while stack:
+            u = stack.pop()
+            v = regs[u]
+            self.emit(OP_TYPE, v, self.const(tm[u]), fail)
+            for la in es.labels[u]:
+                q = es.targets[(u, la)]
+                if q in regs:
+                    self.emit(OP_SAME, v, self.const(la), regs[q], fail)
+                else:
+                    regs[q] = self.reg()
+                    self.emit(OP_EDGE, regs[q], v, self.const(la), fail)
+                    stack.append(q)
+
+        if len(regs) > 1:
+            self.emit(OP_DISTINCT, fail, len(regs), *regs.values())
+        return regs
+
+    def match(self, s):
+        'as st.fork_match, the scrutinee is boxed on a fork joined once a case is known'
+        x, cas = s
+        self.emit(OP_FORK)
+        src = self.expr(x)
+        self.emit(OP_BOX, src)
+        done = self.label()
+        for junc, s2, extra in cas:
+            fail = self.label()
+            if type(junc) is PatternConj:
+                pgs, fs, rms, ms, bt = extra.get()
+                regs = [self.pattern(pg, src, fail) for pg in pgs]
+                for la, k, u in bt:
+                    self.emit(OP_BIND, self.const(la), regs[k][u])
+            elif type(junc) is PatternDisj:
+                pgs, fs, rms, ms, bts = extra.get()
+                bound = self.label()
+                for pg, bt in zip(pgs, bts):
+                    alt = self.label()
+                    regs = self.pattern(pg, src, alt)
+                    for la, u in bt:
+                        self.emit(OP_BIND, self.const(la), regs[u])
+                    self.emit(OP_JUMP, bound)
+                    self.place(alt)
+                self.emit(OP_JUMP, fail)
+                self.place(bound)
+            else:
+                pg, rm, m = extra.get()
+                regs = self.pattern(pg, src, fail)
+                for la, q in rm.items():
+                    self.emit(OP_BIND, self.const(la), regs[q])
+            self.emit(OP_JOIN, 1)
+            self.emit(OP_ENTER)
+            self.stmt(s2)
+            self.emit(OP_LEAVE)
+            self.emit(OP_JUMP, done)
+            self.place(fail)
+        self.emit(OP_JOIN, 0)
+        self.place(done)
+
+class Bytecode:
+    def __init__(self, prog):
+        c = Compiler()
+        c.stmt(prog.block)
+        c.emit(OP_HALT)
+        self.code = c.code
+        self.consts = c.consts
+        self.nregs = c.nregs
+        self.executed = 0
+
+    def dump(self):
+        code = self.code
+        i = 0
+        while i < len(code):
+            op = code[i]
+            n = OPERANDS[op]
+            if n < 0:
+                n = code[i-n] - n
+            print('{:5} {:12} {}'.format(i, OP_NAMES[op][3:], list(code[i+1:i+1+n])))
+            i += 1 + n
+
+    def run(self, sg, ip):
+        code = self.code
+        consts = self.consts
+        regs = [None] * self.nregs
+        binds = []
+        sg0 = None
+        pc = 0
+        steps = 0
+        while True:
+            op = code[pc]
+            steps += 1
+            if op == OP_VAR:
+                d = code[pc+3]
+                regs[code[pc+1]] = find_var_at(sg, SCOPE_LABEL, consts[code[pc+2]], None if d < 0 else d)
+                pc += 4
+            elif op == OP_VALUE:
+                regs[code[pc+1]] = consts[code[pc+2]]
+                pc += 3
+            elif op == OP_BINOP:
+                x = regs[code[pc+4]]
+                y = regs[code[pc+5]]
+                if type(x) is not Value:
+                    x = sg.values[x]
+                if type(y) is not Value:
+                    y = sg.values[y]
+                regs[code[pc+1]] = Value(consts[code[pc+3]], consts[code[pc+2]](x.value, y.value))
+                pc += 6
+            elif op == OP_SETVAR:
+                d = code[pc+2]
+                p, la = find_lvar_at(sg, SCOPE_LABEL, consts[code[pc+1]], None if d < 0 else d)
+                swing_state(sg, p, la, box_value(sg, regs[code[pc+3]]))
+                pc += 4
+            elif op == OP_COLLECT:
+                sg = collect(sg, consts[code[pc+1]], ip)
+                pc += 2
+            elif op == OP_JNTRUE:
+                if value_of(sg, regs[code[pc+1]]).value != True:
+                    pc = code[pc+2]
+                else:
+                    pc += 3
+            elif op == OP_JUMP:
+                pc = code[pc+1]
+            elif op == OP_ATTR:
+                regs[code[pc+1]] = find_attr(sg, regs[code[pc+2]], consts[code[pc+3]])
+                pc += 4
+            elif op == OP_SETATTR:
+                p, la = find_lattr(sg, regs[code[pc+1]], consts[code[pc+2]])
+                swing_state(sg, p, la, box_value(sg, regs[code[pc+3]]))
+                pc += 4
+            elif op == OP_TYPE:
+                p = regs[code[pc+1]]
+                if p in sg.values:
+                    interned = sg.layout.edges.consts
+                    t = ValueSet({sg.values[p]}) if interned is None else interned.value_set(sg.values[p])
+                else:
+                    t = sg.types[p]
+                if subtype(t, consts[code[pc+2]]):
+                    pc += 4
+                else:
+                    pc = code[pc+3]
+            elif op == OP_EDGE:
+                p = regs[code[pc+2]]
+                la = consts[code[pc+3]]
+                es = sg.layout.edges
+                if la in es.labels[p]:
+                    regs[code[pc+1]] = es.targets[(p, la)]
+                    pc += 5
+                else:
+                    pc = code[pc+4]
+            elif op == OP_SAME:
+                p = regs[code[pc+1]]
+                la = consts[code[pc+2]]
+                es = sg.layout.edges
+                if la in es.labels[p] and es.targets[(p, la)] == regs[code[pc+3]]:
+                    pc += 5
+                else:
+                    pc = code[pc+4]
+            elif op == OP_DISTINCT:
+                n = code[pc+2]
+                ps = [regs[r] for r in code[pc+3:pc+3+n]]
+                if len(set(ps)) == n:
+                    pc += n + 3
+                else:
+                    pc = code[pc+1]
+            elif op == OP_BIND:
+                binds.append((consts[code[pc+1]], regs[code[pc+2]]))
+                pc += 3
+            elif op == OP_ENTER:
+                sg = push_state(sg, SCOPE_LABEL)
+                for la, q in binds:
+                    swing_state(sg, sg.layout.root, la, q)
+                binds = []
+                pc += 1
+            elif op == OP_LEAVE:
+                sg = collect(pop_state(sg, SCOPE_LABEL, False), SCOPE_EVENT, ip)
+                pc += 1
+            elif op == OP_JNFALSE:
+                if value_of(sg, regs[code[pc+1]]).value != False:
+                    pc = code[pc+2]
+                else:
+                    pc += 3
+            elif op == OP_MOVE:
+                regs[code[pc+1]] = regs[code[pc+2]]
+                pc += 3
+            elif op == OP_CALL:
+                n = code[pc+3]
+                args = [value_of(sg, regs[r]) for r in code[pc+4:pc+4+n]]
+                regs[code[pc+1]] = consts[code[pc+2]](*args)
+                pc += n + 4
+            elif op == OP_BOX:
+                regs[code[pc+1]] = box_value(sg, regs[code[pc+1]])
+                pc += 2
+            elif op == OP_FORK:
+                sg0 = sg
+                sg = fork_state(sg)
+                pc += 1
+            elif op == OP_JOIN:
+                sg = join_state(sg0, sg, code[pc+1] != 0)
+                sg0 = None
+                pc += 2
+            elif op == OP_NEW:
+                regs[code[pc+1]] = add_object_to_state(sg, consts[code[pc+2]])
+                pc += 3
+            elif op == OP_PRINT:
+                n = code[pc+1]
+                print(', '.join([node_str(sg, regs[r]) for r in code[pc+2:pc+2+n]]))
+                pc += n + 2
+            elif op == OP_DECL:
+                sg = st_var_decl(consts[code[pc+1]], sg, ip)
+                pc += 2
+            elif op == OP_END:
+                sg = st_var_end(consts[code[pc+1]], sg, ip)
+                pc += 2
+            else:
+                break
+
+        self.executed += steps
+        return sg
+
+'operand counts, negative -k when the count is k plus the operand at k'
+OPERANDS = {
+    OP_VALUE: 2, OP_NEW: 2, OP_VAR: 3, OP_ATTR: 3, OP_CALL: -3, OP_BINOP: 5,
+    OP_MOVE: 2, OP_JUMP: 1, OP_JNTRUE: 2, OP_JNFALSE: 2, OP_SETVAR: 3,
+    OP_SETATTR: 3, OP_COLLECT: 1, OP_PRINT: -1, OP_DECL: 1, OP_END: 1,
+    OP_TYPE: 3, OP_EDGE: 4, OP_SAME: 4, OP_DISTINCT: -2, OP_BIND: 2,
+    OP_ENTER: 0, OP_LEAVE: 0, OP_BOX: 1, OP_HALT: 0, OP_FORK: 0, OP_JOIN: 1}
+
+def vm_program(prog):
+    'compiled once per program, after type checking'
+    extra = prog.extra
+    if extra.bytecode is None:
+        extra.bytecode = Bytecode(prog)
+    return extra.bytecode
+
+def run_program(prog, sg, policy = None, cache = None):
+    'st_program on the bytecode, cache is ignored as matching is compiled inline'
+    return run_interp(vm_program(prog).run, sg, policy)
+
+
+##
+## end of vm.py
+##$Id$